@@ -0,0 +1,371 @@
+#!/usr/bin/python3
+
+import collections
+import concurrent.futures
+import fnmatch
+import logging
+import multiprocessing
+import os
+import queue
+import stat
+import struct
+import threading
+import time
+import zlib
+
+from compression import INCOMPRESSIBLE
+
+
+ZIP64_LIMIT = 0xffffffff
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+FLAG_UTF8 = 0x0800
+
+
+def dosTime(mtime):
+    """Return (time, date) in MS-DOS format for {mtime}."""
+    t = time.localtime(mtime)
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1
+    return ((t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+            ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday)
+
+
+class Entry(object):
+    """Central directory record of a written member."""
+
+    def __init__(self, name, mode, mtime):
+        self.name = name.encode()
+        self.mode = mode
+        self.time, self.date = dosTime(mtime)
+        self.method = ZIP_STORED
+        self.crc = 0
+        self.csize = 0
+        self.usize = 0
+        self.offset = 0
+        self.data = 0
+
+
+def deflate(path, level):
+    """Compress the file {path} in a worker process. Returns its CRC,
+size and raw deflate data.
+"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    crc = 0
+    usize = 0
+    chunks = list()
+    with open(path, 'rb') as handle:
+        while True:
+            chunk = handle.read(1 << 20)
+            if not chunk:
+                break
+            usize += len(chunk)
+            crc = zlib.crc32(chunk, crc)
+            chunks.append(compressor.compress(chunk))
+    chunks.append(compressor.flush())
+    return crc, usize, b''.join(chunks)
+
+
+class ZipWriter(object):
+    """Minimal ZIP64-capable writer that deflates each blob only once.
+Members sharing an inode, e.g. hardlinks created by the content store or by
+snapshots, reuse the compressed bytes of the first copy. Writing a name
+again replaces the earlier member.
+
+Files are deflated with {level}; 0 and already compressed formats, see
+compression.INCOMPRESSIBLE, are stored. With more than one of {workers},
+files below {large} bytes are deflated on a process pool while earlier
+members are written. The members keep the order they were added in.
+
+with ZipWriter('out.zip') as zw:
+    zw.write('/path/to/file', 'S01/file')
+"""
+
+    def __init__(self, path, level=6, workers=1, large=64 << 20):
+        self.fp = open(path, 'w+b')
+        self.level = level
+        self.large = large
+        self.entries = dict()
+        self.blobs = dict()
+        self.seen = set()
+        self.pending = collections.deque()
+        self.pool = None
+        self.window = 0
+        if workers > 1:
+            # forking a threaded process may copy held locks
+            self.pool = concurrent.futures.ProcessPoolExecutor(
+                workers, multiprocessing.get_context('forkserver'))
+            self.window = 2 * workers
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def localHeader(self, entry, zip64):
+        extra = b''
+        csize, usize = entry.csize, entry.usize
+        if zip64:
+            extra = struct.pack('<HHQQ', 1, 16, entry.usize, entry.csize)
+            csize = usize = ZIP64_LIMIT
+        header = struct.pack(
+            '<IHHHHHIIIHH', 0x04034b50, 45 if zip64 else 20, FLAG_UTF8,
+            entry.method, entry.time, entry.date, entry.crc, csize, usize,
+            len(entry.name), len(extra))
+        return header + entry.name + extra
+
+    def write(self, path, arcname, fresh=False):
+        """Add the file or directory {path} as {arcname}. With {fresh}, the
+file is compressed again even if its inode was written before, e.g.
+because it was rewritten in place.
+"""
+        st = os.stat(path)
+        if stat.S_ISDIR(st.st_mode):
+            entry = Entry(arcname.rstrip('/') + '/', st.st_mode, st.st_mtime)
+            self.pending.append((entry, path, None, 0, False, None))
+            self.drain()
+            return
+
+        entry = Entry(arcname, st.st_mode, st.st_mtime)
+        if self.level > 0 and \
+                os.path.splitext(path)[1].lower() not in INCOMPRESSIBLE:
+            entry.method = ZIP_DEFLATED
+        key = (st.st_dev, st.st_ino)
+        reuse = key in self.seen and not fresh
+        self.seen.add(key)
+        future = None
+        if self.pool is not None and not reuse and \
+                entry.method == ZIP_DEFLATED and st.st_size < self.large:
+            future = self.pool.submit(deflate, str(path), self.level)
+        self.pending.append((entry, path, key, st.st_size, reuse, future))
+        self.drain()
+
+    def drain(self, wait=False):
+        """Write the pending members whose data is ready, in order. With
+{wait}, all of them are written.
+"""
+        while len(self.pending) > 0:
+            future = self.pending[0][-1]
+            if not wait and len(self.pending) <= self.window and \
+                    future is not None and not future.done():
+                break
+            self.emit(*self.pending.popleft())
+
+    def emit(self, entry, path, key, size, reuse, future):
+        entry.offset = self.fp.tell()
+        if key is None:
+            self.fp.write(self.localHeader(entry, False))
+            self.add(entry)
+            return
+
+        # reserve room for sizes that may not fit into 32 bits
+        zip64 = size >= ZIP64_LIMIT - (1 << 20)
+        blob = self.blobs.get(key)
+        if blob is not None and reuse:
+            entry.method, entry.crc, entry.csize, entry.usize, data = blob
+            self.fp.write(self.localHeader(entry, zip64))
+            entry.data = self.fp.tell()
+            self.copy(data, entry.csize)
+        else:
+            self.fp.write(self.localHeader(entry, zip64))
+            entry.data = self.fp.tell()
+            if future is not None:
+                entry.crc, entry.usize, data = future.result()
+                entry.csize = len(data)
+                self.fp.write(data)
+            else:
+                self.compress(path, entry)
+            end = self.fp.tell()
+            self.fp.seek(entry.offset)
+            self.fp.write(self.localHeader(entry, zip64))
+            self.fp.seek(end)
+            self.blobs[key] = (entry.method, entry.crc, entry.csize,
+                               entry.usize, entry.data)
+        self.add(entry)
+
+    def add(self, entry):
+        """List {entry} in the central directory, replacing an earlier
+member of the same name.
+"""
+        self.entries.pop(entry.name, None)
+        self.entries[entry.name] = entry
+
+    def compress(self, path, entry):
+        """Deflate or store {path} into the archive, depending on the
+method of {entry}, and fill in the sizes and CRC.
+"""
+        compressor = None
+        if entry.method == ZIP_DEFLATED:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        with open(path, 'rb') as handle:
+            while True:
+                chunk = handle.read(1 << 20)
+                if not chunk:
+                    break
+                entry.usize += len(chunk)
+                entry.crc = zlib.crc32(chunk, entry.crc)
+                if compressor is not None:
+                    chunk = compressor.compress(chunk)
+                entry.csize += len(chunk)
+                self.fp.write(chunk)
+        if compressor is not None:
+            data = compressor.flush()
+            entry.csize += len(data)
+            self.fp.write(data)
+
+    def copy(self, offset, size):
+        """Append {size} bytes of the archive starting at {offset}."""
+        self.fp.flush()
+        fd = self.fp.fileno()
+        while size > 0:
+            chunk = os.pread(fd, min(size, 1 << 20), offset)
+            self.fp.write(chunk)
+            offset += len(chunk)
+            size -= len(chunk)
+
+    def writeTree(self, directory, prefix, skip=()):
+        """Add everything below {directory} under the folder {prefix}.
+Top level entries matching a pattern in {skip} are left out.
+"""
+        def skipped(name):
+            return any(fnmatch.fnmatch(name, pattern) for pattern in skip)
+
+        for root, dirs, files in os.walk(directory):
+            if root == str(directory):
+                dirs[:] = [d for d in dirs if not skipped(d)]
+                files = [f for f in files if not skipped(f)]
+            dirs.sort()
+            rel = os.path.relpath(root, directory)
+            if rel != '.' and len(dirs) + len(files) == 0:
+                # keep empty directories
+                self.write(root, os.path.join(prefix, rel))
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                self.write(path, os.path.normpath(
+                    os.path.join(prefix, rel, name)))
+
+    def close(self):
+        """Write the central directory and close the file."""
+        self.drain(wait=True)
+        if self.pool is not None:
+            self.pool.shutdown()
+        start = self.fp.tell()
+        for entry in self.entries.values():
+            extra = b''
+            usize, csize, offset = entry.usize, entry.csize, entry.offset
+            fields = list()
+            for value in (usize, csize, offset):
+                if value >= ZIP64_LIMIT:
+                    fields.append(value)
+            if len(fields) > 0:
+                extra = struct.pack(f'<HH{len(fields)}Q', 1,
+                                    8 * len(fields), *fields)
+                usize, csize, offset = [min(v, ZIP64_LIMIT)
+                                        for v in (usize, csize, offset)]
+            header = struct.pack(
+                '<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | 45,
+                45 if extra else 20, FLAG_UTF8, entry.method, entry.time,
+                entry.date, entry.crc, csize, usize, len(entry.name),
+                len(extra), 0, 0, 0, (entry.mode & 0xffff) << 16, offset)
+            self.fp.write(header + entry.name + extra)
+        end = self.fp.tell()
+
+        count = len(self.entries)
+        size = end - start
+        if count >= 0xffff or size >= ZIP64_LIMIT or start >= ZIP64_LIMIT:
+            self.fp.write(struct.pack(
+                '<IQHHIIQQQQ', 0x06064b50, 44, (3 << 8) | 45, 45, 0, 0,
+                count, count, size, start))
+            self.fp.write(struct.pack('<IIQI', 0x07064b50, 0, end, 1))
+            count = min(count, 0xffff)
+            size = min(size, ZIP64_LIMIT)
+            start = min(start, ZIP64_LIMIT)
+        self.fp.write(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, count,
+                                  count, size, start, 0))
+        self.fp.close()
+
+
+def build(zipname, directory, skip=(), level=6, workers=1):
+    """Write all device folders in {directory} into the ZIP file {zipname}
+with compression {level} on {workers} processes, see ZipWriter. Top level
+entries matching a pattern in {skip} are left out.
+"""
+    with ZipWriter(zipname, level, workers) as zw:
+        zw.writeTree(directory, '', skip)
+
+
+class Collector(threading.Thread):
+    """Thread appending fetched files to the ZIP file {zipname} while the
+collection runs, so the archive is complete shortly after the last
+transfer. Paths below the fetch {directory} are stored relative to it,
+i.e. in per-device folders. In snapshot mode, the snapshot {name} is left
+out of the stored paths. {level} and {workers} are passed to ZipWriter.
+
+collector = Collector('out.zip', settings.fetch)
+collector.add(settings.getFetchDir(0) / 'file')
+collector.addTree(settings.getFetchDir(0))
+collector.finish()
+"""
+
+    def __init__(self, zipname, directory, name=None, level=6, workers=1):
+        super().__init__()
+        self.writer = ZipWriter(zipname, level, workers)
+        self.directory = str(directory)
+        self.name = name
+        self.queue = queue.Queue()
+        self.added = set()
+        self.start()
+
+    def arcname(self, path):
+        """Return the name of the local {path} in the archive."""
+        parts = os.path.relpath(path, self.directory).split(os.sep)
+        if self.name is not None and len(parts) > 1 and \
+                parts[1] == self.name:
+            del parts[1]
+        return '/'.join(parts)
+
+    def add(self, path):
+        """Queue the file {path}, which just arrived."""
+        self.queue.put((False, str(path)))
+
+    def addTree(self, path):
+        """Queue everything below {path} that was not added as it
+arrived, e.g. after the transfer of a device finished.
+"""
+        self.queue.put((True, str(path)))
+
+    def finish(self):
+        """Write the queued files and close the archive."""
+        self.queue.put(None)
+        self.join()
+
+    def write(self, path, again=True):
+        arcname = self.arcname(path)
+        if again or arcname not in self.added:
+            self.writer.write(path, arcname, fresh=again)
+            self.added.add(arcname)
+
+    def sweep(self, directory):
+        for root, dirs, files in os.walk(directory):
+            dirs.sort()
+            if root != directory and len(dirs) + len(files) == 0:
+                # keep empty directories
+                self.write(root, False)
+            for name in sorted(files):
+                self.write(os.path.join(root, name), False)
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            tree, path = item
+            try:
+                if tree:
+                    self.sweep(path)
+                else:
+                    self.write(path)
+            except OSError as e:
+                logging.debug(f'Cannot archive {path}: {e}')
+        self.writer.close()
@@ -0,0 +1,126 @@
+#!/usr/bin/python3
+
+import ipaddress
+import logging
+import os
+import pathlib
+import subprocess
+import tarfile
+import tempfile
+import threading
+import time
+
+from connection import splitRemote, quoteRemote
+from multicast import Sender
+from relay import listEntries
+from transfer import TransferWorker, pipeline
+
+
+RECEIVER = pathlib.Path(__file__).with_name('multicast.py')
+
+
+class ReceiverWorker(TransferWorker):
+    """Thread running the multicast receiver on the device of {dst}. The
+receiver script is piped into python3 on the device, so the clients need
+nothing installed but python3. {args} are the receiver arguments after
+the destination.
+"""
+
+    def __init__(self, dst, args, port=22, timeout=3, pool=None):
+        self.args = args
+        super().__init__(None, dst, port, timeout, pool)
+
+    def run(self):
+        login, path = splitRemote(self.dst)
+        group, mport, sender, session, ident, interface = self.args
+        command = f'python3 - receive {group} {mport} {sender} {session} ' \
+            f'{ident} {quoteRemote(path)} {interface}'
+        cmd = self.ssh(login, command)
+        logging.debug(' '.join(cmd))
+        with open(RECEIVER, 'rb') as script:
+            p = subprocess.run(cmd, stdin=script, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+        self.status = self.exited(p)
+
+
+def pack(src, handle):
+    """Write the local directory {src} as tar archive into {handle}."""
+    with tarfile.open(fileobj=handle, mode='w:') as tar:
+        for name in listEntries(src):
+            tar.add(os.path.join(src, name), name, recursive=False)
+    handle.flush()
+
+
+def broadcast(results, src, dst_lambda, remote_port, progress, total,
+              group='239.255.76.83', port=47600, interface='0.0.0.0',
+              rate=50e6, timeout=60, delay=0.1, pool=None,
+              transport=TransferWorker, limit=0, attempts=1, backoff=1.0,
+              record=None):
+    """Send the local directory {src} once via multicast to every device
+reported reachable by {results}. Devices that do not confirm the complete
+copy receive it via {transport} like in pipeline, with its {limit},
+{attempts} and {backoff}. {rate} limits the multicast in bits per second.
+The final status of each device is stored into the dict {record}, if
+given, like in pipeline. Returns lists of available and missing devices.
+"""
+    available = list()
+    missing = list()
+    for device, status in results:
+        if status:
+            available.append(device)
+        else:
+            missing.append(device)
+        if progress.is_alive():
+            progress(len(missing) / max(total, 1))
+    if record is not None:
+        record.update(dict.fromkeys(missing))
+    if len(available) == 0:
+        progress.finish()
+        return available, missing
+
+    with tempfile.NamedTemporaryFile(suffix='.tar') as handle:
+        pack(src, handle)
+        sender = Sender(handle.name, group, port, interface, rate)
+        host, sport = sender.address
+        if ipaddress.ip_address(host).is_unspecified:
+            # the receivers take the address their SSH session came from
+            host = ''
+        join = host if ipaddress.ip_address(interface).is_loopback \
+            else '0.0.0.0'
+
+        receivers = dict()
+        for device in available:
+            args = (group, port, f'{host}:{sport}', sender.session, device,
+                    join)
+            receivers[device] = ReceiverWorker(
+                dst_lambda(device), args, remote_port, pool=pool)
+
+        done = set()
+        thread = threading.Thread(target=lambda: done.update(sender.run(
+            map(str, available), timeout)), daemon=True)
+        thread.start()
+        while thread.is_alive():
+            finished = 0
+            for device, w in receivers.items():
+                if not w.is_alive():
+                    finished += 1
+                    if not w.status:
+                        sender.abandon(str(device))
+            if progress.is_alive():
+                progress((finished + len(missing)) / max(total, 1))
+            time.sleep(delay)
+        for w in receivers.values():
+            w.join()
+
+    stragglers = [device for device, w in receivers.items()
+                  if not w.status or str(device) not in done]
+    logging.debug(f'Multicast stragglers: {stragglers}')
+    if record is not None:
+        for device in available:
+            record[device] = device not in stragglers
+    if len(stragglers) > 0:
+        pipeline(((device, True) for device in stragglers), lambda d: src,
+                 dst_lambda, remote_port, progress, len(stragglers), delay,
+                 pool, transport, limit, attempts, backoff, record=record)
+    progress.finish()
+    return available, missing
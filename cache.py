@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+
+import json
+import logging
+import pathlib
+
+from connection import quoteRemote
+
+
+class ContentCache(object):
+    """Remembers which contents were delivered to a device. The client
+keeps a copy of every delivered file named by its digest in the hidden
+{remote} directory next to its exchange folder, the teacher keeps one
+inventory file of those digests per login in {directory}. When a client
+cache exceeds {limit} bytes, the least recently delivered contents are
+evicted and the inventory follows, 0 means no limit.
+
+cache = ContentCache(settings.getStatePath('cache'), settings.getCacheDir(),
+                     4 << 30)
+known = cache.load('schueler@192.168.2.100')
+"""
+
+    def __init__(self, directory, remote, limit=0):
+        self.directory = pathlib.Path(directory)
+        self.remote = remote
+        self.limit = limit
+
+        if not self.directory.exists():
+            self.directory.mkdir(parents=True)
+
+    def inventoryPath(self, login):
+        return self.directory / f'{login}.json'
+
+    def load(self, login):
+        """Return the set of digests delivered to {login}."""
+        try:
+            with open(self.inventoryPath(login)) as handle:
+                return set(json.load(handle))
+        except (OSError, ValueError):
+            return set()
+
+    def save(self, login, keys):
+        """Replace the inventory of {login} by {keys}."""
+        path = self.inventoryPath(login)
+        tmp = path.with_suffix('.tmp')
+        with open(tmp, 'w') as handle:
+            json.dump(sorted(keys), handle)
+        tmp.replace(path)
+        logging.debug(f'{len(keys)} cached contents on {login}')
+
+    def restoreCommand(self, exchange):
+        """Return the remote command reading digest and name lines from
+stdin. Each name is copied from the cache into {exchange}, digests that
+are not cached are printed. Restored contents count as delivered again.
+"""
+        cache = quoteRemote(self.remote)
+        return (f'mkdir -p {quoteRemote(exchange)} && '
+                f'cd {quoteRemote(exchange)} && '
+                'while IFS= read -r key && IFS= read -r name; do '
+                f'if [ -f {cache}/"$key" ] && '
+                'mkdir -p "$(dirname "$name")" && '
+                f'cp --reflink=auto -p {cache}/"$key" "$name" && '
+                f'touch {cache}/"$key"; '
+                'then :; else echo "$key"; fi; done')
+
+    def storeCommand(self, exchange):
+        """Return the remote command reading digest and name lines from
+stdin and copying each name from {exchange} into the cache. Afterwards
+the cache is pruned and the digests it keeps are printed, see
+pruneCommand.
+"""
+        cache = quoteRemote(self.remote)
+        return (f'mkdir -p {cache} && cd {quoteRemote(exchange)} && '
+                'while IFS= read -r key && IFS= read -r name; do '
+                f'cp --reflink=auto -p "$name" {cache}/"$key.tmp" && '
+                f'mv {cache}/"$key.tmp" {cache}/"$key" && '
+                f'touch {cache}/"$key"; done; {self.pruneCommand()}')
+
+    def pruneCommand(self):
+        """Return the remote command removing the least recently delivered
+contents beyond the limit from the cache and printing the digests kept.
+"""
+        return (f'cd {quoteRemote(self.remote)} && total=0 && '
+                'ls -t | while IFS= read -r key; do '
+                'case "$key" in *.tmp) continue;; esac; '
+                'total=$((total + $(stat -c %s "$key"))); '
+                f'if [ {self.limit} -gt 0 ] && [ $total -gt {self.limit} ]; '
+                'then rm -f "$key"; else echo "$key"; fi; done')
+
+
+def lines(pairs):
+    """Encode (digest, name) pairs for the remote cache commands."""
+    return ''.join(f'{key}\n{name}\n' for key, name in pairs).encode()
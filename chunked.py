@@ -0,0 +1,181 @@
+#!/usr/bin/python3
+
+import hashlib
+import logging
+import os
+import subprocess
+import threading
+
+from connection import quoteRemote
+
+
+def split(size, streams, minimum=1 << 20):
+    """Return (offset, length) ranges cutting {size} bytes into at most
+{streams} parts of at least {minimum} bytes.
+"""
+    count = max(1, min(streams, size // minimum))
+    step = max(1, -(-size // count))
+    return [(offset, min(step, size - offset))
+            for offset in range(0, size, step)] or [(0, 0)]
+
+
+def pending(size, mtime, streams, checkpoint=None, name=None):
+    """Return the ranges of a file that are not verified yet."""
+    ranges = split(size, streams)
+    if checkpoint is None:
+        return ranges
+    verified = checkpoint.ranges(name, size, mtime)
+    if len(verified) > 0:
+        logging.debug(f'Resuming {name}, {len(verified)} ranges verified')
+    return [r for r in ranges if r not in verified]
+
+
+def rangeCommand(path, offset, length):
+    """Return the remote command printing {length} bytes of the quoted
+{path} starting at {offset}.
+"""
+    return f'dd if={path} bs=1M iflag=skip_bytes,count_bytes ' \
+        f'skip={offset} count={length} status=none'
+
+
+def parallel(ranges, copy):
+    """Run {copy}(offset, length) for all {ranges} at once. A range that
+fails is copied once more. Returns whether all succeeded and the number
+of bytes sent.
+"""
+    results = dict()
+
+    def run(offset, length):
+        ok, sent = copy(offset, length)
+        if not ok:
+            logging.debug(f'Range {offset}+{length} failed, retrying')
+            ok, more = copy(offset, length)
+            sent += more
+        results[offset] = (ok, sent)
+
+    threads = [threading.Thread(target=run, args=r) for r in ranges]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return (all(ok for ok, _ in results.values()),
+            sum(sent for _, sent in results.values()))
+
+
+def sendFile(worker, login, src, dst, size, mtime, streams=4, pooled=True,
+             checkpoint=None, name=None):
+    """Upload the local file {src} to the remote path {dst} over {streams}
+parallel SSH channels of {worker}, through its connection pool if
+{pooled}. Each range is hashed while it is read and compared with the hash
+of the written range on the device. The file is renamed into place after
+all ranges matched.
+
+Verified ranges are recorded as {name} in the journal.Checkpoint
+{checkpoint}, if given, and skipped when the upload is resumed.
+"""
+    part = quoteRemote(f'{dst}.part')
+    target = quoteRemote(dst)
+    directory = quoteRemote(os.path.dirname(dst) or '.')
+
+    def remote(command, **kwargs):
+        cmd = worker.ssh(login, command, pooled)
+        logging.debug(' '.join(cmd))
+        return subprocess.run(cmd, stdin=subprocess.DEVNULL,
+                              stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL, **kwargs)
+
+    if not worker.exited(remote(
+            f'mkdir -p {directory} && truncate -s {size} {part}')):
+        return False
+
+    def copy(offset, length):
+        command = f'dd of={part} bs=1M conv=notrunc oflag=seek_bytes ' \
+            f'seek={offset} status=none && ' \
+            f'{rangeCommand(part, offset, length)} | b2sum'
+        cmd = worker.ssh(login, command, pooled)
+        p = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.DEVNULL)
+        h = hashlib.blake2b()
+        sent = 0
+        try:
+            with open(src, 'rb') as handle:
+                while sent < length:
+                    data = os.pread(handle.fileno(),
+                                    min(1 << 20, length - sent),
+                                    offset + sent)
+                    if not data:
+                        break
+                    h.update(data)
+                    worker.throttle(len(data))
+                    p.stdin.write(data)
+                    sent += len(data)
+            p.stdin.close()
+        except OSError as e:
+            logging.debug(f'Range of {src} broken: {e}')
+            p.kill()
+        out = p.stdout.read()
+        p.wait()
+        ok = worker.exited(p) and out.split()[:1] == [h.hexdigest().encode()]
+        if ok and checkpoint is not None:
+            checkpoint.verified(name, size, mtime, offset, length)
+        return ok, sent
+
+    ok, sent = parallel(pending(size, mtime, streams, checkpoint, name), copy)
+    worker.sent += sent
+    return ok and worker.exited(remote(
+        f'touch -d @{mtime} {part} && mv -f {part} {target}'))
+
+
+def receiveFile(worker, login, src, dst, size, mtime, streams=4,
+                pooled=True, checkpoint=None, name=None):
+    """Download the remote file {src} to the local path {dst} over {streams}
+parallel SSH channels of {worker}, through its connection pool if
+{pooled}. Each range is hashed while it is written and compared with the
+hash the device computed while sending it. The file is renamed into place after all
+ranges matched.
+
+Verified ranges are recorded as {name} in the journal.Checkpoint
+{checkpoint}, if given, and skipped when the download is resumed.
+"""
+    path = quoteRemote(src)
+    part = f'{dst}.part'
+    os.makedirs(os.path.dirname(part) or '.', exist_ok=True)
+    # keep what an interrupted download left behind
+    with open(part, 'a+b') as handle:
+        handle.truncate(size)
+
+    def copy(offset, length):
+        h = hashlib.blake2b()
+        sent = 0
+        # the device hashes the range while sending it, the digest follows
+        # on stderr, so nothing is read twice
+        command = f'{{ {rangeCommand(path, offset, length)} | ' \
+            'tee /dev/fd/3 | b2sum >&2; } 3>&1'
+        cmd = worker.ssh(login, command, pooled)
+        p = subprocess.Popen(cmd, stdin=subprocess.DEVNULL,
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE)
+        with open(part, 'r+b') as handle:
+            while True:
+                data = p.stdout.read(1 << 20)
+                if not data:
+                    break
+                worker.throttle(len(data))
+                h.update(data)
+                os.pwrite(handle.fileno(), data, offset + sent)
+                sent += len(data)
+        lines = p.stderr.read().splitlines()
+        p.wait()
+        ok = worker.exited(p) and sent == length and \
+            lines[-1:] == [f'{h.hexdigest()}  -'.encode()]
+        if ok and checkpoint is not None:
+            checkpoint.verified(name, size, mtime, offset, length)
+        return ok, sent
+
+    ok, sent = parallel(pending(size, mtime, streams, checkpoint, name), copy)
+    worker.sent += sent
+    if ok:
+        os.utime(part, (mtime, mtime))
+        os.replace(part, dst)
+    return ok
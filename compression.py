@@ -0,0 +1,48 @@
+#!/usr/bin/python3
+
+import os
+import zlib
+
+
+# extensions of formats that are compressed already
+INCOMPRESSIBLE = {
+    '.7z', '.avi', '.bz2', '.docx', '.epub', '.flac', '.gif', '.gz',
+    '.jpeg', '.jpg', '.lz4', '.m4a', '.mkv', '.mov', '.mp3', '.mp4',
+    '.odg', '.odp', '.ods', '.odt', '.ogg', '.opus', '.pdf', '.png',
+    '.pptx', '.rar', '.sb3', '.webm', '.webp', '.xlsx', '.xz', '.zip',
+    '.zst'
+}
+
+# compress and decompress commands reading stdin and writing stdout
+CODECS = {
+    'none': None,
+    'gzip': (['gzip', '-1', '-c'], ['gzip', '-d', '-c']),
+    'lz4': (['lz4', '-1', '-q', '-c'], ['lz4', '-d', '-q', '-c']),
+    'zstd': (['zstd', '-1', '-q', '-c'], ['zstd', '-d', '-q', '-c'])
+}
+
+
+def sampleRatio(path, size=65536):
+    """Return the compression ratio of the first {size} bytes of {path}
+using fast deflate. Values close to 1.0 indicate incompressible data.
+"""
+    with open(path, 'rb') as handle:
+        sample = handle.read(size)
+    if len(sample) == 0:
+        return 1.0
+    return len(zlib.compress(sample, 1)) / len(sample)
+
+
+def isCompressible(path, threshold=0.9):
+    """Return whether {path} is worth compressing. Known formats are
+decided by extension, others by the ratio of a quick sample, which must
+be below {threshold}.
+"""
+    ext = os.path.splitext(str(path))[1].lower()
+    if ext in INCOMPRESSIBLE:
+        return False
+    try:
+        return sampleRatio(path) < threshold
+    except OSError:
+        return False
+
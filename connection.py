@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+
+import hashlib
+import logging
+import pathlib
+import shlex
+import subprocess
+
+
+def splitRemote(path):
+    """Split 'user@host:path' into ('user@host', 'path'). Local paths are
+returned as (None, path).
+"""
+    path = str(path)
+    if path.startswith('/') or ':' not in path:
+        return None, path
+    login, path = path.split(':', 1)
+    return login, path
+
+
+def quoteRemote(path):
+    """Quote {path} for the remote shell but keep a leading ~ expandable."""
+    path = str(path)
+    if path == '~':
+        return '"$HOME"'
+    if path.startswith('~/'):
+        return '"$HOME"/' + shlex.quote(path[2:])
+    return shlex.quote(path)
+
+
+class ConnectionPool(object):
+    """Shares one authenticated SSH session per login and port using
+OpenSSH ControlMaster sockets in {directory}. Masters stay open for
+{persist} seconds after their last use, so back-to-back runs can reuse
+them as well.
+
+pool = ConnectionPool('/tmp/sockets')
+subprocess.run(['scp', *pool.options(login, port), ...])
+pool.run(login, port, 'ls')
+"""
+
+    def __init__(self, directory, persist=60, timeout=3):
+        self.directory = pathlib.Path(directory)
+        self.persist = persist
+        self.timeout = timeout
+
+        if not self.directory.exists():
+            self.directory.mkdir(mode=0o700, parents=True)
+
+    def controlPath(self, login, port):
+        """Return the control socket path for {login} and {port}."""
+        # unix socket paths are limited to about 100 characters
+        key = hashlib.sha1(f'{login}:{port}'.encode()).hexdigest()[:16]
+        return self.directory / key
+
+    def options(self, login, port):
+        """Return ssh/scp options that share the pooled session."""
+        persist = f'{int(self.persist)}s' if self.persist > 0 else 'yes'
+        return [
+            '-o', 'ControlMaster=auto',
+            '-o', f'ControlPath={self.controlPath(login, port)}',
+            '-o', f'ControlPersist={persist}',
+            '-o', f'ConnectTimeout={self.timeout}',
+            '-o', 'ServerAliveInterval=5',
+            '-o', 'ServerAliveCountMax=2'
+        ]
+
+    def ssh(self, login, port, command):
+        """Return the argument list running {command} on {login}."""
+        return ['ssh', *self.options(login, port), '-p', str(port),
+                login, command]
+
+    def run(self, login, port, command, **kwargs):
+        """Run {command} on {login} through the pooled session. Returns the
+CompletedProcess.
+"""
+        args = self.ssh(login, port, command)
+        logging.debug(' '.join(args))
+        kwargs.setdefault('stdin', subprocess.DEVNULL)
+        kwargs.setdefault('stdout', subprocess.PIPE)
+        kwargs.setdefault('stderr', subprocess.PIPE)
+        return subprocess.run(args, **kwargs)
+
+    def isOpen(self, login, port):
+        """Return whether a master session for {login} is running."""
+        if not self.controlPath(login, port).exists():
+            return False
+        p = subprocess.run(
+            ['ssh', *self.options(login, port), '-O', 'check', login],
+            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+        return p.returncode == 0
+
+    def close(self, login, port):
+        """Stop the master session for {login}, if any."""
+        if self.controlPath(login, port).exists():
+            subprocess.run(
+                ['ssh', *self.options(login, port), '-O', 'exit', login],
+                stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE)
+
+    def closeAll(self):
+        """Stop all master sessions of this pool."""
+        for path in self.directory.iterdir():
+            subprocess.run(
+                ['ssh', '-o', f'ControlPath={path}', '-O', 'exit', 'pool'],
+                stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE)
@@ -1,11 +1,19 @@
 #!/usr/bin/python3
 
+import asyncio
+import os
+import queue
+import socket
+import struct
 import threading
 import subprocess
-import time
 import logging
 
 
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+
+
 class PingWorker(threading.Thread):
     """Thread to handle pinging a device."""
 
@@ -28,33 +36,300 @@ class PingWorker(threading.Thread):
                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         self.status = p.returncode == 0
 
+# ---------------------------------------------------------------------
+
+
+def checksum(data):
+    """Return the internet checksum (RFC 1071) of {data}."""
+    if len(data) % 2:
+        data += b'\0'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+def openIcmpSocket():
+    """Open a non-blocking ICMP socket. Unprivileged datagram sockets are
+preferred, raw sockets are used if the kernel does not allow them. Returns
+the socket and whether it is a raw socket. Raises PermissionError if neither
+is available.
+"""
+    try:
+        sock = socket.socket(
+            socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+        raw = False
+    except PermissionError:
+        sock = socket.socket(
+            socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+        raw = True
+    sock.setblocking(False)
+    return sock, raw
+
+
+def echoRequest(ident, seq):
+    """Build an ICMP echo request packet."""
+    payload = b'lan_share'
+    header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, 0, ident, seq)
+    csum = checksum(header + payload)
+    header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, csum, ident, seq)
+    return header + payload
+
+
+def parseEchoReply(packet, raw):
+    """Return (ident, seq) of an ICMP echo reply or None for any other
+packet. Raw sockets deliver the IP header as well, which is skipped.
+"""
+    if raw:
+        packet = packet[(packet[0] & 0x0f) * 4:]
+    if len(packet) < 8:
+        return None
+    kind, code, _, ident, seq = struct.unpack('!BBHHH', packet[:8])
+    if kind != ICMP_ECHO_REPLY:
+        return None
+    return ident, seq
+
+
+async def sendto(loop, sock, data, address):
+    """Send {data} through the non-blocking {sock}, waiting until it is
+writable. Unlike loop.sock_sendto, this works before Python 3.11.
+"""
+    while True:
+        try:
+            return sock.sendto(data, address)
+        except (BlockingIOError, InterruptedError):
+            pass
+        writable = loop.create_future()
+        loop.add_writer(sock, writable.set_result, None)
+        try:
+            await writable
+        finally:
+            loop.remove_writer(sock)
+
+
+async def recvfrom(loop, sock, size):
+    """Receive a datagram from the non-blocking {sock}, waiting until one
+arrives. Unlike loop.sock_recvfrom, this works before Python 3.11.
+"""
+    while True:
+        try:
+            return sock.recvfrom(size)
+        except (BlockingIOError, InterruptedError):
+            pass
+        readable = loop.create_future()
+        loop.add_reader(sock, readable.set_result, None)
+        try:
+            await readable
+        finally:
+            loop.remove_reader(sock)
+
+
+async def sweepIcmp(targets, timeout, callback):
+    """Send one echo request per target through a single socket and
+collect the replies until all targets answered or {timeout} expired.
+{targets} maps devices to IPs, {callback} is invoked with (device, status)
+for every result. Returns the set of reachable devices.
+"""
+    loop = asyncio.get_running_loop()
+    sock, raw = openIcmpSocket()
+    ident = os.getpid() & 0xffff
+    pending = dict()
+    reachable = set()
+    try:
+        for seq, (device, ip) in enumerate(targets.items()):
+            try:
+                await sendto(loop, sock, echoRequest(ident, seq & 0xffff),
+                             (str(ip), 0))
+            except OSError as e:
+                logging.debug(f'ICMP to {ip} failed: {e}')
+                callback(device, False)
+                continue
+            pending[str(ip)] = device
+
+        async def receive():
+            while pending:
+                packet, (addr, _) = await recvfrom(loop, sock, 1024)
+                reply = parseEchoReply(packet, raw)
+                if reply is None or addr not in pending:
+                    continue
+                # datagram sockets get their identifier assigned by the kernel
+                if raw and reply[0] != ident:
+                    continue
+                device = pending.pop(addr)
+                reachable.add(device)
+                callback(device, True)
+
+        try:
+            await asyncio.wait_for(receive(), timeout)
+        except asyncio.TimeoutError:
+            pass
+    finally:
+        sock.close()
+
+    for device in pending.values():
+        callback(device, False)
+    return reachable
+
+
+async def probeTcp(ip, port, timeout):
+    """Return whether a TCP connection to {ip}:{port} can be established
+within {timeout} seconds.
+"""
+    try:
+        _, writer = await asyncio.wait_for(
+            asyncio.open_connection(str(ip), port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+    return True
+
+
+async def probeControl(path, timeout):
+    """Return whether an SSH master is listening on the control socket
+{path}. Pooled sessions prove reachability without a new connection.
+"""
+    try:
+        _, writer = await asyncio.wait_for(
+            asyncio.open_unix_connection(str(path)), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    return True
+
+
+async def sweepTcp(targets, port, timeout, callback, controls=None):
+    """Connect to {port} on all targets concurrently. A successful connect
+proves that sshd is up, not only that the host answers ping. Devices with
+a live SSH master socket in {controls} (device -> path) are reachable
+without connecting again. Returns the set of reachable devices.
+"""
+    if controls is None:
+        controls = dict()
 
-def discover(settings, progress, delay=0.1):
-    """Discovers devices in the given range via ping. Returns a list of available devices."""
-    # setup workers
-    worker = list()
-    for device in range(settings.num_clients):
-        ip = settings.getIp(device)
-        worker.append(PingWorker(device, ip))
-
-    # wait and update progress bar
-    n = settings.num_clients
-    while n > 0 and progress.is_alive():
-        # calculate progress based on number of active workers
-        n = sum(1 if w.is_alive() else 0 for w in worker)
-        progress((settings.num_clients - n) / settings.num_clients)
-        time.sleep(delay)
+    async def probe(device, ip):
+        status = False
+        if device in controls:
+            status = await probeControl(controls[device], timeout)
+        if not status:
+            status = await probeTcp(ip, port, timeout)
+        callback(device, status)
+        return device, status
+
+    results = await asyncio.gather(
+        *(probe(device, ip) for device, ip in targets.items()))
+    return set(device for device, status in results if status)
+
+
+def sweep(targets, method='icmp', port=22, timeout=1.0, callback=None,
+          controls=None):
+    """Probe all {targets} (device -> IP) within a single {timeout} window
+using either 'icmp' echo or a 'tcp' connect to {port}. Returns the set of
+reachable devices.
+"""
+    if callback is None:
+        def callback(device, status):
+            pass
+
+    if method == 'tcp':
+        return asyncio.run(
+            sweepTcp(targets, int(port), timeout, callback, controls))
+    elif method == 'icmp':
+        return asyncio.run(sweepIcmp(targets, timeout, callback))
+    raise ValueError(f'unknown probe method {method}')
+
+
+def sweepPing(targets, callback, wait=1):
+    """Fallback sweep with one ping subprocess per device. Used if ICMP
+sockets are not permitted for this user.
+"""
+    worker = [PingWorker(device, ip, wait=wait)
+              for device, ip in targets.items()]
+    reachable = set()
+    for w in worker:
+        w.join()
+        callback(w.device, w.status)
+        if w.status:
+            reachable.add(w.device)
+    return reachable
+
+
+def stream(settings, devices, timeout=1.0, pool=None):
+    """Probe {devices} in the background via ICMP echo or TCP connect,
+depending on {settings.probe}, and yield (device, status) pairs as soon as
+each result arrives. Sessions of the connection {pool} count as reachable.
+"""
+    targets = dict()
+    controls = dict()
+    for device in devices:
+        targets[device] = settings.getIp(device)
+        if pool is not None:
+            controls[device] = pool.controlPath(
+                settings.getLogin(device), settings.remote_port)
+    results = queue.Queue()
+    reported = set()
+
+    def report(device, status):
+        reported.add(device)
+        results.put((device, status))
+
+    def run():
+        try:
+            sweep(targets, settings.probe, settings.remote_port, timeout,
+                  report, controls)
+        except OSError as e:
+            logging.debug(f'Sweep failed ({e}), falling back to ping')
+            sweepPing({device: ip for device, ip in targets.items()
+                       if device not in reported},
+                      report, wait=max(1, int(timeout)))
+        finally:
+            results.put(None)
+
+    threading.Thread(target=run, daemon=True).start()
+    while True:
+        result = results.get()
+        if result is None:
+            break
+        yield result
+
+
+def probeDevices(settings, devices, progress, timeout=1.0):
+    """Probe the given {devices} via ICMP echo or TCP connect, depending on
+{settings.probe}. Returns lists of available and missing devices.
+"""
+    devices = list(devices)
+
+    # update progress bar as results arrive
+    reachable = set()
+    done = 0
+    for device, status in stream(settings, devices, timeout):
+        if status:
+            reachable.add(device)
+        done += 1
+        progress(done / len(devices))
     progress.finish()
 
     # build device list
     available = list()
     missing = list()
-    for w in worker:
-        w.join()
-        if w.status:
-            available.append(w.device)
+    for device in devices:
+        if device in reachable:
+            available.append(device)
         else:
-            missing.append(w.device)
+            missing.append(device)
+
+    return available, missing
+
+
+def discover(settings, progress, delay=0.1, timeout=1.0):
+    """Discovers devices in the given range via ICMP echo or TCP connect,
+depending on {settings.probe}. Returns a list of available devices.
+"""
+    available, missing = probeDevices(
+        settings, range(settings.num_clients), progress, timeout)
 
     if len(available) == 0:
         raise SystemExit(
@@ -0,0 +1,362 @@
+#!/usr/bin/python3
+
+import collections
+import logging
+import os
+import shlex
+import subprocess
+import tarfile
+import threading
+import time
+
+from compression import CODECS
+from connection import splitRemote, quoteRemote
+import integrity
+from transfer import Meter, TransferWorker, partition, pipeline
+
+
+class Fanout(object):
+    """File-like object handing every written chunk to all attached
+readers. The chunks are shared, not copied per reader. Writing blocks
+while {window} bytes are buffered, so the slowest reader bounds the
+memory use. Attach all readers before writing.
+"""
+
+    def __init__(self, window=16 << 20):
+        self.window = window
+        self.chunks = collections.deque()
+        self.first = 0
+        self.size = 0
+        self.position = dict()
+        self.closed = False
+        self.cond = threading.Condition()
+
+    def attach(self, reader):
+        with self.cond:
+            self.position[reader] = self.first
+
+    def detach(self, reader):
+        """Stop feeding {reader}, e.g. after its stream broke."""
+        with self.cond:
+            self.position.pop(reader, None)
+            self.trim()
+            self.cond.notify_all()
+
+    def trim(self):
+        """Drop the chunks every reader has consumed."""
+        low = min(self.position.values(),
+                  default=self.first + len(self.chunks))
+        while self.first < low:
+            self.size -= len(self.chunks.popleft())
+            self.first += 1
+
+    def write(self, data):
+        data = bytes(data)
+        with self.cond:
+            self.cond.wait_for(
+                lambda: self.size < self.window or len(self.position) == 0)
+            if len(self.position) > 0:
+                self.chunks.append(data)
+                self.size += len(data)
+                self.cond.notify_all()
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def read(self, reader):
+        """Return the next chunk for {reader}, b'' at the end."""
+        with self.cond:
+            self.cond.wait_for(
+                lambda: self.position[reader] < self.first + len(self.chunks)
+                or self.closed)
+            index = self.position[reader]
+            if index == self.first + len(self.chunks):
+                return b''
+            data = self.chunks[index - self.first]
+            self.position[reader] = index + 1
+            self.trim()
+            self.cond.notify_all()
+            return data
+
+
+class FanoutWorker(TransferWorker):
+    """Thread piping the chunks of {fanout} into {command} on the device of
+{dst}. The null separated names {command} prints are kept in {broken},
+see integrity.unpack.
+"""
+
+    def __init__(self, fanout, dst, command, port=22, timeout=3, pool=None,
+                 budget=None):
+        self.fanout = fanout
+        self.command = command
+        self.broken = list()
+        fanout.attach(self)
+        super().__init__(None, dst, port, timeout, pool, budget)
+
+    def run(self):
+        login = splitRemote(self.dst)[0]
+        cmd = self.ssh(login, self.command)
+        logging.debug(' '.join(cmd))
+        ok = True
+        try:
+            p = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.DEVNULL)
+            try:
+                while True:
+                    data = self.fanout.read(self)
+                    if not data:
+                        break
+                    self.throttle(len(data))
+                    p.stdin.write(data)
+                    self.sent += len(data)
+                p.stdin.close()
+            except OSError as e:
+                logging.debug(f'Stream to {self.dst} broken: {e}')
+                ok = False
+            self.broken = [os.fsdecode(name)
+                           for name in p.stdout.read().split(b'\0') if name]
+            p.wait()
+            ok = ok and p.returncode == 0
+        except OSError as e:
+            logging.debug(f'Cannot reach {self.dst}: {e}')
+            ok = False
+        finally:
+            self.fanout.detach(self)
+        self.status = ok
+
+
+def produce(fanout, entries, codec='none', verify=False):
+    """Write {entries} once as tar stream into {fanout}, compressed with
+{codec}. With {verify}, the stream carries the digests of its files, see
+integrity.pack. Returns the number of uncompressed bytes.
+"""
+    compressor = None
+    if CODECS.get(codec) is None:
+        sink = Meter(fanout)
+    else:
+        compressor = subprocess.Popen(
+            CODECS[codec][0], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+        def pump():
+            while True:
+                data = compressor.stdout.read1(1 << 20)
+                if not data:
+                    break
+                fanout.write(data)
+
+        pumping = threading.Thread(target=pump)
+        pumping.start()
+        sink = Meter(compressor.stdin)
+
+    try:
+        # large records keep the number of shared chunks small
+        if verify:
+            integrity.pack(entries, sink, bufsize=1 << 20)
+        else:
+            with tarfile.open(fileobj=sink, mode='w|',
+                              bufsize=1 << 20) as tar:
+                for path, arcname in entries:
+                    tar.add(path, arcname=arcname, recursive=False)
+    finally:
+        if compressor is not None:
+            compressor.stdin.close()
+            pumping.join()
+            compressor.wait()
+        fanout.close()
+    return sink.count
+
+
+def share(devices, src, dst_lambda, remote_port, codec='none', threshold=0.9,
+          window=16 << 20, pool=None, budget=None, verify=False,
+          journal=None):
+    """Send the local directory {src} to all {devices} at once, reading
+each file a single time. The streams share the bandwidth {budget}. With
+{verify}, the devices check the files as they arrive and broken ones are
+sent again to that device alone. Large files stay in the shared streams
+as well, cutting them into ranges per device would read them once for
+every device.
+
+With a {journal}, the files every device of the round completed in an
+interrupted run are left out.
+Returns a dict mapping each device to its worker status and sent bytes,
+and the number of bytes read.
+"""
+    result = {device: (True, 0) for device in devices}
+    raw = 0
+    if len(os.listdir(src)) == 0:
+        logging.debug(f'Skipping empty directory {src}.')
+        return result, raw
+
+    checkpoints = dict()
+    if journal is not None:
+        checkpoints = {device: journal.open(src, dst_lambda(device))
+                       for device in devices}
+
+    def isDone(path, name):
+        if len(checkpoints) == 0 or not os.path.isfile(path) or \
+                os.path.islink(path):
+            return False
+        st = os.stat(path)
+        return all(c.isDone(name, st.st_size, st.st_mtime)
+                   for c in checkpoints.values())
+
+    def confirm(device, entries, broken):
+        if device not in checkpoints:
+            return
+        for path, name in entries:
+            if name not in broken and os.path.isfile(path) and \
+                    not os.path.islink(path):
+                st = os.stat(path)
+                checkpoints[device].done(name, st.st_size, st.st_mtime)
+
+    packed, plain = partition(src, codec, threshold)
+    for entries, stream_codec in [(packed, codec), (plain, 'none')]:
+        entries = [e for e in entries if not isDone(*e)]
+        if len(entries) == 0:
+            continue
+        decompress = ''
+        if CODECS.get(stream_codec) is not None:
+            decompress = shlex.join(CODECS[stream_codec][1]) + ' | '
+
+        def command(device):
+            remote = quoteRemote(splitRemote(dst_lambda(device))[1])
+            unpack = f'tar -C {remote} -xf -'
+            if verify:
+                unpack = integrity.command('unpack', remote)
+            return f'mkdir -p {remote} && {decompress}{unpack}'
+
+        fanout = Fanout(window)
+        worker = dict()
+        for device, (ok, sent) in result.items():
+            if not ok:
+                continue
+            worker[device] = FanoutWorker(fanout, dst_lambda(device),
+                                          command(device), remote_port,
+                                          pool=pool, budget=budget)
+        raw += produce(fanout, entries, stream_codec, verify)
+        for device, w in worker.items():
+            w.join()
+            ok, sent = result[device]
+            if w.status and len(w.broken) > 0:
+                logging.info(f'{len(w.broken)} files arrived broken on '
+                             f'device {device}, sending them again')
+                broken = [e for e in entries if e[1] in w.broken]
+                sent += w.sent
+                again = Fanout(window)
+                w = FanoutWorker(again, dst_lambda(device), command(device),
+                                 remote_port, pool=pool, budget=budget)
+                produce(again, broken, stream_codec, verify)
+                w.join()
+            result[device] = (bool(w.status) and len(w.broken) == 0,
+                              sent + w.sent)
+            if w.status:
+                confirm(device, entries, w.broken)
+
+    for device, checkpoint in checkpoints.items():
+        checkpoint.close(result[device][0])
+    return result, raw
+
+
+def fanout(results, src, dst_lambda, remote_port, progress, total,
+           codec='none', threshold=0.9, window=16 << 20, gather=1.0,
+           delay=0.1, pool=None, budget=None, verify=False, limit=0,
+           attempts=1, backoff=1.0, transport=TransferWorker, journal=None,
+           traffic=None, record=None):
+    """Distribute the local directory {src} to every device reported
+reachable by {results}. Devices found within {gather} seconds are served
+together from a single read of the files, at most {limit} at once, 0
+means no limit; devices found later start another round. With {verify},
+the devices check the files as they arrive, see share(). An interrupted
+run is resumed from the {journal}, if given. The bytes read and sent for
+each device are stored as pair into the dict {traffic}, if given.
+
+If {attempts} allow another try, devices the shared stream failed for
+receive the files via {transport} like in pipeline, with its {limit},
+{attempts} and {backoff}. The final status of each device is stored into
+the dict {record}, if given, like in pipeline. Returns lists of available
+and missing devices.
+"""
+    pending = list()
+    missing = list()
+    lock = threading.Lock()
+
+    def feed():
+        for device, status in results:
+            with lock:
+                if status:
+                    pending.append(device)
+                else:
+                    missing.append(device)
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+
+    available = list()
+    failed = list()
+    since = None
+    while True:
+        feeding = feeder.is_alive()
+        with lock:
+            if len(pending) > 0 and since is None:
+                since = time.monotonic()
+            batch = list()
+            if len(pending) > 0 and \
+                    (not feeding or time.monotonic() - since >= gather):
+                batch = pending[:limit] if limit > 0 else list(pending)
+                del pending[:len(batch)]
+                if len(pending) == 0:
+                    since = None
+
+        if len(batch) > 0:
+            outcome = list()
+            serving = threading.Thread(target=lambda: outcome.append(share(
+                batch, src, dst_lambda, remote_port, codec, threshold,
+                window, pool, budget, verify, journal)))
+            serving.start()
+            while serving.is_alive():
+                if progress.is_alive():
+                    progress((len(available) + len(missing)) / max(total, 1))
+                time.sleep(delay)
+
+            result, raw = outcome[0] if len(outcome) > 0 else (dict(), 0)
+            for device, (ok, sent) in result.items():
+                available.append(device)
+                if not ok:
+                    failed.append(device)
+                if traffic is not None and raw > 0:
+                    traffic[device] = (raw, sent)
+            for device in batch:
+                if device not in available:
+                    available.append(device)
+                    failed.append(device)
+
+        if progress.is_alive():
+            progress((len(available) + len(missing)) / max(total, 1))
+        if not feeding and len(batch) == 0 and len(pending) == 0:
+            break
+        time.sleep(delay)
+    progress.finish()
+
+    if record is not None:
+        record.update(dict.fromkeys(missing))
+        for device in available:
+            record[device] = device not in failed
+    if len(failed) > 0 and attempts > 1:
+        logging.debug(f'Fanout failed for {failed}, retrying them alone')
+        pipeline(((device, True) for device in failed), lambda d: src,
+                 dst_lambda, remote_port, progress, len(failed), delay,
+                 pool, transport, limit, attempts - 1, backoff,
+                 record=record, traffic=traffic)
+    elif len(failed) > 0:
+        raise SystemExit(
+            f'{len(failed)} von {len(available)} Übertragungen sind '
+            'fehlgeschlagen.')
+
+    return available, missing
@@ -0,0 +1,219 @@
+#!/usr/bin/python3
+"""Tar streams verified by BLAKE2b hashes computed on the fly.
+
+Files are hashed while they are read into the stream and again while
+they are extracted from it, so nothing is read a second time. The last
+member of the stream, MANIFEST, lists the hashes of the sender in b2sum
+format; the receiver compares them with its own.
+
+This module only uses the standard library: it is passed to python3 on
+the clients to pack and unpack there.
+
+    python3 integrity.py pack DIR < names > stream
+    python3 integrity.py unpack DIR < stream > mismatches
+
+The names are separated by null bytes, as are the mismatching names
+printed by unpack.
+"""
+
+import hashlib
+import io
+import os
+import shlex
+import sys
+import tarfile
+import time
+
+
+MANIFEST = '.transfer.b2sum'
+
+
+class Hashing(object):
+    """File-like wrapper hashing the bytes read from {handle}."""
+
+    def __init__(self, handle):
+        self.handle = handle
+        self.hash = hashlib.blake2b()
+
+    def read(self, size=-1):
+        data = self.handle.read(size)
+        self.hash.update(data)
+        return data
+
+
+class ReplacingTarFile(tarfile.TarFile):
+    """TarFile replacing existing files instead of writing into them, so
+hardlinked copies of a file, e.g. deduplicated ones, stay untouched.
+"""
+
+    def makefile(self, tarinfo, targetpath):
+        unlink(targetpath)
+        super().makefile(tarinfo, targetpath)
+
+
+def unlink(path):
+    """Remove the file {path} if there is one."""
+    try:
+        os.unlink(path)
+    except OSError:
+        # missing, or a folder tarfile fails on anyway
+        pass
+
+
+class HashingTarFile(tarfile.TarFile):
+    """TarFile hashing the content of every regular file it extracts.
+The digests are kept by member name in {digests}. Like ReplacingTarFile,
+existing files are replaced.
+"""
+
+    def __init__(self, *args, **kwargs):
+        self.digests = dict()
+        super().__init__(*args, **kwargs)
+
+    def makefile(self, tarinfo, targetpath):
+        unlink(targetpath)
+        source = self.fileobj
+        source.seek(tarinfo.offset_data)
+        h = hashlib.blake2b()
+        remaining = tarinfo.size
+        with open(targetpath, 'wb') as target:
+            while remaining > 0:
+                data = source.read(min(remaining, 1 << 20))
+                if not data:
+                    raise tarfile.ReadError('unexpected end of data')
+                h.update(data)
+                target.write(data)
+                remaining -= len(data)
+        self.digests[tarinfo.name] = h.hexdigest()
+
+
+def render(digests):
+    """Return {digests} as b2sum lines."""
+    return ''.join(f'{key}  {name}\n' for name, key in sorted(digests.items()))
+
+
+def parse(text):
+    """Return the digests by name of b2sum lines."""
+    digests = dict()
+    for line in text.splitlines():
+        key, sep, name = line.partition('  ')
+        if sep:
+            digests[name] = key
+    return digests
+
+
+def manifestMember(digests):
+    """Return the TarInfo and content of the manifest member listing
+{digests}.
+"""
+    data = render(digests).encode(errors='surrogateescape')
+    info = tarfile.TarInfo(MANIFEST)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    return info, data
+
+
+def trailer(digests):
+    """Return the raw tar blocks of the manifest member listing {digests},
+to be appended to members written elsewhere.
+"""
+    info, data = manifestMember(digests)
+    return info.tobuf(tarfile.PAX_FORMAT, tarfile.ENCODING,
+                      'surrogateescape') + data + \
+        bytes(-len(data) % tarfile.BLOCKSIZE)
+
+
+def pack(entries, fileobj, bufsize=tarfile.RECORDSIZE):
+    """Write (path, arcname) {entries} as tar stream into {fileobj},
+followed by the manifest. Returns the digests by name.
+"""
+    digests = dict()
+    with tarfile.open(fileobj=fileobj, mode='w|', bufsize=bufsize) as tar:
+        for path, arcname in entries:
+            info = tar.gettarinfo(path, arcname=arcname)
+            if info.isreg():
+                with open(path, 'rb') as handle:
+                    reader = Hashing(handle)
+                    tar.addfile(info, reader)
+                digests[info.name] = reader.hash.hexdigest()
+            else:
+                tar.addfile(info)
+        info, data = manifestMember(digests)
+        tar.addfile(info, io.BytesIO(data))
+    return digests
+
+
+def unpack(directory, fileobj, extracted=None):
+    """Extract the tar stream {fileobj} written by pack() into
+{directory}. {extracted} is called with each regular member. Returns the
+verified digests by name and the names that arrived broken, or None for
+the latter if the stream ended before the manifest.
+"""
+    options = dict()
+    if hasattr(tarfile, 'data_filter'):
+        options['filter'] = 'data'
+    expected = None
+    with HashingTarFile.open(fileobj=fileobj, mode='r|') as tar:
+        for member in tar:
+            if member.name == MANIFEST:
+                data = tar.extractfile(member).read()
+                expected = parse(data.decode(errors='surrogateescape'))
+                continue
+            tar.extract(member, directory, **options)
+            if member.isreg() and extracted is not None:
+                extracted(member)
+        received = tar.digests
+    if expected is None:
+        return dict(), None
+    broken = sorted(name for name, key in expected.items()
+                    if received.get(name) != key)
+    verified = {name: key for name, key in received.items()
+                if expected.get(name) == key}
+    return verified, broken
+
+
+def record(path, digests):
+    """Merge {digests} into the b2sum manifest at the local {path}."""
+    known = dict()
+    try:
+        with open(path, errors='surrogateescape') as handle:
+            known = parse(handle.read())
+    except OSError:
+        pass
+    known.update(digests)
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w', errors='surrogateescape') as handle:
+        handle.write(render(known))
+    os.replace(tmp, path)
+
+
+def command(action, directory):
+    """Return the shell command running {action} of this module with
+python3 on a client for the quoted {directory}.
+"""
+    with open(os.path.abspath(__file__)) as handle:
+        source = handle.read()
+    return f'python3 -c {shlex.quote(source)} {action} {directory}'
+
+
+def main(argv):
+    if len(argv) != 2 or argv[0] not in ('pack', 'unpack'):
+        print(__doc__)
+        return 2
+    action, directory = argv
+    if action == 'pack':
+        names = sys.stdin.buffer.read().split(b'\0')
+        entries = [(os.path.join(directory, os.fsdecode(name)),
+                    os.fsdecode(name)) for name in names if name]
+        pack(entries, sys.stdout.buffer)
+        return 0
+    verified, broken = unpack(directory, sys.stdin.buffer)
+    if broken is None:
+        return 1
+    sys.stdout.buffer.write(b''.join(os.fsencode(name) + b'\0'
+                                     for name in broken))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,117 @@
+#!/usr/bin/python3
+
+import hashlib
+import json
+import logging
+import pathlib
+import threading
+import time
+
+
+class Journal(object):
+    """Directory of checkpoints of unfinished transfers, one per source and
+destination, i.e. per device and operation. Checkpoints not continued
+within {age} seconds are removed.
+
+journal = Journal(settings.getStatePath('journal'))
+checkpoint = journal.open(src, dst)
+"""
+
+    def __init__(self, directory, age=7 * 86400):
+        self.directory = pathlib.Path(directory)
+        if not self.directory.exists():
+            self.directory.mkdir(parents=True)
+        self.prune(age)
+
+    def prune(self, age):
+        """Remove checkpoints last written more than {age} seconds ago."""
+        limit = time.time() - age
+        for path in self.directory.glob('*.json'):
+            try:
+                if path.stat().st_mtime < limit:
+                    path.unlink()
+            except OSError:
+                pass
+
+    def open(self, src, dst):
+        """Return the checkpoint of the transfer from {src} to {dst}."""
+        key = hashlib.sha1(f'{src}\0{dst}'.encode()).hexdigest()[:16]
+        return Checkpoint(self.directory / f'{key}.json', src, dst)
+
+
+class Checkpoint(object):
+    """Completed files and verified ranges of partial files of a transfer.
+Entries are only valid for the size and mtime they were recorded with.
+The file {path} is rewritten at most every {interval} seconds and removed
+once the transfer completed.
+"""
+
+    def __init__(self, path, src, dst, interval=1.0):
+        self.path = pathlib.Path(path)
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.last = 0.0
+        self.data = {'src': str(src), 'dst': str(dst), 'files': dict(),
+                     'partial': dict()}
+        try:
+            with open(self.path) as handle:
+                self.data.update(json.load(handle))
+        except (OSError, ValueError):
+            pass
+
+    def isDone(self, name, size, mtime):
+        """Return whether {name} was completed in this state."""
+        return self.data['files'].get(name) == [size, int(mtime)]
+
+    def done(self, name, size, mtime):
+        with self.lock:
+            self.data['files'][name] = [size, int(mtime)]
+            self.data['partial'].pop(name, None)
+        self.save()
+
+    def forget(self, name):
+        """Drop everything recorded about {name}."""
+        with self.lock:
+            self.data['files'].pop(name, None)
+            self.data['partial'].pop(name, None)
+        self.save()
+
+    def ranges(self, name, size, mtime):
+        """Return the verified (offset, length) ranges of {name}."""
+        with self.lock:
+            partial = self.data['partial'].get(name)
+            if partial is None or partial['state'] != [size, int(mtime)]:
+                return set()
+            return set(tuple(r) for r in partial['ranges'])
+
+    def verified(self, name, size, mtime, offset, length):
+        """Record that a range of the partial file {name} arrived intact."""
+        with self.lock:
+            partial = self.data['partial'].get(name)
+            if partial is None or partial['state'] != [size, int(mtime)]:
+                partial = {'state': [size, int(mtime)], 'ranges': list()}
+                self.data['partial'][name] = partial
+            partial['ranges'].append([offset, length])
+        self.save(force=True)
+
+    def save(self, force=False):
+        with self.lock:
+            now = time.monotonic()
+            if not force and now - self.last < self.interval:
+                return
+            self.last = now
+            tmp = self.path.with_suffix('.tmp')
+            with open(tmp, 'w') as handle:
+                json.dump(self.data, handle)
+            tmp.replace(self.path)
+
+    def close(self, ok):
+        """Remove the checkpoint if the transfer completed, otherwise keep
+it for the next run.
+"""
+        if ok:
+            self.path.unlink(missing_ok=True)
+        else:
+            self.save(force=True)
+            logging.debug(f'Checkpoint of {self.data["dst"]}: '
+                          f'{len(self.data["files"])} files completed')
@@ -0,0 +1,154 @@
+#!/usr/bin/python3
+
+import logging
+import os
+import pathlib
+import struct
+import threading
+
+from store import digest
+
+
+# size, mtime_ns, inode, BLAKE2b digest (zero until needed), name length
+RECORD = struct.Struct('<QqQ64sH')
+UNKNOWN = bytes(64)
+
+
+class Manifest(object):
+    """Persistent index of the files below local directories, kept in
+the file {path}. Per file, the size, mtime, inode and BLAKE2b digest are
+stored as one packed record, so hundreds of thousands of files fit into
+a few dozen MB.
+
+update() walks a directory and only keeps digests of files whose stat
+data did not change. Digests are computed on first use by digest().
+
+manifest = Manifest(settings.getStatePath('manifest'))
+manifest.update(settings.share)
+key = manifest.digest(settings.getShareDir(0) / 'file')
+manifest.save()
+"""
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        self.files = dict()
+        self.dirs = set()
+        self.occupied = set()
+        self.roots = set()
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'rb') as handle:
+                data = handle.read()
+        except OSError:
+            return
+        offset = 0
+        try:
+            while offset < len(data):
+                record = data[offset:offset + RECORD.size]
+                length = RECORD.unpack(record)[-1]
+                offset += RECORD.size
+                name = os.fsdecode(data[offset:offset + length])
+                offset += length
+                self.files[name] = record
+        except struct.error:
+            logging.debug(f'{self.path} is truncated, rebuilding it')
+            self.files.clear()
+
+    def save(self):
+        """Write the manifest atomically."""
+        tmp = self.path.with_suffix('.tmp')
+        with self.lock, open(tmp, 'wb') as handle:
+            for name, record in self.files.items():
+                handle.write(record)
+                handle.write(os.fsencode(name))
+        tmp.replace(self.path)
+
+    def update(self, directory):
+        """Bring the entries below {directory} up to date. Returns the
+paths of added or changed files and of removed ones.
+"""
+        directory = os.path.abspath(directory)
+        prefix = directory + os.sep
+        seen = set()
+        changed = list()
+        dirs = set()
+        for root, subdirs, files in os.walk(directory):
+            dirs.update(os.path.join(root, d) for d in subdirs)
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.lstat(path)
+                except OSError:
+                    continue
+                seen.add(path)
+                record = self.files.get(path)
+                if record is not None:
+                    size, mtime, inode, key, _ = RECORD.unpack(record)
+                    if (size, mtime, inode) == \
+                            (st.st_size, st.st_mtime_ns, st.st_ino):
+                        continue
+                encoded = os.fsencode(path)
+                self.files[path] = RECORD.pack(
+                    st.st_size, st.st_mtime_ns, st.st_ino, UNKNOWN,
+                    len(encoded))
+                changed.append(path)
+
+        with self.lock:
+            removed = [path for path in self.files
+                       if path.startswith(prefix) and path not in seen]
+            for path in removed:
+                del self.files[path]
+            self.dirs = set(d for d in self.dirs
+                            if not d.startswith(prefix)) | dirs
+            self.occupied = set(os.path.dirname(p)
+                                for p in self.files) | \
+                set(os.path.dirname(d) for d in self.dirs)
+            self.roots.add(directory)
+        logging.debug(f'Manifest of {directory}: {len(changed)} changed, '
+                      f'{len(removed)} removed')
+        return changed, removed
+
+    def entries(self, directory):
+        """Return (name, size, mtime_ns) of the files below {directory},
+sorted by name relative to it.
+"""
+        prefix = os.path.abspath(directory) + os.sep
+        with self.lock:
+            found = [(path[len(prefix):], record)
+                     for path, record in self.files.items()
+                     if path.startswith(prefix)]
+        return sorted((name, *RECORD.unpack(record)[:2])
+                      for name, record in found)
+
+    def isEmpty(self, directory):
+        """Return whether {directory} had no entries at the last update.
+Directories outside the updated ones are listed instead.
+"""
+        directory = os.path.abspath(directory)
+        if not any(directory == root or directory.startswith(root + os.sep)
+                   for root in self.roots):
+            return len(os.listdir(directory)) == 0
+        return directory not in self.occupied
+
+    def digest(self, path):
+        """Return the digest of the file {path}, hashing it only if it is
+not known for its current stat data.
+"""
+        path = os.path.abspath(path)
+        st = os.lstat(path)
+        record = self.files.get(path)
+        if record is not None:
+            size, mtime, inode, key, _ = RECORD.unpack(record)
+            if key != UNKNOWN and (size, mtime, inode) == \
+                    (st.st_size, st.st_mtime_ns, st.st_ino):
+                return key.hex()
+        key = digest(path)
+        encoded = os.fsencode(path)
+        with self.lock:
+            self.files[path] = RECORD.pack(
+                st.st_size, st.st_mtime_ns, st.st_ino, bytes.fromhex(key),
+                len(encoded))
+        return key
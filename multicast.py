@@ -0,0 +1,269 @@
+#!/usr/bin/python3
+"""Multicast distribution of a tar archive with NACK based repair.
+
+This module only uses the standard library: it is piped into python3 on
+the clients to run the receiver there.
+
+    python3 multicast.py receive GROUP PORT SENDER SESSION IDENT DEST [IFACE]
+
+SENDER is host:port of the distributor; an empty host means the address
+the SSH session came from.
+"""
+
+import os
+import random
+import socket
+import struct
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+
+
+MAGIC = b'LSM1'
+HEADER = struct.Struct('!4sIBII')
+RANGE = struct.Struct('!II')
+BLOCK = 1400
+
+DATA = 1
+END = 2
+HELLO = 3
+NACK = 4
+DONE = 5
+
+
+def packet(session, kind, index=0, total=0, payload=b''):
+    return HEADER.pack(MAGIC, session, kind, index, total) + payload
+
+
+def parse(data, session):
+    """Return (kind, index, total, payload) of a packet of {session} or
+None for anything else.
+"""
+    if len(data) < HEADER.size:
+        return None
+    magic, sid, kind, index, total = HEADER.unpack_from(data)
+    if magic != MAGIC or sid != session:
+        return None
+    return kind, index, total, data[HEADER.size:]
+
+
+def ranges(indices):
+    """Collapse sorted block indices into (first, last) ranges."""
+    result = list()
+    for i in indices:
+        if result and result[-1][1] == i - 1:
+            result[-1][1] = i
+        else:
+            result.append([i, i])
+    return result
+
+
+class Sender(object):
+    """Sends the file {path} to a multicast {group} and repairs losses on
+request. Create it before starting the receivers, they need {port}.
+"""
+
+    def __init__(self, path, group, port, interface='0.0.0.0', rate=50e6,
+                 session=None):
+        self.path = path
+        self.group = group
+        self.port = port
+        self.rate = rate
+        self.session = session or random.getrandbits(32)
+        self.size = os.path.getsize(path)
+        self.total = max(1, (self.size + BLOCK - 1) // BLOCK)
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((interface, 0))
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF,
+                             socket.inet_aton(interface))
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        self.address = self.sock.getsockname()
+        self.debt = 0.0
+        self.last = time.monotonic()
+        self.waiting = set()
+        self.abandoned = set()
+        # abandon() is called from other threads
+        self.lock = threading.Lock()
+
+    def pace(self, size):
+        """Sleep as needed to stay below {rate} bits per second."""
+        now = time.monotonic()
+        self.debt = max(0.0, self.debt - (now - self.last))
+        self.last = now
+        self.debt += size * 8 / self.rate
+        if self.debt > 0.002:
+            time.sleep(self.debt)
+
+    def sendBlocks(self, handle, indices):
+        for index in indices:
+            data = os.pread(handle.fileno(), BLOCK, index * BLOCK)
+            msg = packet(self.session, DATA, index, self.total, data)
+            self.sock.sendto(msg, (self.group, self.port))
+            self.pace(len(msg))
+
+    def receive(self, wait):
+        """Yield (kind, payload) of packets arriving within {wait} seconds."""
+        deadline = time.monotonic() + wait
+        while True:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return
+            self.sock.settimeout(left)
+            try:
+                data, _ = self.sock.recvfrom(65536)
+            except socket.timeout:
+                return
+            msg = parse(data, self.session)
+            if msg is not None:
+                yield msg[0], msg[3]
+
+    def abandon(self, ident):
+        """Stop waiting for the receiver {ident}, e.g. if it crashed."""
+        with self.lock:
+            self.abandoned.add(ident)
+            self.waiting.discard(ident)
+
+    def isComplete(self, done):
+        """Return whether all receivers still waited for are {done}."""
+        with self.lock:
+            return self.waiting <= done
+
+    def run(self, receivers, timeout=60, hello=10):
+        """Distribute the file to the {receivers} identifiers. Returns the
+set of receivers that confirmed the complete file within {timeout} seconds
+of repairs after the first pass, which takes as long as {rate} demands.
+"""
+        with self.lock:
+            self.waiting = set(receivers) - self.abandoned
+        done = set()
+        ready = set()
+        deadline = time.monotonic() + hello
+        while not self.isComplete(ready) and time.monotonic() < deadline:
+            for kind, payload in self.receive(0.1):
+                if kind == HELLO:
+                    ready.add(payload.partition(b'\0')[0].decode())
+
+        with open(self.path, 'rb') as handle:
+            self.sendBlocks(handle, range(self.total))
+            deadline = time.monotonic() + timeout
+            while not self.isComplete(done) and \
+                    time.monotonic() < deadline:
+                self.sock.sendto(packet(self.session, END, 0, self.total),
+                                 (self.group, self.port))
+                wanted = set()
+                for kind, payload in self.receive(0.2):
+                    ident, _, rest = payload.partition(b'\0')
+                    if kind == DONE:
+                        done.add(ident.decode())
+                    elif kind == NACK:
+                        for offset in range(0, len(rest), RANGE.size):
+                            first, last = RANGE.unpack_from(rest, offset)
+                            wanted.update(range(first,
+                                                min(last, self.total - 1) + 1))
+                self.sendBlocks(handle, sorted(wanted))
+        self.sock.close()
+        return done
+
+
+class Receiver(object):
+    """Joins {group} on {port}, reassembles the file announced by the
+sender at {sender} and extracts it as tar archive into {dest}. {loss}
+drops a share of the data packets on purpose, for testing the repair.
+"""
+
+    def __init__(self, group, port, sender, session, ident, dest,
+                 interface='0.0.0.0', loss=0.0, idle=15):
+        self.sender = sender
+        self.session = session
+        self.ident = ident.encode()
+        self.dest = dest
+        self.loss = loss
+        self.idle = idle
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('', port))
+        mreq = socket.inet_aton(group) + socket.inet_aton(interface)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                             mreq)
+        self.sock.settimeout(0.5)
+
+    def reply(self, kind, payload=b''):
+        msg = packet(self.session, kind, payload=self.ident + b'\0' + payload)
+        self.sock.sendto(msg, self.sender)
+
+    def run(self):
+        """Receive and extract the archive. Returns whether it succeeded."""
+        with tempfile.TemporaryFile() as handle:
+            if not self.collect(handle):
+                return False
+            handle.seek(0)
+            os.makedirs(self.dest, exist_ok=True)
+            with tarfile.open(fileobj=handle, mode='r:') as tar:
+                if hasattr(tarfile, 'data_filter'):
+                    tar.extractall(self.dest, filter='data')
+                else:
+                    tar.extractall(self.dest)
+        for _ in range(3):
+            self.reply(DONE)
+        return True
+
+    def collect(self, handle):
+        """Write all blocks into {handle}. Returns whether all arrived."""
+        have = None
+        count = 0
+        started = False
+        last = time.monotonic()
+        while time.monotonic() - last < self.idle:
+            if not started:
+                self.reply(HELLO)
+            try:
+                data, _ = self.sock.recvfrom(65536)
+            except socket.timeout:
+                continue
+            msg = parse(data, self.session)
+            if msg is None:
+                continue
+            kind, index, total, payload = msg
+            started = True
+            last = time.monotonic()
+            if have is None:
+                have = bytearray(total)
+
+            if kind == DATA and not have[index]:
+                if random.random() < self.loss:
+                    continue
+                os.pwrite(handle.fileno(), payload, index * BLOCK)
+                have[index] = 1
+                count += 1
+            elif kind == END:
+                if count == total:
+                    return True
+                missing = [i for i in range(total) if not have[i]]
+                payload = b''.join(RANGE.pack(first, last)
+                                   for first, last in ranges(missing)[:100])
+                self.reply(NACK, payload)
+        return False
+
+
+def main(argv):
+    if len(argv) < 7 or argv[0] != 'receive':
+        print(__doc__)
+        return 2
+    group, port, sender, session, ident, dest = argv[1:7]
+    interface = argv[7] if len(argv) > 7 else '0.0.0.0'
+    host, _, sender_port = sender.rpartition(':')
+    if host == '':
+        host = os.environ['SSH_CLIENT'].split()[0]
+    receiver = Receiver(group, int(port), (host, int(sender_port)),
+                        int(session), ident, os.path.expanduser(dest),
+                        interface)
+    return 0 if receiver.run() else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
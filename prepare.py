@@ -0,0 +1,260 @@
+#!/usr/bin/python3
+
+import ctypes
+import ctypes.util
+import hashlib
+import io
+import logging
+import os
+import pathlib
+import select
+import struct
+import subprocess
+import tarfile
+import threading
+import time
+
+from compression import CODECS, isCompressible
+
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+EVENT = struct.Struct('iIII')
+
+
+class Inotify(object):
+    """Minimal inotify binding through ctypes, Linux only. Watches are
+not recursive, see Watcher.
+"""
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'),
+                                use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.paths = dict()
+
+    def watch(self, path, mask=IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f'cannot watch {path}')
+        self.paths[wd] = str(path)
+
+    def read(self, timeout=None):
+        """Return (path, mask) of the events within {timeout} seconds."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if len(ready) == 0:
+            return list()
+        data = os.read(self.fd, 1 << 16)
+        events = list()
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & IN_IGNORED:
+                self.paths.pop(wd, None)
+                continue
+            if wd in self.paths:
+                events.append((os.path.join(self.paths[wd],
+                                            os.fsdecode(name)), mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+def header(path, arcname):
+    """Return the tar header blocks of the file {path} stored as {arcname},
+as written by tarfile.
+"""
+    tar = tarfile.TarFile(fileobj=io.BytesIO(), mode='w')
+    info = tar.gettarinfo(path, arcname=arcname)
+    return info.tobuf(tarfile.PAX_FORMAT, tarfile.ENCODING,
+                      'surrogateescape')
+
+
+class Artifacts(object):
+    """Cache of tar members compressed with {codec} ahead of time in
+{directory}. A member is only valid for the stat data of its file it was
+made from. When the cache exceeds {limit} bytes, the least recently used
+members are evicted. Compressed frames can be concatenated, so a stream of
+prepared members is streamed as is.
+
+artifacts = Artifacts(settings.getStatePath('prepared'), 'gzip', 1 << 30)
+artifacts.prepare('/path/to/file', 'file')
+frame = artifacts.lookup('/path/to/file', 'file')
+"""
+
+    def __init__(self, directory, codec='gzip', limit=1 << 30):
+        self.directory = pathlib.Path(directory)
+        self.codec = codec
+        self.limit = limit
+        self.lock = threading.Lock()
+        if not self.directory.exists():
+            self.directory.mkdir(parents=True)
+
+    def framePath(self, path, arcname):
+        st = os.stat(path)
+        key = hashlib.sha1(
+            f'{self.codec}\0{path}\0{arcname}\0{st.st_dev} {st.st_ino} '
+            f'{st.st_size} {st.st_mtime_ns}'.encode(
+                errors='surrogateescape')).hexdigest()
+        return self.directory / key
+
+    def lookup(self, path, arcname):
+        """Return the prepared member of {path} as {arcname} or None."""
+        try:
+            frame = self.framePath(path, arcname)
+            # mark as recently used
+            os.utime(frame)
+        except OSError:
+            return None
+        return frame
+
+    def prepare(self, path, arcname):
+        """Compress the tar member of {path} as {arcname} into the cache.
+Returns whether it is cached.
+"""
+        frame = self.framePath(path, arcname)
+        if frame.exists():
+            return True
+        tmp = frame.with_suffix('.tmp')
+        with open(tmp, 'wb') as out:
+            p = subprocess.Popen(CODECS[self.codec][0],
+                                 stdin=subprocess.PIPE, stdout=out)
+            try:
+                p.stdin.write(header(path, arcname))
+                size = 0
+                with open(path, 'rb') as handle:
+                    while True:
+                        data = handle.read(1 << 20)
+                        if not data:
+                            break
+                        p.stdin.write(data)
+                        size += len(data)
+                p.stdin.write(bytes(-size % tarfile.BLOCKSIZE))
+                p.stdin.close()
+            except OSError as e:
+                logging.debug(f'Cannot prepare {path}: {e}')
+                p.kill()
+            p.wait()
+        # the file must not have changed meanwhile
+        if p.returncode != 0 or self.framePath(path, arcname) != frame:
+            tmp.unlink()
+            return False
+        tmp.replace(frame)
+        self.evict()
+        return True
+
+    def compress(self, data):
+        """Return {data} compressed as a frame of its own."""
+        p = subprocess.run(CODECS[self.codec][0], input=data,
+                           stdout=subprocess.PIPE, check=True)
+        return p.stdout
+
+    def evict(self):
+        """Remove least recently used members beyond the limit."""
+        with self.lock:
+            frames = list()
+            for frame in self.directory.iterdir():
+                try:
+                    frames.append((frame.stat(), frame))
+                except OSError:
+                    pass
+            total = sum(st.st_size for st, _ in frames)
+            for st, frame in sorted(frames, key=lambda f: f[0].st_mtime):
+                if total <= self.limit:
+                    break
+                frame.unlink(missing_ok=True)
+                total -= st.st_size
+
+
+class Watcher(threading.Thread):
+    """Thread following the local {roots} with inotify while the teacher
+fills them. Files that stayed unchanged for {settle} seconds are hashed
+into the manifest.Manifest {manifest} and, if worth compressing, packed
+and compressed into {artifacts}. {roots} are (directory, level) pairs:
+archive names are relative to the folders {level} levels below the
+directory, e.g. 1 for the per-device share folders.
+
+watcher = Watcher([(settings.share, 1), (settings.shareall, 0)],
+                  manifest, artifacts)
+watcher.stop()
+"""
+
+    def __init__(self, roots, manifest, artifacts=None, threshold=0.9,
+                 settle=2.0):
+        super().__init__(daemon=True)
+        self.roots = [(str(directory), level) for directory, level in roots]
+        self.manifest = manifest
+        self.artifacts = artifacts
+        self.threshold = threshold
+        self.settle = settle
+        self.pending = dict()
+        self.running = True
+        self.start()
+
+    def arcname(self, path):
+        """Return the archive name of {path} or None."""
+        for directory, level in self.roots:
+            if path.startswith(directory + os.sep):
+                parts = os.path.relpath(path, directory).split(os.sep)
+                if len(parts) > level:
+                    return '/'.join(parts[level:])
+        return None
+
+    def watchTree(self, inotify, directory):
+        """Watch {directory} and its subfolders and queue their files."""
+        for root, dirs, files in os.walk(directory):
+            try:
+                inotify.watch(root)
+            except OSError as e:
+                logging.debug(f'{e}')
+            for name in files:
+                self.pending[os.path.join(root, name)] = 0.0
+
+    def process(self, path):
+        if not os.path.isfile(path) or os.path.islink(path):
+            return
+        self.manifest.digest(path)
+        arcname = self.arcname(path)
+        if arcname is not None and self.artifacts is not None and \
+                isCompressible(path, self.threshold):
+            self.artifacts.prepare(path, arcname)
+        logging.debug(f'Prepared {path}')
+
+    def run(self):
+        inotify = Inotify()
+        for directory, level in self.roots:
+            if os.path.isdir(directory):
+                self.watchTree(inotify, directory)
+        while self.running:
+            for path, mask in inotify.read(0.5):
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        self.watchTree(inotify, path)
+                elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                    self.pending[path] = time.monotonic()
+
+            now = time.monotonic()
+            ready = [path for path, since in self.pending.items()
+                     if now - since >= self.settle]
+            for path in ready:
+                del self.pending[path]
+                try:
+                    self.process(path)
+                except OSError as e:
+                    logging.debug(f'Cannot prepare {path}: {e}')
+            if len(ready) > 0:
+                self.manifest.save()
+        inotify.close()
+
+    def stop(self):
+        self.running = False
+        self.join()
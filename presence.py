@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+import time
+
+from discovery import sweep
+
+
+class PresenceMap(object):
+    """Thread-safe reachability map holding (status, timestamp) per device."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = dict()
+
+    def update(self, device, status, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        with self.lock:
+            self.entries[device] = (status, timestamp)
+
+    def expire(self):
+        """Forget all entries, so they count as stale."""
+        with self.lock:
+            self.entries.clear()
+
+    def snapshot(self):
+        """Return {device: (status, age)} with the age in seconds."""
+        now = time.time()
+        with self.lock:
+            return {device: (status, now - timestamp)
+                    for device, (status, timestamp) in self.entries.items()}
+
+
+class PresenceHandler(socketserver.StreamRequestHandler):
+    """Send the current map as a single JSON line and close."""
+
+    def handle(self):
+        snapshot = self.server.presence.snapshot()
+        data = {str(device): entry for device, entry in snapshot.items()}
+        self.wfile.write(json.dumps(data).encode() + b'\n')
+
+
+class PresenceServer(socketserver.ThreadingMixIn,
+                     socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class PresenceService(threading.Thread):
+    """Keeps a live reachability map of all configured devices by probing
+them every {interval} seconds and serves it over the Unix socket {path}.
+
+service = PresenceService(settings, path)
+# later
+service.stop()
+"""
+
+    def __init__(self, settings, path, interval=10, timeout=1.0):
+        super().__init__(daemon=True)
+        self.settings = settings
+        self.path = str(path)
+        self.interval = interval
+        self.timeout = timeout
+        self.presence = PresenceMap()
+        self.stopped = threading.Event()
+
+        # remove socket left behind by a crashed service
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.server = PresenceServer(self.path, PresenceHandler)
+        self.server.presence = self.presence
+        self.serving = threading.Thread(
+            target=self.server.serve_forever, daemon=True)
+        self.serving.start()
+
+        self.start()
+
+    def probe(self):
+        """Sweep all devices once and update the map."""
+        targets = dict()
+        for device in range(self.settings.num_clients):
+            targets[device] = self.settings.getIp(device)
+        sweep(targets, self.settings.probe, self.settings.remote_port,
+              self.timeout, self.presence.update)
+
+    def run(self):
+        """Probe periodically until stopped. If the thread ends, the map is
+expired, so clients do not rely on outdated entries.
+"""
+        try:
+            while not self.stopped.is_set():
+                try:
+                    self.probe()
+                except Exception:
+                    logging.exception('Presence probe failed')
+                self.stopped.wait(self.interval)
+        finally:
+            self.presence.expire()
+
+    def stop(self):
+        self.stopped.set()
+        self.server.shutdown()
+        self.server.server_close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.join()
+
+
+def query(path, timeout=0.2):
+    """Read the reachability map from a running service. Returns
+{device: (status, age)} or None if no service is listening on {path}.
+"""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(str(path))
+            data = b''
+            while not data.endswith(b'\n'):
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+    except OSError:
+        return None
+
+    try:
+        data = json.loads(data)
+    except ValueError:
+        return None
+    return {int(device): (status, age)
+            for device, (status, age) in data.items()}
+
+
+def split(snapshot, devices, ttl):
+    """Partition {devices} using a snapshot of the map. Returns lists of
+fresh available, fresh missing and stale devices. Entries older than {ttl}
+seconds count as stale.
+"""
+    available = list()
+    missing = list()
+    stale = list()
+    for device in devices:
+        entry = snapshot.get(device)
+        if entry is None or entry[1] > ttl:
+            stale.append(device)
+        elif entry[0]:
+            available.append(device)
+        else:
+            missing.append(device)
+    return available, missing, stale
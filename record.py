@@ -0,0 +1,72 @@
+#!/usr/bin/python3
+
+import datetime
+import json
+import pathlib
+
+
+class ResultRecord(object):
+    """Keeps the outcome per device of the last run of every operation in
+the JSON file {path}, so failed transfers can be repeated alone.
+
+record = ResultRecord(settings.getStatePath('results.json'))
+record.save('fetch', {0: True, 1: False, 2: None})
+record.failed()  # ('fetch', [1, 2])
+record.sizes('fetch')  # {0: 1024}, bytes transferred per device
+"""
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+
+    def load(self):
+        try:
+            with open(self.path) as handle:
+                return json.load(handle)
+        except (OSError, ValueError):
+            return dict()
+
+    def save(self, operation, results, sizes=None, traffic=None):
+        """Store {results}, a dict mapping devices to True on success,
+False on failure and None if unreachable, as last run of {operation}.
+The bytes transferred per device in the dict {sizes} are merged into
+those known from earlier runs. {traffic} maps devices to the bytes before
+and after compression of this run.
+"""
+        names = {True: 'ok', False: 'failed', None: 'missing'}
+        data = self.load()
+        known = data.get(operation, dict()).get('sizes', dict())
+        known.update({str(device): size
+                      for device, size in (sizes or dict()).items()})
+        data['last'] = operation
+        data[operation] = {
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'devices': {str(device): names[status]
+                        for device, status in sorted(results.items())},
+            'sizes': known,
+            'traffic': {str(device): {'raw': raw, 'sent': sent}
+                        for device, (raw, sent)
+                        in sorted((traffic or dict()).items())}
+        }
+        tmp = self.path.with_suffix('.tmp')
+        with open(tmp, 'w') as handle:
+            json.dump(data, handle, indent=2)
+        tmp.replace(self.path)
+
+    def failed(self, operation=None):
+        """Return the name of the {operation}, by default the last one, and
+the devices it failed on or could not reach.
+"""
+        data = self.load()
+        if operation is None:
+            operation = data.get('last')
+        devices = data.get(operation, dict()).get('devices', dict())
+        return operation, sorted(int(device) for device, status
+                                 in devices.items() if status != 'ok')
+
+    def sizes(self, operation):
+        """Return the bytes transferred per device by earlier runs of
+{operation}.
+"""
+        data = self.load()
+        known = data.get(operation, dict()).get('sizes', dict())
+        return {int(device): size for device, size in known.items()}
@@ -0,0 +1,175 @@
+#!/usr/bin/python3
+
+import logging
+import os
+import shlex
+import subprocess
+import threading
+import time
+
+from connection import splitRemote, quoteRemote
+from transfer import TransferWorker
+
+
+def listEntries(src):
+    """Return all paths below the local directory {src}, relative to it."""
+    names = list()
+    for root, dirs, files in os.walk(src):
+        dirs.sort()
+        for name in dirs + sorted(files):
+            names.append(os.path.relpath(os.path.join(root, name), src))
+    return names
+
+
+class RelayWorker(TransferWorker):
+    """Thread to let a device forward what it received to another device.
+{src} and {dst} are the exchange directories of both devices, {names} the
+shared paths inside them. The devices connect to each other via SSH, so
+the clients need key based logins among themselves.
+
+If the forwarding failed, {parentFailed} tells whether the source device
+itself cannot be reached anymore.
+"""
+
+    def __init__(self, src, dst, names, port=22, timeout=3, pool=None):
+        self.names = names
+        self.parentFailed = False
+        super().__init__(src, dst, port, timeout, pool)
+
+    def run(self):
+        """Trigger the forwarding on the source device."""
+        parent, path = splitRemote(self.src)
+        child, target = splitRemote(self.dst)
+        unpack = f'mkdir -p {quoteRemote(target)} && ' \
+            f'tar -C {quoteRemote(target)} -xf -'
+        forward = shlex.join([
+            'ssh', '-o', 'BatchMode=yes', '-o',
+            f'ConnectTimeout={self.timeout}', '-p', str(self.port), child,
+            unpack])
+        command = f'cd {quoteRemote(path)} && ' \
+            f'tar --null --no-recursion -T - -cf - | {forward}'
+        cmd = self.ssh(parent, command)
+        logging.debug(' '.join(cmd))
+        names = b''.join(os.fsencode(name) + b'\0' for name in self.names)
+        p = subprocess.run(cmd, input=names, stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL)
+        self.status = self.exited(p)
+        if not self.status:
+            # both ssh hops exit with 255, so ask the source directly
+            p = subprocess.run(self.ssh(parent, 'true'),
+                               stdin=subprocess.DEVNULL,
+                               stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+            self.parentFailed = p.returncode != 0
+
+
+def relay(results, src, dst_lambda, remote_port, progress, total, fanout=3,
+          attempts=3, delay=0.1, pool=None, transport=TransferWorker,
+          limit=0, backoff=1.0, record=None):
+    """Distribute the local directory {src} to every device reported
+reachable by {results} along a relay tree. The teacher and every device
+that already received the files serve up to {fanout} devices at once, so
+the depth grows logarithmically with the number of devices. A device whose
+relay failed is attached to another parent, at most {attempts} times,
+waiting {backoff} seconds doubled after every try. A parent is retired
+once it is unreachable itself or failed to serve two different devices.
+At most {limit} transfers run at once in the whole tree, 0 means no limit.
+The final status of each device is stored into the dict {record}, if
+given, like in pipeline. Returns lists of available and missing devices.
+"""
+    names = listEntries(src)
+    pending = list()
+    missing = list()
+    lock = threading.Lock()
+
+    def feed():
+        for device, status in results:
+            with lock:
+                if status:
+                    pending.append(device)
+                else:
+                    missing.append(device)
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+
+    # sources with their number of running transfers, None is the teacher
+    load = {None: 0}
+    retired = set()
+    failures = dict()
+    edges = dict()
+    tries = dict()
+    due = dict()
+    done = list()
+    failed = list()
+
+    while True:
+        feeding = feeder.is_alive()
+
+        # collect finished transfers
+        for device, (parent, w) in list(edges.items()):
+            if w.is_alive():
+                continue
+            del edges[device]
+            load[parent] -= 1
+            if w.status:
+                done.append(device)
+                load[device] = 0
+                continue
+            logging.debug(f'Relay {parent} -> {device} failed')
+            if parent is not None:
+                failures.setdefault(parent, set()).add(device)
+                # do not use a parent that cannot forward again
+                if w.parentFailed or len(failures[parent]) > 1:
+                    retired.add(parent)
+            if tries[device] < attempts:
+                due[device] = time.monotonic() + \
+                    backoff * 2 ** (tries[device] - 1)
+                with lock:
+                    pending.append(device)
+            else:
+                failed.append(device)
+
+        # attach pending devices to the least loaded sources
+        now = time.monotonic()
+        with lock:
+            for device in list(pending):
+                if limit > 0 and len(edges) >= limit:
+                    break
+                if due.get(device, 0) > now:
+                    continue
+                # not again through a parent that failed this device
+                sources = [s for s in load if s not in retired and
+                           device not in failures.get(s, ())]
+                parent = min(sources, key=lambda s: (load[s], s is None))
+                if load[parent] >= fanout:
+                    break
+                pending.remove(device)
+                tries[device] = tries.get(device, 0) + 1
+                load[parent] += 1
+                dst = dst_lambda(device)
+                if parent is None:
+                    w = transport(src, dst, remote_port, pool=pool)
+                else:
+                    w = RelayWorker(dst_lambda(parent), dst, names,
+                                    remote_port, pool=pool)
+                edges[device] = (parent, w)
+            waiting = len(pending)
+
+        if progress.is_alive():
+            progress((len(done) + len(failed) + len(missing)) / max(total, 1))
+        if not feeding and len(edges) == 0 and waiting == 0:
+            break
+        time.sleep(delay)
+    progress.finish()
+
+    if record is not None:
+        record.update(dict.fromkeys(missing))
+        record.update(dict.fromkeys(done, True))
+        record.update(dict.fromkeys(failed, False))
+    if len(failed) > 0:
+        raise SystemExit(
+            f'{len(failed)} von {len(done) + len(failed)} Übertragungen '
+            'sind fehlgeschlagen.')
+
+    return done, missing
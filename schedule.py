@@ -0,0 +1,102 @@
+#!/usr/bin/python3
+
+import heapq
+import logging
+import os
+import threading
+
+from connection import splitRemote, quoteRemote
+
+
+def localSize(path):
+    """Return the total size of the files below the local {path}."""
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def remoteSize(pool, remote, port=22):
+    """Return the total size of the files below the remote path {remote},
+e.g. 'schueler@192.168.2.100:~/Austausch', or None if unknown.
+"""
+    login, path = splitRemote(remote)
+    p = pool.run(login, port, f'du -sb {quoteRemote(path)}')
+    if p.returncode != 0:
+        return None
+    try:
+        return int(p.stdout.split()[0])
+    except (IndexError, ValueError):
+        return None
+
+
+def preflight(devices, path_lambda):
+    """Measure the local payload {path_lambda} gives for each device in
+parallel. Returns a dict mapping devices to bytes.
+"""
+    sizes = dict()
+    lock = threading.Lock()
+
+    def measure(device):
+        size = localSize(path_lambda(device))
+        with lock:
+            sizes[device] = size
+
+    threads = [threading.Thread(target=measure, args=(device,))
+               for device in devices]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    logging.debug(f'Preflight sizes: {sizes}')
+    return sizes
+
+
+def measureFound(results, path_lambda, sizes, pool, port=22):
+    """Pass on the (device, status) pairs of {results} and measure the
+remote directory {path_lambda} gives for each reachable device in the
+background, through its session in the connection {pool}. Known sizes
+are updated in the dict {sizes} as they arrive, so devices still waiting
+for a transfer are ordered by them.
+"""
+    def measure(device):
+        size = remoteSize(pool, str(path_lambda(device)), port)
+        if size is not None:
+            sizes[device] = size
+            logging.debug(f'Device {device} holds {size} bytes')
+
+    for device, status in results:
+        if status:
+            threading.Thread(target=measure, args=(device,),
+                             daemon=True).start()
+        yield device, status
+
+
+def makespan(sizes, limit=0, throughput=10e6):
+    """Estimate the seconds needed to transfer {sizes} largest first with
+at most {limit} concurrent transfers sharing {throughput} bytes per
+second.
+"""
+    jobs = sorted((size for size in sizes if size > 0), reverse=True)
+    if len(jobs) == 0:
+        return 0.0
+    slots = len(jobs) if limit <= 0 else min(limit, len(jobs))
+    # each transfer gets its share of the link, the longest slot finishes last
+    loads = [0] * slots
+    for size in jobs:
+        heapq.heappush(loads, heapq.heappop(loads) + size)
+    return max(loads) * slots / throughput
+
+
+def duration(seconds):
+    """Return a rough German description of {seconds}."""
+    if seconds < 60:
+        return 'weniger als eine Minute'
+    minutes = round(seconds / 60)
+    if minutes == 1:
+        return 'etwa eine Minute'
+    return f'etwa {minutes} Minuten'
@@ -18,6 +18,42 @@ def input_default(msg, default):
 class Settings(object):
     """Holds configuration details."""
 
+    # defaults for options missing in older settings files
+    remote_port = 22
+    probe = 'icmp'
+    persist = 60
+    transfer_mode = 'scp'
+    codec = 'gzip'
+    compress_threshold = 0.9
+    snapshots = False
+    dedup = False
+    ingest_zip = False
+    zip_level = 6
+    zip_workers = 0
+    cache = False
+    cache_size = 4096
+    relay_fanout = 0
+    max_workers = 8
+    retries = 2
+    backoff = 1.0
+    throughput = 10
+    bandwidth = 0
+    device_bandwidth = 0
+    chunk_threshold = 256
+    chunk_streams = 4
+    chunk_pooled = False
+    resume = True
+    verify = False
+    prepared_size = 1024
+    fanout = True
+    fanout_window = 16
+    multicast = False
+    multicast_group = '239.255.76.83'
+    multicast_port = 47600
+    multicast_rate = 50
+    presence_interval = 10
+    presence_ttl = 30
+
     def getPrefDir(self, appname='lan_share'):
         """Return path to ~/.local/share/<appname>/settings.cfg"""
         # setup filename
@@ -33,6 +69,11 @@ class Settings(object):
 
         return p / 'settings.cfg'
 
+    def getStatePath(self, name):
+        """Return path to ~/.local/share/<appname>/<name> next to the
+settings file."""
+        return self.getPrefDir().parent / name
+
     def loadFromFile(self, fname):
         cfg = configparser.ConfigParser()
         if not fname.exists():
@@ -43,12 +84,71 @@ class Settings(object):
         self.num_clients = int(cfg['network']['num_clients'])
         self.user = cfg['network']['user']
         self.remote_port = cfg['network']['remote_port']
+        self.probe = cfg['network'].get('probe', self.probe)
+        self.persist = cfg['network'].getint('persist', self.persist)
 
         self.folder_prefix = cfg['folders']['prefix']
         self.exchange = pathlib.Path(cfg['folders']['exchange'])
         self.share = pathlib.Path(cfg['folders']['share'])
         self.fetch = pathlib.Path(cfg['folders']['fetch'])
         self.shareall = pathlib.Path(cfg['folders']['shareall'])
+        self.snapshots = cfg['folders'].getboolean(
+            'snapshots', self.snapshots)
+        self.dedup = cfg['folders'].getboolean('dedup', self.dedup)
+        self.ingest_zip = cfg['folders'].getboolean(
+            'ingest_zip', self.ingest_zip)
+        self.zip_level = cfg['folders'].getint('zip_level', self.zip_level)
+        self.zip_workers = cfg['folders'].getint(
+            'zip_workers', self.zip_workers)
+
+        if cfg.has_section('transfer'):
+            self.transfer_mode = cfg['transfer'].get(
+                'mode', self.transfer_mode)
+            self.codec = cfg['transfer'].get('codec', self.codec)
+            self.compress_threshold = cfg['transfer'].getfloat(
+                'compress_threshold', self.compress_threshold)
+            self.cache = cfg['transfer'].getboolean('cache', self.cache)
+            self.cache_size = cfg['transfer'].getint(
+                'cache_size', self.cache_size)
+            self.relay_fanout = cfg['transfer'].getint(
+                'relay_fanout', self.relay_fanout)
+            self.max_workers = cfg['transfer'].getint(
+                'max_workers', self.max_workers)
+            self.retries = cfg['transfer'].getint('retries', self.retries)
+            self.backoff = cfg['transfer'].getfloat('backoff', self.backoff)
+            self.throughput = cfg['transfer'].getfloat(
+                'throughput', self.throughput)
+            self.bandwidth = cfg['transfer'].getfloat(
+                'bandwidth', self.bandwidth)
+            self.device_bandwidth = cfg['transfer'].getfloat(
+                'device_bandwidth', self.device_bandwidth)
+            self.chunk_threshold = cfg['transfer'].getint(
+                'chunk_threshold', self.chunk_threshold)
+            self.chunk_streams = cfg['transfer'].getint(
+                'chunk_streams', self.chunk_streams)
+            self.chunk_pooled = cfg['transfer'].getboolean(
+                'chunk_pooled', self.chunk_pooled)
+            self.resume = cfg['transfer'].getboolean('resume', self.resume)
+            self.verify = cfg['transfer'].getboolean('verify', self.verify)
+            self.prepared_size = cfg['transfer'].getint(
+                'prepared_size', self.prepared_size)
+            self.fanout = cfg['transfer'].getboolean('fanout', self.fanout)
+            self.fanout_window = cfg['transfer'].getint(
+                'fanout_window', self.fanout_window)
+            self.multicast = cfg['transfer'].getboolean(
+                'multicast', self.multicast)
+            self.multicast_group = cfg['transfer'].get(
+                'multicast_group', self.multicast_group)
+            self.multicast_port = cfg['transfer'].getint(
+                'multicast_port', self.multicast_port)
+            self.multicast_rate = cfg['transfer'].getfloat(
+                'multicast_rate', self.multicast_rate)
+
+        if cfg.has_section('presence'):
+            self.presence_interval = cfg['presence'].getfloat(
+                'interval', self.presence_interval)
+            self.presence_ttl = cfg['presence'].getfloat(
+                'ttl', self.presence_ttl)
 
     def saveToFile(self, fname):
         cfg = configparser.ConfigParser()
@@ -56,14 +156,51 @@ class Settings(object):
             'first_ip': self.first_ip,
             'num_clients': self.num_clients,
             'user': self.user,
-            'remote_port': self.remote_port
+            'remote_port': self.remote_port,
+            'probe': self.probe,
+            'persist': self.persist
         }
         cfg['folders'] = {
             'prefix': self.folder_prefix,
             'exchange': self.exchange,
             'share': self.share,
             'fetch': self.fetch,
-            'shareall': self.shareall
+            'shareall': self.shareall,
+            'snapshots': self.snapshots,
+            'dedup': self.dedup,
+            'ingest_zip': self.ingest_zip,
+            'zip_level': self.zip_level,
+            'zip_workers': self.zip_workers
+        }
+        cfg['transfer'] = {
+            'mode': self.transfer_mode,
+            'codec': self.codec,
+            'compress_threshold': self.compress_threshold,
+            'cache': self.cache,
+            'cache_size': self.cache_size,
+            'relay_fanout': self.relay_fanout,
+            'max_workers': self.max_workers,
+            'retries': self.retries,
+            'backoff': self.backoff,
+            'throughput': self.throughput,
+            'bandwidth': self.bandwidth,
+            'device_bandwidth': self.device_bandwidth,
+            'chunk_threshold': self.chunk_threshold,
+            'chunk_streams': self.chunk_streams,
+            'chunk_pooled': self.chunk_pooled,
+            'resume': self.resume,
+            'verify': self.verify,
+            'prepared_size': self.prepared_size,
+            'fanout': self.fanout,
+            'fanout_window': self.fanout_window,
+            'multicast': self.multicast,
+            'multicast_group': self.multicast_group,
+            'multicast_port': self.multicast_port,
+            'multicast_rate': self.multicast_rate
+        }
+        cfg['presence'] = {
+            'interval': self.presence_interval,
+            'ttl': self.presence_ttl
         }
 
         with open(fname, 'w') as handle:
@@ -86,6 +223,17 @@ class Settings(object):
         self.remote_port = int(
             input_default(
                 'Remote port number [32400]:', 32400))
+        self.probe = input_default(
+            'Discovery probe, icmp or tcp [icmp]: ', 'icmp')
+
+        # query transfer settings, settings files of older versions keep scp
+        self.transfer_mode = input_default(
+            'Transfer mode, scp, tar or rsync (tar and rsync need them on '
+            'the clients) [tar]: ', 'tar')
+        if self.transfer_mode == 'tar':
+            self.verify = input_default(
+                'Verify files with hashes, needs python3 on the clients '
+                '[y]: ', 'y').lower().startswith('y')
 
         # query folder settings
         self.folder_prefix = input_default(
@@ -153,6 +301,20 @@ class Settings(object):
         else:
             return self.share / self.getDirName(device)
 
+    def getLogin(self, device):
+        """Return SSH login of a device."""
+        return f'{self.user}@{self.getIp(device)}'
+
     def getExchangeDir(self, device):
         """Return remote path to device's exchange directory."""
-        return f'{self.user}@{self.getIp(device)}:{self.exchange}'
+        return f'{self.getLogin(device)}:{self.exchange}'
+
+    def getCacheDir(self):
+        """Return remote path of the hidden content cache next to the
+exchange directory, e.g. ~/Schreibtisch/.Austausch.cache"""
+        return self.exchange.parent / f'.{self.exchange.name}.cache'
+
+    def getStageDir(self):
+        """Return remote path of the hidden staging directory next to the
+exchange directory, e.g. ~/Schreibtisch/.Austausch.stage"""
+        return self.exchange.parent / f'.{self.exchange.name}.stage'
@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+
+import datetime
+import os
+import pathlib
+
+from archive import ZipWriter
+
+
+STAMP_FORMAT = '%Y-%m-%d_%H-%M-%S'
+
+
+def stamp(now=None):
+    """Return the directory name of a snapshot taken {now}."""
+    if now is None:
+        now = datetime.datetime.now()
+    return now.strftime(STAMP_FORMAT)
+
+
+def snapshots(directory):
+    """Return all snapshot directories inside {directory}, oldest first."""
+    directory = pathlib.Path(directory)
+    if not directory.is_dir():
+        return list()
+    found = list()
+    for entry in directory.iterdir():
+        try:
+            datetime.datetime.strptime(entry.name, STAMP_FORMAT)
+        except ValueError:
+            continue
+        if entry.is_dir():
+            found.append(entry)
+    return sorted(found)
+
+
+def latest(directory, exclude=None):
+    """Return the newest snapshot inside {directory} other than {exclude},
+or None.
+"""
+    found = [s for s in snapshots(directory) if s != exclude]
+    if len(found) == 0:
+        return None
+    return found[-1]
+
+
+def linkUnchanged(reference, target, name, size, mtime):
+    """Hardlink {name} from the {reference} snapshot into {target} if it
+has the given {size} and {mtime}. Returns whether the file was linked.
+"""
+    src = os.path.join(reference, name)
+    try:
+        stat = os.stat(src, follow_symlinks=False)
+    except OSError:
+        return False
+    if stat.st_size != size or abs(stat.st_mtime - mtime) >= 1:
+        return False
+
+    dst = os.path.join(target, name)
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    try:
+        os.link(src, dst)
+    except FileExistsError:
+        os.unlink(dst)
+        os.link(src, dst)
+    return True
+
+
+def archive(zipname, directory, name, level=6, workers=1):
+    """Write the snapshot {name} of every device folder in {directory}
+into the ZIP file {zipname}, using the device folders as top level. The
+{level} and number of {workers} are passed to ZipWriter.
+"""
+    directory = pathlib.Path(directory)
+    with ZipWriter(zipname, level, workers) as zw:
+        for device in sorted(directory.iterdir()):
+            root = device / name
+            if root.is_dir():
+                zw.writeTree(root, device.name)
@@ -0,0 +1,139 @@
+#!/usr/bin/python3
+
+import hashlib
+import logging
+import os
+import subprocess
+
+from connection import splitRemote, quoteRemote
+from transfer import TransferWorker
+
+
+def listing(directory):
+    """Return (name, size, mtime_ns) of the files below {directory}, sorted
+by name relative to it.
+"""
+    entries = list()
+    for root, dirs, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            st = os.lstat(path)
+            entries.append((os.path.relpath(path, directory), st.st_size,
+                            st.st_mtime_ns))
+    return sorted(entries)
+
+
+def fingerprint(directories, manifest=None):
+    """Return a short hash of names, sizes and modification times of all
+entries below the local {directories}. They are read from the updated
+manifest.Manifest {manifest}, if given, instead of the disk.
+"""
+    h = hashlib.sha1()
+    for index, directory in enumerate(directories):
+        if manifest is not None:
+            entries = manifest.entries(directory)
+        else:
+            entries = listing(directory)
+        for rel, size, mtime in entries:
+            h.update(f'{index} {rel} {size} {mtime}\0'
+                     .encode(errors='surrogateescape'))
+    return h.hexdigest()[:16]
+
+
+class StageWorker(TransferWorker):
+    """Thread uploading the local directories {src} into the hidden
+staging directory {dst} of a device. Each directory is sent by a
+{transport} worker, e.g. TarWorker. When all arrived, the fingerprint of
+the sources is written into {dst}/.complete. A failed upload removes {dst}
+again, so no partial state is left on the device.
+
+Checkpoints of the {transport} in the journal.Journal {journal} are
+dropped whenever the staging directory is removed, so an upload never
+skips files that are gone.
+"""
+
+    def __init__(self, src, dst, port=22, timeout=3, pool=None,
+                 transport=TransferWorker, manifest=None, journal=None):
+        self.transport = transport
+        self.journal = journal
+        super().__init__(src, dst, port, timeout, pool, manifest=manifest)
+
+    def remote(self, login, command):
+        cmd = self.ssh(login, command)
+        logging.debug(' '.join(cmd))
+        p = subprocess.run(cmd, stdin=subprocess.DEVNULL,
+                           stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL)
+        return self.exited(p)
+
+    def discard(self, login, path):
+        """Remove the staging directory {path} of the device and the
+checkpoints of uploads into it."""
+        ok = self.remote(login, f'rm -rf {quoteRemote(path)}')
+        if self.journal is not None:
+            for src in self.src:
+                self.journal.open(src, f'{login}:{path}/data').close(True)
+        return ok
+
+    def run(self):
+        login, path = splitRemote(self.dst)
+        stage = quoteRemote(path)
+        self.status = self.discard(login, path) and \
+            self.remote(login, f'mkdir -p {stage}/data')
+        for src in self.src:
+            if not self.status:
+                break
+            w = self.transport(src, f'{login}:{path}/data', self.port,
+                               pool=self.pool)
+            w.join()
+            self.status = bool(w.status)
+            self.code = w.code
+            self.raw += w.raw
+            self.sent += w.sent
+        if self.status:
+            self.status = self.remote(
+                login, f'echo {fingerprint(self.src, self.manifest)} > '
+                f'{stage}/.complete')
+        if not self.status:
+            self.discard(login, path)
+
+
+class CommitWorker(StageWorker):
+    """Thread making the files staged in {stage} visible in the exchange
+directory {dst} of a device. Files are hardlinked into place and the
+staging directory removed, so no content is copied. If the device did not
+stage the current state of the local directories {src}, they are sent
+by {transport} instead and the outdated staging directory is removed.
+"""
+
+    def __init__(self, src, dst, port=22, timeout=3, pool=None,
+                 transport=TransferWorker, stage=None, manifest=None,
+                 journal=None):
+        self.stage = stage
+        self.staged = False
+        super().__init__(src, dst, port, timeout, pool, transport, manifest,
+                         journal)
+
+    def run(self):
+        login, path = splitRemote(self.dst)
+        stage = quoteRemote(self.stage)
+        exchange = quoteRemote(path)
+        self.staged = self.remote(
+            login, f'[ "$(cat {stage}/.complete 2>/dev/null)" = '
+            f'{fingerprint(self.src, self.manifest)} ] && '
+            f'mkdir -p {exchange} && '
+            f'cp -alf {stage}/data/. {exchange}/')
+        self.discard(login, self.stage)
+        if self.staged:
+            self.status = True
+            return
+
+        logging.debug(f'{login} missed staging, sending now')
+        self.status = True
+        for src in self.src:
+            w = self.transport(src, self.dst, self.port, pool=self.pool)
+            w.join()
+            self.status = self.status and bool(w.status)
+            self.code = w.code or self.code
+            self.raw += w.raw
+            self.sent += w.sent
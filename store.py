@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+
+import hashlib
+import logging
+import os
+import pathlib
+import shutil
+
+
+def digest(path, size=1 << 20):
+    """Return the BLAKE2b hex digest of the file {path}."""
+    h = hashlib.blake2b()
+    with open(path, 'rb') as handle:
+        while True:
+            chunk = handle.read(size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class Store(object):
+    """Content-addressed store below {root}. Every distinct content is kept
+once as blob and the fetched files become hardlinks to their blob, so 30
+copies of a handout cost the disk space of one.
+
+Hardlinked copies share their content: edit collected files by saving a
+new file, not in place.
+
+store = Store(settings.fetch / '.store')
+store.ingestTree(settings.getFetchDir(2))
+"""
+
+    def __init__(self, root):
+        self.root = pathlib.Path(root)
+        if not self.root.exists():
+            self.root.mkdir(parents=True)
+
+    def blobPath(self, key):
+        return self.root / key[:2] / key[2:]
+
+    def ingest(self, path):
+        """Hash {path} and replace it by a hardlink to its blob. Returns
+the digest.
+"""
+        key = digest(path)
+        blob = self.blobPath(key)
+        if not blob.exists():
+            blob.parent.mkdir(exist_ok=True)
+            os.link(path, blob)
+        elif not os.path.samefile(path, blob):
+            tmp = f'{path}.store'
+            os.link(blob, tmp)
+            os.replace(tmp, path)
+        return key
+
+    def ingestTree(self, directory):
+        """Ingest all regular files below {directory}. Returns a dict
+mapping relative paths to digests.
+"""
+        digests = dict()
+        for root, dirs, files in os.walk(directory):
+            for name in files:
+                path = os.path.join(root, name)
+                if os.path.islink(path):
+                    continue
+                try:
+                    digests[os.path.relpath(path, directory)] = \
+                        self.ingest(path)
+                except OSError as e:
+                    logging.debug(f'Cannot ingest {path}: {e}')
+        return digests
+
+    def release(self, directory):
+        """Replace the hardlinks below {directory} by copies of their own,
+so a transfer writing into the files in place, e.g. scp, cannot change
+the blobs and the other copies.
+"""
+        for root, dirs, files in os.walk(directory):
+            for name in files:
+                path = os.path.join(root, name)
+                if os.path.islink(path) or os.stat(path).st_nlink == 1:
+                    continue
+                tmp = f'{path}.store'
+                shutil.copy2(path, tmp)
+                os.replace(tmp, path)
+
+    def prune(self):
+        """Remove blobs no fetched file links to anymore."""
+        for blob in self.root.glob('*/*'):
+            if blob.stat().st_nlink == 1:
+                blob.unlink()
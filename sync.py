@@ -4,81 +4,287 @@ import sys
 import os
 import logging
 import datetime
-import shutil
+import functools
 
 from settings import Settings
-from discovery import discover
-from transfer import batch
+from archive import Collector, build
+from connection import ConnectionPool
+from discovery import stream
+from presence import PresenceService, query, split
+import snapshot
+from store import Store
+from trash import Trash
+from manifest import Manifest
+from prepare import Watcher
+from transfer import artifactsFor, budgetFor, journalFor, pipeline, \
+    transportFor
+from record import ResultRecord
+from schedule import duration, makespan, measureFound, preflight
+from relay import relay
+from broadcast import broadcast
+from fanout import fanout
+from staging import StageWorker, CommitWorker
 from args import CliArgs
-from ui import ProgressBar, ask, confirm, choose, notify
+from ui import ProgressBar, ask, choose, notify
 
-def queryDevices(settings):
-    """Discover all available devices and warn if not every device is
-reachable. Returns a list of available device IDs.
+def connectionPool(settings):
+    """Return the pool of SSH sessions shared by all remote operations."""
+    return ConnectionPool(settings.getStatePath('ssh'), settings.persist)
+
+
+def streamDevices(settings, pool=None, devices=None):
+    """Yield (device, status) pairs for the {devices}, by default all
+configured devices, as soon as their reachability is known.
+
+If the presence service is running, its fresh entries are yielded at once
+and only stale entries are probed on demand.
+"""
+    if devices is None:
+        devices = list(range(settings.num_clients))
+    snapshot = query(settings.getStatePath('presence.sock'))
+    if snapshot is None:
+        available, missing, stale = list(), list(), devices
+    else:
+        available, missing, stale = split(
+            snapshot, devices, settings.presence_ttl)
+        logging.debug(f'Stale presence entries: {stale}')
+
+    for device in available:
+        yield device, True
+    for device in missing:
+        yield device, False
+    if len(stale) > 0:
+        yield from stream(settings, stale, pool=pool)
+
+
+def transferAll(settings, src, dst, title, method='pipeline',
+                transport=None, operation=None, devices=None, sizes=None,
+                done=None, measure=False):
+    """Transfer to or from the {devices}, by default all devices, as soon as
+they are discovered. Unreachable devices are reported at the end. Returns
+a list of available device IDs. The workers are created by {transport},
+by default the one of the configured transfer mode.
+
+The common share-all folder can be distributed by other {method}s:
+'relay' lets devices that received the files forward them to others,
+'multicast' sends them once to all devices and 'fanout' reads them once
+for all device streams.
+
+The outcome per device is recorded under the name of the {operation} for
+--retry-failed, with the bytes transferred for the next {sizes}. Devices
+with the largest payload in the dict {sizes} are served first. With
+{measure}, the remote sources are measured as soon as a device is found
+and update these sizes, see schedule.measureFound. {done} is called with
+each device whose transfer finished, see pipeline.
 """
-    # show progress bar while discovering devices
-    progress = ProgressBar(
-        'Suche Schülercomputer',
-        '{0}% durchsucht. Bitte warten...')
-    available, missing = discover(settings, progress)
+    if devices is None:
+        devices = list(range(settings.num_clients))
+    pool = connectionPool(settings)
+    progress = ProgressBar(title, '{0}% abgeschlossen. Bitte warten …')
+    results = streamDevices(settings, pool, devices)
+    if measure:
+        sizes = dict(sizes or dict())
+        results = measureFound(results, src, sizes, pool,
+                               settings.remote_port)
+    record = dict()
+    measured = dict()
+    traffic = dict()
+
+    def finished(device, worker):
+        if worker.status:
+            measured[device] = worker.raw
+        if done is not None:
+            done(device, worker)
+    try:
+        if method == 'fanout':
+            available, missing = fanout(
+                results, src(None), dst, settings.remote_port, progress,
+                len(devices), settings.codec, settings.compress_threshold,
+                settings.fanout_window << 20, pool=pool,
+                budget=budgetFor(settings), verify=settings.verify,
+                limit=settings.max_workers, attempts=settings.retries + 1,
+                backoff=settings.backoff, transport=transportFor(settings),
+                journal=journalFor(settings), traffic=traffic, record=record)
+        elif method == 'multicast':
+            available, missing = broadcast(
+                results, src(None), dst, settings.remote_port, progress,
+                len(devices), settings.multicast_group,
+                settings.multicast_port, rate=settings.multicast_rate * 1e6,
+                pool=pool, transport=transportFor(settings),
+                limit=settings.max_workers, attempts=settings.retries + 1,
+                backoff=settings.backoff, record=record)
+        elif method == 'relay':
+            available, missing = relay(
+                results, src(None), dst, settings.remote_port, progress,
+                len(devices), settings.relay_fanout,
+                attempts=settings.retries + 1, pool=pool,
+                transport=transportFor(settings), limit=settings.max_workers,
+                backoff=settings.backoff, record=record)
+        else:
+            available, missing = pipeline(
+                results, src, dst, settings.remote_port, progress,
+                len(devices), pool=pool,
+                transport=transport or transportFor(settings),
+                limit=settings.max_workers, attempts=settings.retries + 1,
+                backoff=settings.backoff, record=record, sizes=sizes,
+                done=finished, traffic=traffic)
+    except (SystemExit, KeyboardInterrupt):
+        if len(record) == 0:
+            # the outcome per device is unknown, retry all of them
+            record = dict.fromkeys(devices, False)
+        raise
+    else:
+        record = dict.fromkeys(missing)
+        record.update(dict.fromkeys(available, True))
+    finally:
+        if operation is not None:
+            ResultRecord(settings.getStatePath('results.json')).save(
+                operation, record, measured, traffic)
+        # keep sessions for back-to-back runs only if configured
+        if settings.persist <= 0:
+            pool.closeAll()
     logging.debug(f'Available clients: {available}')
     logging.debug(f'Missing clients: {missing}')
 
+    if len(available) == 0:
+        raise SystemExit(
+            f'Im Netzwerk wurden keine verfügbaren Geräte gefunden.')
+
     if len(missing) > 0:
-        devlist = ', '.join(map(settings.getDirName, missing))
-        msg = f'Folgende Schülercomputer sind nicht erreichbar:\n\n{devlist}\n\nDennoch fortfahren?'
-        confirm('Einsammeln', msg)
+        devlist = ', '.join(map(settings.getDirName, sorted(missing)))
+        notify('warning',
+               f'Folgende Schülercomputer waren nicht erreichbar: {devlist}')
 
-    return available
+    summary = savings(traffic)
+    if summary is not None:
+        notify('info', summary)
+
+    return sorted(available)
+
+
+def savings(traffic):
+    """Return a description of the bytes compression saved for the dict
+{traffic} of (raw, sent) pairs per device, or None if nothing was saved."""
+    raw = sum(r for r, s in traffic.values())
+    sent = sum(s for r, s in traffic.values())
+    if raw == 0 or sent >= raw:
+        return None
+    return f'{megabytes(raw)} wurden als {megabytes(sent)} übertragen, ' \
+        f'die Kompression hat {megabytes(raw - sent)} ' \
+        f'({(raw - sent) / raw:.0%}) eingespart.'
+
+
+def megabytes(size):
+    """Return {size} bytes in MB with a decimal comma."""
+    return f'{size / 1e6:.1f} MB'.replace('.', ',')
 
 # ---------------------------------------------------------------------
 
+def shareTrash(settings):
+    """Return the trash for the share folders, see trash.Trash. It starts
+deleting what an interrupted run left behind."""
+    bins = set(folder.parent / '.lan_share_trash'
+               for folder in (settings.share, settings.shareall))
+    return Trash(sorted(bins))
+
+def keepCommon(settings, operation):
+    """Return whether the common folder is kept because the last run of
+{operation} failed on or missed devices. They receive it on --retry-failed.
+"""
+    record = ResultRecord(settings.getStatePath('results.json'))
+    _, devices = record.failed(operation)
+    if len(devices) > 0:
+        notify('warning', 'Der gemeinsame Austeil-Ordner wird erst geleert, '
+               'wenn alle Schülercomputer die Dateien erhalten haben. '
+               'Mit --retry-failed werden sie nachgeliefert.')
+    return len(devices) > 0
+
+def successes(devices):
+    """Return a callback for transferAll appending each device whose
+transfer succeeded to the list {devices}."""
+    def done(device, worker):
+        if worker.status:
+            devices.append(device)
+    return done
+
 def clearShareDirectories(settings, devices):
-    for device in devices:
-        directory = settings.getShareDir(device)
-        cmd = f'rm -r {directory}/*'
-        logging.debug(cmd)
-        os.system(cmd)
+    """Empty the share folders of {devices} at once. Their old contents
+are deleted in the background before the program exits."""
+    trash = shareTrash(settings)
+    try:
+        for device in devices:
+            # the common folder itself is watched by --watch
+            trash.discard(settings.getShareDir(device),
+                          inplace=device is None)
+    finally:
+        trash.close()
     if len(devices) > 1:
         notify('info', 'Die Austeil-Ordner wurden geleert.')
     else:
         notify('info', 'Der Austeil-Ordner wurde geleert.')
 
+def shareManifest(settings):
+    """Return the manifest of the share folders, brought up to date."""
+    manifest = Manifest(settings.getStatePath('manifest'))
+    for directory in (settings.share, settings.shareall):
+        if directory.exists():
+            manifest.update(directory)
+    return manifest
+
+def estimate(settings, sizes):
+    """Return a description of the time needed for payloads of {sizes}."""
+    seconds = makespan(sizes.values(), settings.max_workers,
+                       settings.throughput * 1e6)
+    logging.debug(f'Estimated makespan: {seconds:.1f}s')
+    return duration(seconds)
+
 # ---------------------------------------------------------------------
 
-def shareEach(settings):
-    """Share individual files with available devices."""
-    
-    devices = queryDevices(settings)
-    first = settings.getDirName(devices[0])
-    last = settings.getDirName(devices[-1])
+def shareEach(settings, devices=None):
+    """Share individual files with available {devices}, by default all."""
+    first = settings.getDirName(0)
+    last = settings.getDirName(settings.num_clients - 1)
 
-    if len(devices) > 1:
+    if settings.num_clients > 1:
         directories = f'{settings.share}/{first} bis …/{last}'
         clear = 'Die genannten Ordner werden'
-    elif len(devices) == 1:
+    else:
         directories = f'{settings.share}/{first}'
         clear = 'Der genannte Ordner wird'
-    else:
-        notify('info', 'Es wurden keine verbundenen Schülercomputer gefunden.')
-        return
-    
+
+    # measure the payloads to start the largest first
+    if devices is None:
+        devices = list(range(settings.num_clients))
+    sizes = preflight(devices, settings.getShareDir)
+
     msg = f'Die Dateien in in \n\n    {directories} \n\n' + \
-        'werden ausgeteilt. Dies kann einen Moment dauern. Sie werden ' + \
+        'werden ausgeteilt. Dies dauert voraussichtlich ' + \
+        f'{estimate(settings, sizes)}. Sie werden ' + \
         'benachrichtigt, wenn das Austeilen abgeschlossen ist. \n\nWARNUNG: ' + \
         f'{clear} anschließend VOLLSTÄNDIG GELEERT. Stellen ' + \
         'Sie sicher, dass Sie eine KOPIE der Daten besitzen. \n\n' + \
         '    Fortfahren?'
     ok = ask('Warnung', msg)
     if ok:
-        # show progressbar while sharing
-        progress = ProgressBar(
-            'Zurückgeben',
-            '{0}% abgeschlossen. Bitte warten …')
+        # transfer while discovering devices
         src = settings.getShareDir
         dst = settings.getExchangeDir
-        remote_port = settings.remote_port
-        batch(devices, src, dst, remote_port, progress)
+        manifest = shareManifest(settings)
+        succeeded = list()
+        try:
+            devices = transferAll(
+                settings, src, dst, 'Zurückgeben',
+                transport=transportFor(settings, manifest=manifest),
+                operation='share-each', devices=devices, sizes=sizes,
+                done=successes(succeeded))
+        except SystemExit:
+            # --retry-failed must not send the others their files again
+            if len(succeeded) > 0:
+                clearShareDirectories(settings, succeeded)
+            raise
+        finally:
+            # keep the digests computed on the way
+            manifest.save()
 
         notify('info', 'Das Zurückgeben wurde abgeschlossen.')
         
@@ -89,8 +295,21 @@ def shareEach(settings):
          notify('info', 'Der Benutzer hat den Vorgang abgebrochen.')
 
 
-def shareAll(settings):
-    """Share common files with available devices."""
+def shareAllMethod(settings):
+    """Return how the common files are distributed, see transferAll."""
+    if settings.multicast:
+        return 'multicast'
+    if settings.relay_fanout > 0:
+        return 'relay'
+    if settings.fanout and settings.transfer_mode == 'tar' and \
+            not settings.cache:
+        # per-device caches need per-device streams
+        return 'fanout'
+    return 'pipeline'
+
+
+def shareAll(settings, devices=None):
+    """Share common files with available {devices}, by default all."""
     msg = f'Die Dateien in in \n\n    {settings.shareall} \n\n' + \
         'werden ausgeteilt. Dies kann einen Moment dauern. Sie werden ' + \
         'benachrichtigt, wenn das Austeilen abgeschlossen ist. \n\nWARNUNG: ' + \
@@ -103,50 +322,255 @@ def shareAll(settings):
         def src(device):
             return settings.getShareDir()
 
-        devices = queryDevices(settings)
-
-        # show progress bar while sharing
-        progress = ProgressBar('Austeilen', '{0}% abgeschlossen. Bitte warten …')
+        # transfer while discovering devices
         dst = settings.getExchangeDir
-        remote_port = settings.remote_port
-        batch(devices, src, dst, remote_port, progress)
+        manifest = shareManifest(settings)
+        try:
+            transferAll(settings, src, dst, 'Austeilen',
+                        shareAllMethod(settings),
+                        transport=transportFor(settings, manifest=manifest),
+                        operation='share-all', devices=devices)
+        finally:
+            manifest.save()
 
         notify('info', 'Das Austeilen wurde abgeschlossen.')
         # clear share directories
-        clearShareDirectories(settings, [None])
+        if not keepCommon(settings, 'share-all'):
+            clearShareDirectories(settings, [None])
     else:
         notify('info', 'Der Benutzer hat den Vorgang abgebrochen.')
 
 
-def fetch(settings):
-    """Fetch files from available devices."""
-    devices = queryDevices(settings)
+def stageSources(settings):
+    """Return a function yielding the local folders staged for a device:
+its own share folder and the common one."""
+    def src(device):
+        return (settings.getShareDir(device), settings.getShareDir())
+    return src
+
 
-    # show progress bar while fetching
-    progress = ProgressBar('Einsammeln', '{0}% abgeschlossen. Bitte warten …')
+def stage(settings, devices=None):
+    """Upload the files to share into hidden staging folders ahead of time.
+They become visible on --commit."""
+    def dst(device):
+        return f'{settings.getLogin(device)}:{settings.getStageDir()}'
+
+    manifest = shareManifest(settings)
+    try:
+        transferAll(settings, stageSources(settings), dst, 'Vorbereiten',
+                    transport=functools.partial(
+                        StageWorker, manifest=manifest,
+                        transport=transportFor(settings, manifest=manifest),
+                        journal=journalFor(settings)),
+                    operation='stage', devices=devices)
+    finally:
+        manifest.save()
+    notify('info', 'Das Vorbereiten wurde abgeschlossen.')
+
+
+def commit(settings, devices=None):
+    """Make the staged files visible in the exchange folders. Devices that
+missed the staging receive the files now."""
+    msg = f'Die vorbereiteten Dateien aus \n\n    {settings.share} \n\n' + \
+        'werden freigegeben. \n\nWARNUNG: Die Austeil-Ordner werden ' + \
+        'anschließend VOLLSTÄNDIG GELEERT. Stellen Sie sicher, dass Sie ' + \
+        'eine KOPIE der Daten besitzen. \n\n    Fortfahren?'
+    ok = ask('Warnung', msg)
+    if ok:
+        manifest = shareManifest(settings)
+        succeeded = list()
+        try:
+            devices = transferAll(
+                settings, stageSources(settings), settings.getExchangeDir,
+                'Freigeben', transport=functools.partial(
+                    CommitWorker, manifest=manifest,
+                    transport=transportFor(settings, manifest=manifest),
+                    stage=settings.getStageDir(),
+                    journal=journalFor(settings)),
+                operation='commit', devices=devices,
+                done=successes(succeeded))
+        except SystemExit:
+            if len(succeeded) > 0:
+                clearShareDirectories(settings, succeeded)
+            raise
+        finally:
+            manifest.save()
+        notify('info', 'Das Freigeben wurde abgeschlossen.')
+        if keepCommon(settings, 'commit'):
+            clearShareDirectories(settings, devices)
+        else:
+            clearShareDirectories(settings, devices + [None])
+    else:
+        notify('info', 'Der Benutzer hat den Vorgang abgebrochen.')
+
+
+def fetch(settings, devices=None):
+    """Fetch files from available {devices}, by default all."""
+    # transfer while discovering devices
     src = settings.getExchangeDir
     dst = settings.getFetchDir
-    remote_port = settings.remote_port
-    batch(devices, src, dst, remote_port, progress)
+    if settings.snapshots:
+        # collect into a new snapshot per device
+        name = snapshot.stamp()
+
+        def dst(device):
+            return settings.getFetchDir(device) / name
+
+    else:
+        name = None
+
+    # write the ZIP archive while collecting, if configured
+    collector = None
+    if settings.ingest_zip:
+        zipname = chooseArchive()
+        if zipname is not None:
+            collector = Collector(zipname, settings.fetch, name,
+                                  settings.zip_level, zipWorkers(settings))
+
+    if devices is None:
+        devices = list(range(settings.num_clients))
+    if settings.dedup and not settings.snapshots and \
+            settings.transfer_mode == 'scp':
+        # scp writes into existing files, which are shared blobs
+        store = Store(settings.fetch / '.store')
+        for device in devices:
+            store.release(dst(device))
+    # start the largest payloads first, by the last fetch until a device
+    # is measured, measuring them up front would wait for offline devices
+    sizes = ResultRecord(settings.getStatePath('results.json')).sizes('fetch')
+    title = 'Einsammeln'
+    if len(sizes) > 0:
+        title = f'Einsammeln, {estimate(settings, sizes)}'
+    transport = None
+    done = None
+    if collector is not None:
+        transport = transportFor(settings, ingest=collector.add)
+
+        def done(device, worker):
+            # files not streamed into the archive, e.g. hardlinked ones
+            collector.addTree(dst(device))
+    try:
+        devices = transferAll(settings, src, dst, title, transport=transport,
+                              operation='fetch', devices=devices,
+                              sizes=sizes, done=done, measure=True)
+    finally:
+        if collector is not None:
+            collector.finish()
+            logging.debug(f'{zipname} created')
+
+    if settings.dedup:
+        # store identical files only once
+        store = Store(settings.fetch / '.store')
+        for device in devices:
+            store.ingestTree(dst(device))
+        store.prune()
 
     notify('info', 'Das Einsammeln wurde abgeschlossen')
+    if collector is not None:
+        notify('info', 'Das ZIP-Archiv wurde erstellt')
+        return
+    if settings.ingest_zip:
+        return
 
-    # nach ZIP fragen
-    msg = f'Sollen die eingesammelten Dateien zu einem ZIP-Archiv komprimiert werden?'
-    ok = ask('ZIP-Archiv', msg)
-    if ok:
-        zipname = datetime.datetime.now().strftime('%Y-%m-%d_%H-%m-%S.zip')
-        zipname = choose('ZIP-Archiv', zipname, filter=['*.zip'])
-        if zipname is None:
-            notify(
-                'error',
-                'Der Benutzer hat den Vorgang abgebrochen.')
-            return
-
-        shutil.make_archive(zipname, 'zip', settings.fetch)
+    zipname = chooseArchive()
+    if zipname is not None:
+        if settings.snapshots:
+            snapshot.archive(zipname, settings.fetch, name,
+                             settings.zip_level, zipWorkers(settings))
+        else:
+            # neither the shared blobs nor the digests of verified fetches
+            build(zipname, settings.fetch, ['.store', '*.b2sum'],
+                  settings.zip_level, zipWorkers(settings))
         logging.debug(f'{zipname} created')
         notify('info', 'Das ZIP-Archiv wurde erstellt')
 
+
+def zipWorkers(settings):
+    """Return the number of processes compressing ZIP archives."""
+    return settings.zip_workers or os.cpu_count() or 1
+
+
+def chooseArchive():
+    """Ask whether to pack the fetched files into a ZIP archive. Returns
+its file name or None.
+"""
+    msg = f'Sollen die eingesammelten Dateien zu einem ZIP-Archiv komprimiert werden?'
+    ok = ask('ZIP-Archiv', msg)
+    if not ok:
+        return None
+    zipname = datetime.datetime.now().strftime('%Y-%m-%d_%H-%m-%S.zip')
+    zipname = choose('ZIP-Archiv', zipname, filter=['*.zip'])
+    if zipname is None:
+        notify(
+            'error',
+            'Der Benutzer hat den Vorgang abgebrochen.')
+        return None
+
+    if not zipname.endswith('.zip'):
+        zipname += '.zip'
+    return zipname
+
+
+def retryFailed(settings):
+    """Repeat the last operation for the devices it failed on."""
+    operations = {
+        'share-each': shareEach,
+        'share-all': shareAll,
+        'stage': stage,
+        'commit': commit,
+        'fetch': fetch
+    }
+    record = ResultRecord(settings.getStatePath('results.json'))
+    operation, devices = record.failed()
+    if operation not in operations or len(devices) == 0:
+        notify('info', 'Es gibt keine fehlgeschlagenen Übertragungen.')
+        return
+    # the share folders must still hold what the devices missed
+    if operation == 'share-all':
+        empty = [None] if isEmptyDir(settings.getShareDir()) else []
+    elif operation == 'share-each':
+        empty = [device for device in devices
+                 if isEmptyDir(settings.getShareDir(device))]
+    else:
+        empty = list()
+    if len(empty) > 0:
+        folders = ', '.join(str(settings.getShareDir(device))
+                            for device in empty)
+        raise SystemExit(f'Die Austeil-Ordner {folders} sind leer, die '
+                         'Übertragung kann nicht wiederholt werden.')
+    logging.debug(f'Retrying {operation} for {devices}')
+    operations[operation](settings, devices=devices)
+
+
+def isEmptyDir(directory):
+    """Return whether {directory} is missing or empty."""
+    return not os.path.isdir(directory) or len(os.listdir(directory)) == 0
+
+
+def presence(settings):
+    """Run the presence service in the foreground."""
+    service = PresenceService(
+        settings, settings.getStatePath('presence.sock'),
+        settings.presence_interval)
+    try:
+        service.join()
+    finally:
+        service.stop()
+
+
+def watch(settings):
+    """Prepare the files of the share folders in the foreground while
+they are filled, so the next share only streams them."""
+    manifest = shareManifest(settings)
+    watcher = Watcher([(settings.share, 1), (settings.shareall, 0)],
+                      manifest, artifactsFor(settings),
+                      settings.compress_threshold)
+    try:
+        watcher.join()
+    finally:
+        watcher.stop()
+        manifest.save()
+
 # ---------------------------------------------------------------------
 
 
@@ -167,12 +591,19 @@ if __name__ == '__main__':
             s.setup()
 
         s.ensureFolders()
+        # finish deleting old share folders after a crash
+        shareTrash(s).close()
 
         # parse command line arguments to trigger correct mode
         cli = CliArgs()
         cli.register('--share-each', shareEach)
         cli.register('--share-all', shareAll)
         cli.register('--fetch', fetch)
+        cli.register('--stage', stage)
+        cli.register('--commit', commit)
+        cli.register('--retry-failed', retryFailed)
+        cli.register('--presence', presence)
+        cli.register('--watch', watch)
 
         if not cli(sys.argv, settings=s):
             os.system('cat USAGE.md')
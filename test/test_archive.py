@@ -0,0 +1,109 @@
+#!/usr/bin/python3
+
+import unittest
+import os
+import pathlib
+import shutil
+import subprocess
+import tempfile
+import zipfile
+
+from archive import Collector, ZipWriter, build
+
+
+class ArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmpdir.name)
+        self.src = self.root / 'fetch'
+        (self.src / 'S01' / 'sub').mkdir(parents=True)
+        (self.src / 'S02' / 'empty').mkdir(parents=True)
+        (self.src / '.store').mkdir()
+        (self.src / 'S01' / 'sub' / 'a.txt').write_text('abc' * 1000)
+        (self.src / 'S01' / 'video.bin').write_bytes(os.urandom(20000))
+        os.link(self.src / 'S01' / 'video.bin', self.src / 'S02' / 'video.bin')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_build(self):
+        (self.src / 'S01.b2sum').write_text('digests')
+        zipname = self.root / 'out.zip'
+        build(zipname, self.src, skip=['.store', '*.b2sum'])
+
+        with zipfile.ZipFile(zipname) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(sorted(zf.namelist()), [
+                'S01/sub/a.txt', 'S01/video.bin', 'S02/empty/',
+                'S02/video.bin'])
+            self.assertEqual(zf.read('S01/sub/a.txt'), b'abc' * 1000)
+            self.assertEqual(zf.read('S02/video.bin'),
+                             (self.src / 'S01' / 'video.bin').read_bytes())
+            info = zf.getinfo('S01/sub/a.txt')
+            self.assertLess(info.compress_size, info.file_size)
+
+    def test_parallel(self):
+        (self.src / 'S02' / 'photo.jpg').write_bytes(b'jpg' * 1000)
+        for i in range(10):
+            (self.src / 'S02' / f'{i}.txt').write_text(str(i) * 5000)
+        build(self.root / 'serial.zip', self.src, ['.store'])
+        zipname = self.root / 'out.zip'
+        build(zipname, self.src, ['.store'], level=9, workers=3)
+
+        with zipfile.ZipFile(self.root / 'serial.zip') as serial, \
+                zipfile.ZipFile(zipname) as zf:
+            self.assertIsNone(zf.testzip())
+            # same order as written on one core
+            self.assertEqual(zf.namelist(), serial.namelist())
+            self.assertEqual(zf.read('S02/7.txt'), b'7' * 5000)
+            self.assertEqual(zf.getinfo('S02/photo.jpg').compress_type,
+                             zipfile.ZIP_STORED)
+            self.assertEqual(zf.getinfo('S02/7.txt').compress_type,
+                             zipfile.ZIP_DEFLATED)
+        if shutil.which('unzip') is not None:
+            p = subprocess.run(['unzip', '-tq', zipname],
+                               stdout=subprocess.PIPE)
+            self.assertEqual(p.returncode, 0)
+
+    def test_Collector(self):
+        zipname = self.root / 'out.zip'
+        snap = self.src / 'S03' / 'snap'
+        snap.mkdir(parents=True)
+        (snap / 'x.txt').write_text('old')
+        collector = Collector(zipname, self.src, 'snap')
+        collector.add(snap / 'x.txt')
+        collector.add(self.src / 'S01' / 'sub' / 'a.txt')
+        collector.finish()
+        self.assertFalse(collector.is_alive())
+
+        with zipfile.ZipFile(zipname) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(sorted(zf.namelist()),
+                             ['S01/sub/a.txt', 'S03/x.txt'])
+
+        # a file fetched again replaces the earlier copy
+        collector = Collector(zipname, self.src, 'snap')
+        collector.add(snap / 'x.txt')
+        (snap / 'x.txt').write_text('new')
+        collector.add(snap / 'x.txt')
+        collector.addTree(self.src / 'S02')
+        collector.finish()
+
+        with zipfile.ZipFile(zipname) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(sorted(zf.namelist()),
+                             ['S02/empty/', 'S02/video.bin', 'S03/x.txt'])
+            self.assertEqual(zf.read('S03/x.txt'), b'new')
+
+    def test_duplicates(self):
+        zipname = self.root / 'out.zip'
+        with ZipWriter(zipname) as zw:
+            zw.write(self.src / 'S01' / 'video.bin', 'a.bin')
+            zw.write(self.src / 'S02' / 'video.bin', 'b.bin')
+            # hardlinks are compressed once
+            self.assertEqual(len(zw.blobs), 1)
+
+        with zipfile.ZipFile(zipname) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(zf.read('a.bin'), zf.read('b.bin'))
@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+
+import unittest
+import os
+import pathlib
+import shutil
+import tempfile
+
+from cache import ContentCache
+from store import digest
+from transfer import TarWorker
+from test.test_transfer import fakeSsh, makeTree
+
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmpdir.name)
+        self.cache = ContentCache(self.root / 'inventory',
+                                  self.root / '.exchange.cache')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        del self.cache
+
+    def test_inventory(self):
+        self.assertEqual(self.cache.load('tester@1.1.1.10'), set())
+        self.cache.save('tester@1.1.1.10', {'ab', 'cd'})
+        self.assertEqual(self.cache.load('tester@1.1.1.10'), {'ab', 'cd'})
+        self.assertEqual(self.cache.load('tester@1.1.1.11'), set())
+
+    def test_restore(self):
+        src, exchange = self.root / 'src', self.root / 'exchange'
+        src.mkdir()
+        makeTree(src)
+        (src / 'video.mp4').write_bytes(os.urandom(50000))
+        dst = f'tester@127.0.0.1:{exchange}'
+
+        with fakeSsh():
+            w = TarWorker(src, dst, cache=self.cache)
+            w.join()
+            self.assertTrue(w.status)
+            self.assertEqual(len(self.cache.load('tester@127.0.0.1')), 4)
+
+            # the student deleted everything, the cache restores it
+            shutil.rmtree(exchange)
+            w = TarWorker(src, dst, cache=self.cache)
+            w.join()
+            self.assertTrue(w.status)
+            self.assertLess(w.sent, 50000)
+            self.assertEqual((exchange / 'video.mp4').read_bytes(),
+                             (src / 'video.mp4').read_bytes())
+            self.assertEqual((exchange / 'sub' / 'b.txt').read_text(),
+                             'b' * 1000)
+
+    def test_limit(self):
+        cache = ContentCache(self.root / 'inventory',
+                             self.root / '.exchange.cache', 60000)
+        src, exchange = self.root / 'src', self.root / 'exchange'
+        src.mkdir()
+        old = src / 'old.mp4'
+        old.write_bytes(os.urandom(40000))
+        dst = f'tester@127.0.0.1:{exchange}'
+
+        with fakeSsh():
+            w = TarWorker(src, dst, cache=cache)
+            w.join()
+            self.assertTrue(w.status)
+            os.utime(self.root / '.exchange.cache' / digest(old),
+                     (1, 1))
+
+            # the next delivery does not fit next to the older one
+            old.unlink()
+            (src / 'new.mp4').write_bytes(os.urandom(40000))
+            w = TarWorker(src, dst, cache=cache)
+            w.join()
+            self.assertTrue(w.status)
+
+        kept = {digest(src / 'new.mp4')}
+        self.assertEqual(set(os.listdir(self.root / '.exchange.cache')),
+                         kept)
+        self.assertEqual(cache.load('tester@127.0.0.1'), kept)
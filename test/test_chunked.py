@@ -0,0 +1,53 @@
+#!/usr/bin/python3
+
+import unittest
+import os
+import pathlib
+import tempfile
+
+from chunked import split
+from transfer import TarWorker
+from test.test_transfer import fakeSsh, makeTree
+
+
+class ChunkedTest(unittest.TestCase):
+
+    def test_split(self):
+        mib = 1 << 20
+        self.assertEqual(split(10, 4), [(0, 10)])
+        self.assertEqual(split(0, 4), [(0, 0)])
+        self.assertEqual(split(3 * mib + 1, 4),
+                         [(0, mib + 1), (mib + 1, mib + 1),
+                          (2 * mib + 2, mib - 1)])
+        self.assertEqual(len(split(100 * mib, 4)), 4)
+
+    def test_TarWorker(self):
+        with tempfile.TemporaryDirectory() as tmpdir, fakeSsh():
+            tmpdir = pathlib.Path(tmpdir)
+            src, remote, back = tmpdir / 'src', tmpdir / 'remote', \
+                tmpdir / 'back'
+            src.mkdir()
+            makeTree(src)
+            video = os.urandom((7 << 19) + 123)
+            (src / 'sub' / 'video.mp4').write_bytes(video)
+            os.utime(src / 'sub' / 'video.mp4', (1e9, 1e9))
+
+            w = TarWorker(src, f'tester@127.0.0.1:{remote}', large=1 << 20,
+                          streams=3)
+            w.join()
+            self.assertTrue(w.status)
+            self.assertEqual((remote / 'sub' / 'video.mp4').read_bytes(),
+                             video)
+            self.assertEqual(
+                (remote / 'sub' / 'video.mp4').stat().st_mtime, 1e9)
+            self.assertFalse((remote / 'sub' / 'video.mp4.part').exists())
+            self.assertEqual((remote / 'a.txt').read_text(), 'a')
+
+            w = TarWorker(f'tester@127.0.0.1:{remote}', back, large=1 << 20,
+                          streams=3)
+            w.join()
+            self.assertTrue(w.status)
+            self.assertEqual((back / 'sub' / 'video.mp4').read_bytes(), video)
+            self.assertEqual((back / 'sub' / 'video.mp4').stat().st_mtime, 1e9)
+            self.assertEqual((back / 'sub' / 'b.txt').read_text(), 'b' * 1000)
+            self.assertGreater(w.raw, len(video))
@@ -0,0 +1,44 @@
+#!/usr/bin/python3
+
+import unittest
+import os
+import pathlib
+import tempfile
+
+from compression import isCompressible, sampleRatio
+
+
+class CompressionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_sampleRatio(self):
+        text = self.root / 'text.txt'
+        text.write_text('Arbeitsblatt ' * 1000)
+        noise = self.root / 'noise.bin'
+        noise.write_bytes(os.urandom(10000))
+        empty = self.root / 'empty'
+        empty.write_bytes(b'')
+
+        self.assertLess(sampleRatio(text), 0.1)
+        self.assertGreater(sampleRatio(noise), 0.99)
+        self.assertEqual(sampleRatio(empty), 1.0)
+
+    def test_isCompressible(self):
+        # decided by extension without reading
+        jpeg = self.root / 'photo.JPG'
+        jpeg.write_text('a' * 1000)
+        self.assertFalse(isCompressible(jpeg))
+
+        text = self.root / 'notes.md'
+        text.write_text('a' * 1000)
+        self.assertTrue(isCompressible(text))
+
+        noise = self.root / 'data.bin'
+        noise.write_bytes(os.urandom(10000))
+        self.assertFalse(isCompressible(noise))
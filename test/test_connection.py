@@ -0,0 +1,46 @@
+#!/usr/bin/python3
+
+import unittest
+import pathlib
+import tempfile
+
+from connection import ConnectionPool, splitRemote
+
+
+class ConnectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.pool = ConnectionPool(pathlib.Path(self.tmpdir.name) / 'ssh')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        del self.pool
+
+    def test_splitRemote(self):
+        self.assertEqual(
+            splitRemote('tester@1.1.1.10:~/exchange'),
+            ('tester@1.1.1.10', '~/exchange'))
+        self.assertEqual(
+            splitRemote(pathlib.Path('/tmp/share')), (None, '/tmp/share'))
+
+    def test_controlPath(self):
+        a = self.pool.controlPath('tester@1.1.1.10', 22)
+        b = self.pool.controlPath('tester@1.1.1.11', 22)
+        c = self.pool.controlPath('tester@1.1.1.10', 2222)
+        self.assertEqual(a, self.pool.controlPath('tester@1.1.1.10', 22))
+        self.assertEqual(len({a, b, c}), 3)
+        self.assertEqual(a.parent, self.pool.directory)
+
+    def test_options(self):
+        options = self.pool.options('tester@1.1.1.10', 22)
+        path = self.pool.controlPath('tester@1.1.1.10', 22)
+        self.assertIn(f'ControlPath={path}', options)
+        self.assertIn('ControlPersist=60s', options)
+
+        self.pool.persist = 0
+        options = self.pool.options('tester@1.1.1.10', 22)
+        self.assertIn('ControlPersist=yes', options)
+
+    def test_isOpen(self):
+        self.assertFalse(self.pool.isOpen('tester@1.1.1.10', 22))
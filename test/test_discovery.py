@@ -2,9 +2,13 @@
 
 import unittest
 import ipaddress
+import socket
+import tempfile
+from unittest import mock
 
 from settings import Settings
-from discovery import PingWorker, discover
+import discovery
+from discovery import PingWorker, discover, stream, sweep, checksum
 
 
 class DummyProgress(object):
@@ -53,4 +57,63 @@ class DiscoveryTest(unittest.TestCase):
         p = DummyProgress()
         with self.assertRaises(SystemExit):
             devices = discover(self.settings, p)
-        
+
+    def test_checksum(self):
+        self.assertEqual(checksum(b'\x08\x00\x00\x00\x00\x01\x00\x01'), 0xf7fd)
+        self.assertEqual(checksum(b'\xff\xff'), 0)
+
+    def test_sweep_icmp(self):
+        targets = {0: '127.0.0.1', 1: '0.0.0.1'}
+        results = dict()
+        reachable = sweep(targets, 'icmp', timeout=0.5,
+                          callback=lambda d, s: results.update({d: s}))
+        self.assertEqual(reachable, {0})
+        self.assertEqual(results, {0: True, 1: False})
+
+    def test_stream_fallback(self):
+        # e.g. no ICMP sockets for this user, each device is pinged instead
+        def broken(*args, **kwargs):
+            raise OSError('ICMP not available')
+
+        with mock.patch.object(discovery, 'openIcmpSocket', broken), \
+                mock.patch.object(discovery, 'sweepPing',
+                                  wraps=discovery.sweepPing) as ping:
+            results = dict(stream(self.settings, range(3), timeout=0.5))
+        self.assertEqual(sorted(results), [0, 1, 2])
+        self.assertEqual(sorted(ping.call_args[0][0]), [0, 1, 2])
+
+    def test_sweep_tcp(self):
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen()
+        port = server.getsockname()[1]
+
+        closed = socket.socket()
+        closed.bind(('127.0.0.1', 0))
+        closed_port = closed.getsockname()[1]
+
+        reachable = sweep({0: '127.0.0.1'}, 'tcp', port, timeout=0.5)
+        self.assertEqual(reachable, {0})
+        reachable = sweep({0: '127.0.0.1'}, 'tcp', closed_port, timeout=0.5)
+        self.assertEqual(reachable, set())
+
+        server.close()
+        closed.close()
+
+    def test_sweep_control(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = f'{tmpdir}/master'
+            master = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            master.bind(path)
+            master.listen()
+
+            # pooled session counts although nothing listens on the port
+            closed = socket.socket()
+            closed.bind(('127.0.0.1', 0))
+            port = closed.getsockname()[1]
+            reachable = sweep({0: '127.0.0.1', 1: '127.0.0.1'}, 'tcp', port,
+                              timeout=0.5, controls={0: path})
+            self.assertEqual(reachable, {0})
+
+            master.close()
+            closed.close()
@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+
+import unittest
+import pathlib
+import tempfile
+import threading
+
+from fanout import Fanout, fanout, share
+from transfer import TarWorker
+from test.test_transfer import DummyProgress, fakeSsh, makeTree
+
+
+class FanoutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmpdir.name)
+        self.src = self.root / 'src'
+        self.src.mkdir()
+        makeTree(self.src)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def exchange(self, device):
+        if device == 1:
+            return 'tester@127.0.0.2:/proc/none'
+        return f'tester@127.0.0.{device + 1}:{self.root}/dev{device}'
+
+    def test_window(self):
+        f = Fanout(window=10)
+        fast, slow = object(), object()
+        f.attach(fast)
+        f.attach(slow)
+        f.write(b'x' * 10)
+        writing = threading.Thread(target=f.write, args=(b'y' * 10,))
+        writing.start()
+        writing.join(0.1)
+        # the slow reader holds the window
+        self.assertTrue(writing.is_alive())
+        self.assertEqual(f.read(fast), b'x' * 10)
+        self.assertTrue(writing.is_alive())
+        chunk = f.read(slow)
+        writing.join(1)
+        self.assertFalse(writing.is_alive())
+        # both readers got the very same buffer
+        self.assertEqual(f.size, 10)
+        self.assertEqual(chunk, b'x' * 10)
+        f.close()
+        self.assertEqual(f.read(fast), b'y' * 10)
+        f.detach(slow)
+        self.assertEqual(f.read(fast), b'')
+        self.assertEqual(f.size, 0)
+
+    def test_share(self):
+        with fakeSsh():
+            result, raw = share([0, 2, 3], self.src, self.exchange, 22,
+                                codec='gzip', threshold=1.0)
+        self.assertEqual(sorted(result), [0, 2, 3])
+        self.assertGreater(raw, 1000)
+        for device in [0, 2, 3]:
+            self.assertTrue(result[device][0])
+            path = self.root / f'dev{device}'
+            self.assertEqual((path / 'sub' / 'b.txt').read_text(), 'b' * 1000)
+            self.assertEqual((path / '.hidden').read_text(), 'hidden')
+
+    def test_fanout(self):
+        results = iter([(0, True), (1, True), (2, False), (3, True)])
+        record = dict()
+        with fakeSsh(), self.assertRaises(SystemExit):
+            fanout(results, self.src, self.exchange, 22, DummyProgress(), 4,
+                   gather=0.05, delay=0.01, window=1024, record=record)
+        self.assertEqual((self.root / 'dev3' / 'a.txt').read_text(), 'a')
+        self.assertEqual(record, {0: True, 1: False, 2: None, 3: True})
+
+    def test_retry(self):
+        calls = list()
+
+        def exchange(device):
+            # the shared stream fails for device 1, a retry succeeds
+            calls.append(device)
+            if calls.count(device) == 1:
+                return self.exchange(device)
+            return f'tester@127.0.0.{device + 1}:{self.root}/dev{device}'
+
+        results = iter([(0, True), (1, True), (3, True)])
+        record = dict()
+        with fakeSsh():
+            available, missing = fanout(
+                results, self.src, exchange, 22, DummyProgress(), 3,
+                gather=0.05, delay=0.01, window=1024, limit=2, attempts=2,
+                transport=TarWorker, record=record)
+        self.assertEqual(sorted(available), [0, 1, 3])
+        self.assertEqual(record, {0: True, 1: True, 3: True})
+        self.assertEqual((self.root / 'dev1' / 'a.txt').read_text(), 'a')
@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+
+import unittest
+import hashlib
+import io
+import os
+import pathlib
+import tarfile
+import tempfile
+
+from integrity import MANIFEST, pack, parse, unpack
+from transfer import TarWorker
+from test.test_transfer import fakeSsh, makeTree
+
+
+class IntegrityTest(unittest.TestCase):
+
+    def test_unpack(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmpdir = pathlib.Path(tmpdir)
+            src = tmpdir / 'src'
+            src.mkdir()
+            makeTree(src)
+            entries = [(src / name, name)
+                       for name in ['sub', 'a.txt', 'sub/b.txt']]
+            stream = io.BytesIO()
+            digests = pack(entries, stream)
+            self.assertEqual(digests['sub/b.txt'],
+                             hashlib.blake2b(b'b' * 1000).hexdigest())
+
+            data = stream.getvalue()
+            verified, broken = unpack(tmpdir / 'ok', io.BytesIO(data))
+            self.assertEqual(broken, [])
+            self.assertEqual(verified, digests)
+            self.assertFalse((tmpdir / 'ok' / MANIFEST).exists())
+
+            # flip a byte of b.txt on the way
+            offset = data.index(b'b' * 1000) + 500
+            data = data[:offset] + b'x' + data[offset + 1:]
+            verified, broken = unpack(tmpdir / 'bad', io.BytesIO(data))
+            self.assertEqual(broken, ['sub/b.txt'])
+            self.assertNotIn('sub/b.txt', verified)
+
+            # a stream cut off before the manifest cannot be trusted
+            with self.assertRaises(tarfile.TarError):
+                unpack(tmpdir / 'cut', io.BytesIO(data[:2048]))
+
+    def test_TarWorker(self):
+        with tempfile.TemporaryDirectory() as tmpdir, fakeSsh():
+            tmpdir = pathlib.Path(tmpdir)
+            src, remote, back = tmpdir / 'src', tmpdir / 'remote', \
+                tmpdir / 'back'
+            src.mkdir()
+            makeTree(src)
+
+            w = TarWorker(src, f'tester@127.0.0.1:{remote}', codec='gzip',
+                          threshold=1.0, verify=True)
+            w.join()
+            self.assertTrue(w.status)
+            self.assertEqual((remote / 'sub' / 'b.txt').read_text(),
+                             'b' * 1000)
+            self.assertFalse((remote / MANIFEST).exists())
+
+            w = TarWorker(f'tester@127.0.0.1:{remote}', back, codec='gzip',
+                          threshold=1.0, verify=True)
+            w.join()
+            self.assertTrue(w.status)
+            self.assertEqual((back / '.hidden').read_text(), 'hidden')
+            manifest = parse((tmpdir / 'back.b2sum').read_text())
+            self.assertEqual(manifest['sub/b.txt'],
+                             hashlib.blake2b(b'b' * 1000).hexdigest())
+            self.assertEqual(sorted(manifest),
+                             ['.hidden', 'a.txt', 'sub/b.txt'])
+            self.assertFalse(os.path.exists(back / MANIFEST))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+#!/usr/bin/python3
+
+import unittest
+import os
+import pathlib
+import tempfile
+
+from chunked import split
+from fanout import share
+from journal import Journal
+from transfer import TarWorker
+from test.test_transfer import fakeSsh, makeTree
+
+
+class JournalTest(unittest.TestCase):
+
+    def test_Checkpoint(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            journal = Journal(pathlib.Path(tmpdir) / 'journal')
+            checkpoint = journal.open('src', 'dst')
+            checkpoint.done('a.txt', 1, 100.5)
+            checkpoint.verified('video.mp4', 10, 200, 0, 5)
+            checkpoint.close(False)
+
+            checkpoint = journal.open('src', 'dst')
+            self.assertTrue(checkpoint.isDone('a.txt', 1, 100))
+            self.assertFalse(checkpoint.isDone('a.txt', 2, 100))
+            self.assertEqual(checkpoint.ranges('video.mp4', 10, 200),
+                             {(0, 5)})
+            # a changed file starts over
+            self.assertEqual(checkpoint.ranges('video.mp4', 11, 200), set())
+            self.assertFalse(journal.open('src', 'other').isDone('a.txt', 1,
+                                                                 100))
+            checkpoint.close(True)
+            self.assertEqual(os.listdir(journal.directory), [])
+
+    def test_TarWorker_send(self):
+        with tempfile.TemporaryDirectory() as tmpdir, fakeSsh():
+            tmpdir = pathlib.Path(tmpdir)
+            src, remote = tmpdir / 'src', tmpdir / 'remote'
+            src.mkdir()
+            makeTree(src)
+            journal = Journal(tmpdir / 'journal')
+            dst = f'tester@127.0.0.1:{remote}'
+            st = (src / 'a.txt').stat()
+            journal.open(src, dst).done('a.txt', st.st_size, st.st_mtime)
+
+            w = TarWorker(src, dst, journal=journal)
+            w.join()
+            self.assertTrue(w.status)
+            self.assertFalse((remote / 'a.txt').exists())
+            self.assertEqual((remote / 'sub' / 'b.txt').read_text(),
+                             'b' * 1000)
+            self.assertEqual(os.listdir(journal.directory), [])
+
+    def test_TarWorker_receive(self):
+        with tempfile.TemporaryDirectory() as tmpdir, fakeSsh():
+            tmpdir = pathlib.Path(tmpdir)
+            remote, back = tmpdir / 'remote', tmpdir / 'back'
+            remote.mkdir()
+            video = os.urandom((3 << 20) + 17)
+            (remote / 'video.mp4').write_bytes(video)
+            os.utime(remote / 'video.mp4', (1e9, 1e9))
+            journal = Journal(tmpdir / 'journal')
+            src = f'tester@127.0.0.1:{remote}'
+
+            # the first range arrived before the transfer broke off
+            first = split(len(video), 3)[0]
+            back.mkdir()
+            (back / 'video.mp4.part').write_bytes(video[:first[1]])
+            journal.open(src, back).verified('video.mp4', len(video), 1e9,
+                                             *first)
+
+            w = TarWorker(src, back, large=1 << 20, streams=3,
+                          journal=journal)
+            w.join()
+            self.assertTrue(w.status)
+            self.assertEqual((back / 'video.mp4').read_bytes(), video)
+            self.assertEqual(w.sent, len(video) - first[1])
+
+    def test_share(self):
+        with tempfile.TemporaryDirectory() as tmpdir, fakeSsh():
+            tmpdir = pathlib.Path(tmpdir)
+            src = tmpdir / 'src'
+            src.mkdir()
+            makeTree(src)
+            journal = Journal(tmpdir / 'journal')
+
+            def exchange(device):
+                return f'tester@127.0.0.{device + 1}:{tmpdir}/dev{device}'
+
+            # a.txt reached both devices before the run broke off
+            st = (src / 'a.txt').stat()
+            for device in [0, 1]:
+                journal.open(src, exchange(device)).done(
+                    'a.txt', st.st_size, st.st_mtime)
+            result, raw = share([0, 1], src, exchange, 22, journal=journal)
+            self.assertTrue(result[0][0] and result[1][0])
+            self.assertFalse((tmpdir / 'dev0' / 'a.txt').exists())
+            self.assertEqual((tmpdir / 'dev1' / 'sub' / 'b.txt').read_text(),
+                             'b' * 1000)
+            self.assertEqual(os.listdir(journal.directory), [])
+
+    def test_snapshot(self):
+        with tempfile.TemporaryDirectory() as tmpdir, fakeSsh():
+            tmpdir = pathlib.Path(tmpdir)
+            remote = tmpdir / 'remote'
+            remote.mkdir()
+            makeTree(remote)
+            journal = Journal(tmpdir / 'journal')
+            # left behind by an earlier run
+            (journal.directory / 'old.json').write_text('{}')
+            os.utime(journal.directory / 'old.json', (0, 0))
+
+            # a new snapshot cannot resume, so it keeps no checkpoint
+            w = TarWorker(f'tester@127.0.0.1:{remote}',
+                          tmpdir / 'back' / 'snap', snapshot=True,
+                          journal=journal)
+            w.join()
+            self.assertIsNone(w.checkpoint)
+            self.assertEqual((tmpdir / 'back' / 'snap' / 'a.txt').read_text(),
+                             'a')
+            Journal(journal.directory)
+            self.assertEqual(os.listdir(journal.directory), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
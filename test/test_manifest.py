@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+
+import unittest
+import os
+import pathlib
+import tempfile
+
+from manifest import Manifest
+from staging import fingerprint
+from store import digest
+from test.test_transfer import makeTree
+
+
+class ManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmpdir.name)
+        self.share = self.root / 'share'
+        (self.share / 'S01').mkdir(parents=True)
+        (self.share / 'S02' / 'empty').mkdir(parents=True)
+        (self.share / 'S03').mkdir()
+        makeTree(self.share / 'S01')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_update(self):
+        path = self.share / 'S01' / 'a.txt'
+        manifest = Manifest(self.root / 'manifest')
+        changed, removed = manifest.update(self.share)
+        self.assertEqual(len(changed), 3)
+        self.assertEqual(manifest.digest(path), digest(path))
+        manifest.save()
+
+        # same stat data, so the stored digest is trusted
+        st = path.stat()
+        path.write_text('b')
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        manifest = Manifest(self.root / 'manifest')
+        self.assertEqual(manifest.update(self.share), ([], []))
+        self.assertNotEqual(manifest.digest(path), digest(path))
+
+        (self.share / 'S01' / 'sub' / 'b.txt').unlink()
+        path.write_text('changed')
+        changed, removed = manifest.update(self.share)
+        self.assertEqual(changed, [str(path)])
+        self.assertEqual(removed, [str(self.share / 'S01' / 'sub' / 'b.txt')])
+        self.assertEqual(manifest.digest(path), digest(path))
+
+    def test_isEmpty(self):
+        manifest = Manifest(self.root / 'manifest')
+        manifest.update(self.share)
+        self.assertFalse(manifest.isEmpty(self.share / 'S01'))
+        # empty folders are shared as well
+        self.assertFalse(manifest.isEmpty(self.share / 'S02'))
+        self.assertTrue(manifest.isEmpty(self.share / 'S03'))
+        self.assertTrue(manifest.isEmpty(self.share / 'S04'))
+
+        directories = (self.share / 'S01', self.share / 'S03')
+        self.assertEqual(fingerprint(directories, manifest),
+                         fingerprint(directories))
+
+
+if __name__ == '__main__':
+    unittest.main()
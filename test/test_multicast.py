@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+
+import unittest
+import pathlib
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+
+import multicast
+from broadcast import broadcast, pack
+from multicast import Receiver, Sender, ranges
+from transfer import TarWorker
+from test.test_transfer import DummyProgress, fakeSsh, makeTree
+
+
+GROUP = '239.255.76.83'
+
+
+class MulticastTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmpdir.name)
+        self.src = self.root / 'src'
+        self.src.mkdir()
+        makeTree(self.src)
+        (self.src / 'data.bin').write_bytes(random.randbytes(300000))
+        self.port = random.randint(40000, 50000)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def assertTree(self, path):
+        self.assertEqual((path / 'sub' / 'b.txt').read_text(), 'b' * 1000)
+        self.assertEqual((path / '.hidden').read_text(), 'hidden')
+        self.assertEqual((path / 'data.bin').read_bytes(),
+                         (self.src / 'data.bin').read_bytes())
+
+    def test_ranges(self):
+        self.assertEqual(ranges([1, 2, 3, 7, 9, 10]),
+                         [[1, 3], [7, 7], [9, 10]])
+
+    def test_receivers(self):
+        archive = self.root / 'share.tar'
+        with open(archive, 'wb') as handle:
+            pack(self.src, handle)
+        sender = Sender(archive, GROUP, self.port, '127.0.0.1', 500e6)
+        address = f'127.0.0.1:{sender.address[1]}'
+
+        # several receiver processes and a lossy one in this process
+        procs = [subprocess.Popen(
+            [sys.executable, multicast.__file__, 'receive', GROUP,
+             str(self.port), address, str(sender.session), str(i),
+             str(self.root / f'dev{i}'), '127.0.0.1'])
+            for i in range(3)]
+        lossy = Receiver(GROUP, self.port, ('127.0.0.1', sender.address[1]),
+                         sender.session, 'lossy', self.root / 'lossy',
+                         '127.0.0.1', loss=0.3)
+        thread = threading.Thread(target=lossy.run)
+        thread.start()
+
+        done = sender.run(['0', '1', '2', 'lossy'], timeout=20)
+        thread.join()
+        for p in procs:
+            self.assertEqual(p.wait(timeout=20), 0)
+
+        self.assertEqual(done, {'0', '1', '2', 'lossy'})
+        for name in ['dev0', 'dev1', 'dev2', 'lossy']:
+            self.assertTree(self.root / name)
+
+    def test_slowFirstPass(self):
+        # the first pass takes longer than the repair timeout
+        archive = self.root / 'share.tar'
+        with open(archive, 'wb') as handle:
+            pack(self.src, handle)
+        sender = Sender(archive, GROUP, self.port, '127.0.0.1', 3e6)
+        receiver = Receiver(GROUP, self.port,
+                            ('127.0.0.1', sender.address[1]),
+                            sender.session, 'slow', self.root / 'slow',
+                            '127.0.0.1')
+        thread = threading.Thread(target=receiver.run)
+        thread.start()
+        done = sender.run(['slow'], timeout=0.5)
+        thread.join()
+        self.assertEqual(done, {'slow'})
+        self.assertTree(self.root / 'slow')
+
+    def test_broadcast(self):
+        def exchange(device):
+            if device == 1:
+                return 'tester@127.0.0.2:/proc/none'
+            return f'tester@127.0.0.{device + 1}:{self.root}/dev{device}'
+
+        results = iter([(0, True), (1, True), (2, False), (3, True)])
+        record = dict()
+        with fakeSsh(), self.assertRaises(SystemExit):
+            broadcast(results, self.src, exchange, 22, DummyProgress(), 4,
+                      GROUP, self.port, '127.0.0.1', 500e6, timeout=10,
+                      delay=0.01, transport=TarWorker, record=record)
+        self.assertTree(self.root / 'dev0')
+        self.assertTree(self.root / 'dev3')
+        self.assertEqual(record, {0: True, 1: False, 2: None, 3: True})
@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+
+import unittest
+import os
+import pathlib
+import tempfile
+import time
+
+from manifest import Manifest
+from prepare import Artifacts, Watcher
+from store import digest
+from transfer import TarWorker
+from test.test_transfer import fakeSsh, makeTree
+
+
+class PrepareTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmpdir.name)
+        self.src = self.root / 'src'
+        self.src.mkdir()
+        makeTree(self.src)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_Artifacts(self):
+        path = self.src / 'sub' / 'b.txt'
+        artifacts = Artifacts(self.root / 'prepared', 'gzip', 1 << 20)
+        self.assertIsNone(artifacts.lookup(path, 'sub/b.txt'))
+        self.assertTrue(artifacts.prepare(path, 'sub/b.txt'))
+        frame = artifacts.lookup(path, 'sub/b.txt')
+        self.assertIsNotNone(frame)
+        # only valid for the same name and content
+        self.assertIsNone(artifacts.lookup(path, 'b.txt'))
+        path.write_text('c' * 1000)
+        self.assertIsNone(artifacts.lookup(path, 'sub/b.txt'))
+
+        # the least recently used member goes first
+        artifacts.prepare(self.src / 'a.txt', 'a.txt')
+        os.utime(frame, (0, 0))
+        artifacts.limit = 0
+        artifacts.evict()
+        self.assertFalse(frame.exists())
+
+    def test_TarWorker(self):
+        with fakeSsh():
+            remote = self.root / 'remote'
+            manifest = Manifest(self.root / 'manifest')
+            artifacts = Artifacts(self.root / 'prepared', 'gzip')
+            for name in ['a.txt', '.hidden', 'sub/b.txt']:
+                artifacts.prepare(self.src / name, name)
+            w = TarWorker(self.src, f'tester@127.0.0.1:{remote}',
+                          codec='gzip', threshold=1.0, verify=True,
+                          manifest=manifest, artifacts=artifacts)
+            w.join()
+            self.assertTrue(w.status)
+            self.assertIsNotNone(w.prepared(w.partition()[0], 'gzip'))
+            self.assertEqual(w.broken, [])
+            self.assertEqual((remote / 'sub' / 'b.txt').read_text(),
+                             'b' * 1000)
+            self.assertEqual((remote / '.hidden').read_text(), 'hidden')
+
+    def test_Watcher(self):
+        share = self.root / 'share'
+        (share / 'S01').mkdir(parents=True)
+        manifest = Manifest(self.root / 'manifest')
+        artifacts = Artifacts(self.root / 'prepared', 'gzip')
+        watcher = Watcher([(share, 1)], manifest, artifacts, 1.0, 0.1)
+        try:
+            time.sleep(0.2)
+            path = share / 'S01' / 'new' / 'c.txt'
+            path.parent.mkdir()
+            time.sleep(0.2)
+            path.write_text('c' * 1000)
+            for _ in range(50):
+                if artifacts.lookup(path, 'new/c.txt') is not None:
+                    break
+                time.sleep(0.1)
+        finally:
+            watcher.stop()
+        self.assertIsNotNone(artifacts.lookup(path, 'new/c.txt'))
+        self.assertEqual(manifest.digest(path), digest(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
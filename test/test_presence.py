@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+
+import unittest
+import ipaddress
+import pathlib
+import tempfile
+import time
+from unittest import mock
+
+from settings import Settings
+from presence import PresenceMap, PresenceService, query, split
+
+
+class PresenceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.settings = Settings()
+        self.settings.first_ip = ipaddress.ip_address('127.0.0.1')
+        self.settings.num_clients = 3
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = pathlib.Path(self.tmpdir.name) / 'presence.sock'
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        del self.settings
+
+    def test_split(self):
+        snapshot = {0: (True, 1.0), 1: (False, 2.0), 2: (True, 60.0)}
+        available, missing, stale = split(snapshot, [0, 1, 2, 3], 30)
+        self.assertEqual(available, [0])
+        self.assertEqual(missing, [1])
+        self.assertEqual(stale, [2, 3])
+
+    def test_PresenceMap(self):
+        m = PresenceMap()
+        m.update(1, True, time.time() - 5)
+        status, age = m.snapshot()[1]
+        self.assertTrue(status)
+        self.assertGreaterEqual(age, 5)
+
+    def test_query(self):
+        self.assertIsNone(query(self.path))
+
+        service = PresenceService(self.settings, self.path, interval=60)
+        try:
+            # wait for the first sweep to complete
+            deadline = time.time() + 3
+            snapshot = dict()
+            while len(snapshot) < 3 and time.time() < deadline:
+                snapshot = query(self.path)
+                time.sleep(0.05)
+            self.assertEqual(set(snapshot), {0, 1, 2})
+            self.assertTrue(snapshot[0][0])
+        finally:
+            service.stop()
+
+        self.assertFalse(self.path.exists())
+
+    def test_failingProbe(self):
+        class FailingService(PresenceService):
+            calls = 0
+
+            def probe(self):
+                self.calls += 1
+                if self.calls == 1:
+                    raise ValueError('broken reply')
+                self.presence.update(0, True)
+                if self.calls == 2:
+                    raise SystemExit
+
+        with self.assertLogs(level='ERROR'), \
+                mock.patch('threading.excepthook'):
+            service = FailingService(self.settings, self.path, interval=0.01)
+            service.join(3)
+        try:
+            # the first error is survived, the second ends the thread
+            self.assertEqual(service.calls, 2)
+            self.assertFalse(service.is_alive())
+            self.assertEqual(query(self.path), dict())
+        finally:
+            service.stop()
@@ -0,0 +1,41 @@
+#!/usr/bin/python3
+
+import unittest
+import pathlib
+import tempfile
+
+from record import ResultRecord
+
+
+class RecordTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.record = ResultRecord(
+            pathlib.Path(self.tmpdir.name) / 'results.json')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_failed(self):
+        self.assertEqual(self.record.failed(), (None, []))
+        self.record.save('fetch', {0: True, 1: False, 2: None})
+        self.record.save('share-all', {0: True, 3: False})
+        self.assertEqual(self.record.failed(), ('share-all', [3]))
+        self.assertEqual(self.record.failed('fetch'), ('fetch', [1, 2]))
+
+        self.record.save('share-all', {3: True})
+        self.assertEqual(self.record.failed(), ('share-all', []))
+
+    def test_sizes(self):
+        self.assertEqual(self.record.sizes('fetch'), dict())
+        self.record.save('fetch', {0: True, 1: True}, {0: 100, 1: 200})
+        # a retry only measures its devices
+        self.record.save('fetch', {1: True}, {1: 300})
+        self.assertEqual(self.record.sizes('fetch'), {0: 100, 1: 300})
+        self.assertEqual(self.record.failed(), ('fetch', []))
+
+    def test_traffic(self):
+        self.record.save('share-all', {0: True}, traffic={0: (1000, 250)})
+        self.assertEqual(self.record.load()['share-all']['traffic'],
+                         {'0': {'raw': 1000, 'sent': 250}})
@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+
+import unittest
+import pathlib
+import tempfile
+
+from relay import listEntries, relay
+from transfer import TarWorker
+from test.test_transfer import DummyProgress, fakeSsh, makeTree
+
+
+class RelayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmpdir.name)
+        self.src = self.root / 'src'
+        self.src.mkdir()
+        makeTree(self.src)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def exchange(self, device):
+        return f'tester@127.0.0.{device + 1}:{self.root}/dev{device}'
+
+    def test_listEntries(self):
+        self.assertEqual(listEntries(self.src),
+                         ['sub', '.hidden', 'a.txt', 'sub/b.txt'])
+
+    def test_relay(self):
+        seeds = list()
+
+        def transport(*args, **kwargs):
+            seeds.append(args[1])
+            return TarWorker(*args, **kwargs)
+
+        results = iter([(0, True), (1, True), (2, False), (3, True),
+                        (4, True)])
+        with fakeSsh():
+            available, missing = relay(
+                results, self.src, self.exchange, 22, DummyProgress(), 5,
+                fanout=1, delay=0.01, transport=transport)
+
+        self.assertEqual(sorted(available), [0, 1, 3, 4])
+        self.assertEqual(missing, [2])
+        self.assertLess(len(seeds), 4)
+        for device in available:
+            path = self.root / f'dev{device}'
+            self.assertEqual((path / 'sub' / 'b.txt').read_text(), 'b' * 1000)
+            self.assertEqual((path / '.hidden').read_text(), 'hidden')
+
+    def test_failure(self):
+        def exchange(device):
+            if device == 1:
+                return 'tester@127.0.0.2:/proc/none'
+            return self.exchange(device)
+
+        results = iter([(0, True), (1, True), (2, True), (3, False)])
+        record = dict()
+        with fakeSsh(), self.assertRaises(SystemExit):
+            relay(results, self.src, exchange, 22, DummyProgress(), 4,
+                  fanout=2, delay=0.01, transport=TarWorker, record=record)
+        self.assertTrue((self.root / 'dev2' / 'a.txt').exists())
+        self.assertEqual(record, {0: True, 1: False, 2: True, 3: None})
+
+    def test_busyParent(self):
+        # a device failing next to others served by the same parent
+        def exchange(device):
+            if device == 4:
+                return 'tester@127.0.0.5:/proc/none'
+            return self.exchange(device)
+
+        results = iter([(device, True) for device in range(10)])
+        with fakeSsh(), self.assertRaises(SystemExit) as cm:
+            relay(results, self.src, exchange, 22, DummyProgress(), 10,
+                  fanout=3, delay=0.01, transport=TarWorker)
+        self.assertIn('1 von 10', str(cm.exception.code))
+        for device in [0, 1, 2, 3, 5, 6, 7, 8, 9]:
+            self.assertEqual(
+                (self.root / f'dev{device}' / 'a.txt').read_text(), 'a')
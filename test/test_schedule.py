@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+
+import unittest
+import pathlib
+import tempfile
+import time
+
+from connection import ConnectionPool
+from schedule import localSize, makespan, measureFound, preflight
+from transfer import TransferWorker, pipeline
+from test.test_transfer import DummyProgress, fakeSsh, makeTree
+
+
+class ScheduleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmpdir.name)
+        makeTree(self.root)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_sizes(self):
+        self.assertEqual(localSize(self.root), 1007)
+        sizes = preflight([0, 1], lambda device: [
+            self.root / 'sub', self.root][device])
+        self.assertEqual(sizes, {0: 1000, 1: 1007})
+
+    def test_measureFound(self):
+        pool = ConnectionPool(self.root / 'ssh')
+        paths = {0: f'tester@127.0.0.1:{self.root}/sub',
+                 1: 'tester@127.0.0.1:/proc/none'}
+        sizes = {0: 10, 2: 20}
+        with fakeSsh():
+            results = list(measureFound(
+                iter([(0, True), (1, True), (2, False)]), paths.get, sizes,
+                pool))
+            deadline = time.time() + 3
+            while sizes[0] == 10 and time.time() < deadline:
+                time.sleep(0.01)
+        self.assertEqual(results, [(0, True), (1, True), (2, False)])
+        self.assertGreaterEqual(sizes[0], 1000)
+        self.assertEqual(sizes[2], 20)
+        self.assertNotIn(1, sizes)
+
+    def test_makespan(self):
+        # largest first on two slots: 5+3 and 4+3+3
+        self.assertEqual(makespan([5, 4, 3, 3, 3], 2, 1), 20)
+        self.assertEqual(makespan([5, 4], 0, 1), 10)
+        self.assertEqual(makespan([], 2, 1), 0)
+
+    def test_order(self):
+        started = list()
+
+        class Worker(TransferWorker):
+            def run(self):
+                started.append(self.dst)
+                time.sleep(0.05)
+                self.status = True
+
+        # the others queue up while the first device is served
+        sizes = {9: 100, 0: 10, 1: 30, 2: 20}
+        pipeline(iter([(9, True), (0, True), (1, True), (2, True)]),
+                 lambda d: None, lambda d: d, 22, DummyProgress(), 4,
+                 delay=0.01, transport=Worker, limit=1, sizes=sizes)
+        self.assertEqual(started, [9, 1, 2, 0])
@@ -44,6 +44,19 @@ class SettingTest(unittest.TestCase):
         self.assertEqual(self.settings.share, loaded.share)
         self.assertEqual(self.settings.shareall, loaded.shareall)
 
+    def test_olderFile(self):
+        # files without a [transfer] section keep the plain scp transport
+        with tempfile.NamedTemporaryFile(mode='w') as tmpfile:
+            self.settings.saveToFile(pathlib.Path(tmpfile.name))
+            with open(tmpfile.name) as handle:
+                text = handle.read()
+            with open(tmpfile.name, 'w') as handle:
+                handle.write(text[:text.index('[transfer]')])
+            loaded = Settings()
+            loaded.loadFromFile(pathlib.Path(tmpfile.name))
+        self.assertEqual(loaded.transfer_mode, 'scp')
+        self.assertFalse(loaded.verify)
+
     def test_getDirName(self):
         self.assertEqual(self.settings.getDirName(2), 'PC03')
         self.assertEqual(self.settings.getDirName(11), 'PC12')
@@ -0,0 +1,63 @@
+#!/usr/bin/python3
+
+import unittest
+import datetime
+import os
+import pathlib
+import tempfile
+import zipfile
+
+import snapshot
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_latest(self):
+        device = self.root / 'S01'
+        self.assertIsNone(snapshot.latest(device))
+
+        older = device / snapshot.stamp(datetime.datetime(2024, 1, 1, 8))
+        newer = device / snapshot.stamp(datetime.datetime(2024, 1, 1, 9))
+        for folder in [older, newer, device / 'other']:
+            folder.mkdir(parents=True)
+
+        self.assertEqual(snapshot.snapshots(device), [older, newer])
+        self.assertEqual(snapshot.latest(device), newer)
+        self.assertEqual(snapshot.latest(device, exclude=newer), older)
+
+    def test_linkUnchanged(self):
+        reference = self.root / 'old'
+        target = self.root / 'new'
+        (reference / 'sub').mkdir(parents=True)
+        path = reference / 'sub' / 'a.txt'
+        path.write_text('abc')
+        mtime = path.stat().st_mtime
+
+        self.assertFalse(snapshot.linkUnchanged(
+            reference, target, 'sub/a.txt', 4, mtime))
+        self.assertFalse(snapshot.linkUnchanged(
+            reference, target, 'sub/a.txt', 3, mtime + 10))
+        self.assertTrue(snapshot.linkUnchanged(
+            reference, target, 'sub/a.txt', 3, mtime))
+        self.assertTrue(os.path.samefile(path, target / 'sub' / 'a.txt'))
+
+    def test_archive(self):
+        name = snapshot.stamp()
+        for device in ['S01', 'S02']:
+            folder = self.root / 'fetch' / device / name
+            folder.mkdir(parents=True)
+            (folder / 'a.txt').write_text(device)
+        (self.root / 'fetch' / 'S01' / 'old').mkdir()
+
+        zipname = self.root / 'out.zip'
+        snapshot.archive(zipname, self.root / 'fetch', name)
+        with zipfile.ZipFile(zipname) as zf:
+            self.assertEqual(sorted(zf.namelist()), ['S01/a.txt', 'S02/a.txt'])
+            self.assertEqual(zf.read('S02/a.txt'), b'S02')
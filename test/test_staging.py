@@ -0,0 +1,121 @@
+#!/usr/bin/python3
+
+import unittest
+import functools
+import pathlib
+import tempfile
+
+from journal import Journal
+from staging import CommitWorker, StageWorker, fingerprint
+from transfer import TarWorker
+from test.test_transfer import fakeSsh, makeTree
+
+
+class StagingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmpdir.name)
+        self.own = self.root / 'own'
+        self.common = self.root / 'common'
+        self.own.mkdir()
+        self.common.mkdir()
+        makeTree(self.common)
+        (self.own / 'task.txt').write_text('task')
+        self.exchange = self.root / 'exchange'
+        self.exchange.mkdir()
+        (self.exchange / 'work.txt').write_text('work')
+        self.stage = self.root / '.exchange.stage'
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def run_worker(self, cls, transport=TarWorker, **kwargs):
+        dst = self.stage if cls is StageWorker else self.exchange
+        with fakeSsh():
+            w = cls((self.own, self.common), f'tester@127.0.0.1:{dst}',
+                    transport=transport, **kwargs)
+            w.join()
+        return w
+
+    def test_fingerprint(self):
+        before = fingerprint([self.own, self.common])
+        self.assertEqual(before, fingerprint([self.own, self.common]))
+        (self.own / 'task.txt').write_text('changed')
+        self.assertNotEqual(before, fingerprint([self.own, self.common]))
+
+    def test_commit(self):
+        self.assertTrue(self.run_worker(StageWorker).status)
+        self.assertTrue((self.stage / 'data' / 'task.txt').exists())
+        self.assertFalse((self.exchange / 'task.txt').exists())
+
+        w = self.run_worker(CommitWorker, stage=self.stage)
+        self.assertTrue(w.status)
+        self.assertTrue(w.staged)
+        self.assertFalse(self.stage.exists())
+        self.assertEqual((self.exchange / 'task.txt').read_text(), 'task')
+        self.assertEqual((self.exchange / 'sub' / 'b.txt').read_text(),
+                         'b' * 1000)
+        self.assertEqual((self.exchange / 'work.txt').read_text(), 'work')
+
+    def test_fallback(self):
+        self.assertTrue(self.run_worker(StageWorker).status)
+        (self.own / 'task.txt').write_text('changed')
+
+        w = self.run_worker(CommitWorker, stage=self.stage)
+        self.assertTrue(w.status)
+        self.assertFalse(w.staged)
+        self.assertFalse(self.stage.exists())
+        self.assertEqual((self.exchange / 'task.txt').read_text(), 'changed')
+
+    def test_failedStage(self):
+        common = self.common
+
+        class BrokenWorker(TarWorker):
+            def run(self):
+                super().run()
+                if self.src == common:
+                    self.status = False
+
+        with fakeSsh():
+            w = StageWorker((self.own, self.common),
+                            f'tester@127.0.0.1:{self.stage}',
+                            transport=BrokenWorker)
+            w.join()
+        self.assertFalse(w.status)
+        self.assertFalse(self.stage.exists())
+
+    def test_restage(self):
+        journal = Journal(self.root / 'journal')
+        common = self.common
+
+        class InterruptedWorker(TarWorker):
+            def run(self):
+                super().run()
+                if self.src == common:
+                    # only a.txt arrived before the connection broke
+                    checkpoint = journal.open(self.src, self.dst)
+                    st = (common / 'a.txt').stat()
+                    checkpoint.done('a.txt', st.st_size, st.st_mtime)
+                    checkpoint.close(False)
+                    self.status = False
+
+        with fakeSsh():
+            w = StageWorker((self.own, self.common),
+                            f'tester@127.0.0.1:{self.stage}',
+                            transport=functools.partial(InterruptedWorker,
+                                                        journal=journal),
+                            journal=journal)
+            w.join()
+        self.assertFalse(w.status)
+        self.assertFalse(self.stage.exists())
+
+        transport = functools.partial(TarWorker, journal=journal)
+        self.assertTrue(self.run_worker(StageWorker, journal=journal,
+                                        transport=transport).status)
+        w = self.run_worker(CommitWorker, stage=self.stage, journal=journal,
+                            transport=transport)
+        self.assertTrue(w.staged)
+        self.assertEqual((self.exchange / 'a.txt').read_text(), 'a')
+        self.assertEqual((self.exchange / 'sub' / 'b.txt').read_text(),
+                         'b' * 1000)
@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+
+import unittest
+import os
+import pathlib
+import tempfile
+
+from store import Store, digest
+from transfer import TarWorker
+from test.test_transfer import fakeSsh
+
+
+class StoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmpdir.name)
+        self.store = Store(self.root / '.store')
+        for device in ['S01', 'S02']:
+            (self.root / device).mkdir()
+            (self.root / device / 'handout.txt').write_text('same')
+            (self.root / device / 'own.txt').write_text(device)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        del self.store
+
+    def test_ingestTree(self):
+        first = self.store.ingestTree(self.root / 'S01')
+        second = self.store.ingestTree(self.root / 'S02')
+
+        self.assertEqual(first['handout.txt'], second['handout.txt'])
+        self.assertNotEqual(first['own.txt'], second['own.txt'])
+        self.assertTrue(os.path.samefile(
+            self.root / 'S01' / 'handout.txt',
+            self.root / 'S02' / 'handout.txt'))
+        self.assertEqual(
+            self.store.blobPath(digest(self.root / 'S02' / 'own.txt')).read_text(),
+            'S02')
+        self.assertEqual(len(list(self.store.root.glob('*/*'))), 3)
+
+    def test_refetch(self):
+        # fetch in place twice, the second time with an edited handout
+        remote = self.root / 'remote'
+        (remote / 'S01').mkdir(parents=True)
+        (remote / 'S02').mkdir()
+        for device in ['S01', 'S02']:
+            (remote / device / 'handout.txt').write_text('same')
+        with fakeSsh():
+            for verify in (False, True, False, True):
+                for device in ['S01', 'S02']:
+                    w = TarWorker(f'tester@127.0.0.1:{remote / device}',
+                                  self.root / device, verify=verify)
+                    w.join()
+                    self.assertTrue(w.status)
+                    self.store.ingestTree(self.root / device)
+                (remote / 'S01' / 'handout.txt').write_text(f'{verify}')
+        self.assertEqual((self.root / 'S02' / 'handout.txt').read_text(),
+                         'same')
+        self.assertEqual((self.root / 'S01' / 'handout.txt').read_text(),
+                         'False')
+
+        # scp writes into the files, so the links are released first
+        self.store.release(self.root / 'S01')
+        (self.root / 'S01' / 'handout.txt').write_text('edited')
+        self.assertEqual((self.root / 'S02' / 'handout.txt').read_text(),
+                         'same')
+
+    def test_prune(self):
+        self.store.ingestTree(self.root / 'S01')
+        (self.root / 'S01' / 'own.txt').unlink()
+        self.store.prune()
+        self.assertEqual(len(list(self.store.root.glob('*/*'))), 1)
@@ -0,0 +1,53 @@
+#!/usr/bin/python3
+
+import unittest
+import threading
+import time
+
+from throttle import Budget, TokenBucket
+
+
+class ThrottleTest(unittest.TestCase):
+
+    def consume(self, budget, key, chunks, size=50000):
+        for _ in range(chunks):
+            budget.consume(key, size)
+
+    def test_bucket(self):
+        bucket = TokenBucket(1000, burst=500)
+        now = bucket.last
+        self.assertEqual(bucket.reserve(500, now), 0)
+        self.assertAlmostEqual(bucket.reserve(500, now), 0.5)
+        # the debt is paid off over time
+        self.assertAlmostEqual(bucket.reserve(100, now + 0.4), 0.2)
+        self.assertEqual(bucket.reserve(100, now + 5.0), 0)
+
+    def test_total(self):
+        # 200 kB beyond the burst at 1 MB/s shared by two devices
+        budget = Budget(total=1e6)
+        start = time.monotonic()
+        threads = [threading.Thread(target=self.consume,
+                                    args=(budget, key, 9))
+                   for key in ('a', 'b')]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertGreater(time.monotonic() - start, 0.6)
+
+    def test_device(self):
+        # a capped device does not slow down the others
+        budget = Budget(total=10e6, device=1e6)
+        start = time.monotonic()
+        self.consume(budget, 'a', 5)
+        self.assertLess(time.monotonic() - start, 0.2)
+        self.consume(budget, 'a', 10)
+        self.assertGreater(time.monotonic() - start, 0.45)
+        start = time.monotonic()
+        self.consume(budget, 'b', 5)
+        self.assertLess(time.monotonic() - start, 0.2)
+
+    def test_static(self):
+        self.assertEqual(Budget().static(), 0)
+        self.assertEqual(Budget(8e6, 0, 4).static(), 2e6)
+        self.assertEqual(Budget(8e6, 1e6, 4).static(), 1e6)
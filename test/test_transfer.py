@@ -2,10 +2,15 @@
 
 import unittest
 import ipaddress
+import os
 import pathlib
+import tempfile
+import threading
+import time
+from unittest import mock
 
 from settings import Settings
-from transfer import TransferWorker, batch
+from transfer import TransferWorker, TarWorker, batch, pipeline, parseStats
 
 
 class DummyProgress(object):
@@ -21,9 +26,45 @@ class DummyProgress(object):
     def finish(self):
         self.value = 1.0
 
+
+def fakeSsh():
+    """Put the ssh stand-in from test/bin in front of PATH."""
+    bindir = pathlib.Path(__file__).parent / 'bin'
+    path = f'{bindir}{os.pathsep}{os.environ["PATH"]}'
+    return mock.patch.dict(os.environ, {'PATH': path})
+
+
+def makeTree(root):
+    root = pathlib.Path(root)
+    (root / 'sub').mkdir()
+    (root / 'a.txt').write_text('a')
+    (root / '.hidden').write_text('hidden')
+    (root / 'sub' / 'b.txt').write_text('b' * 1000)
+
 # ---------------------------------------------------------------------
 
 
+class FlakyWorker(TransferWorker):
+    """Fails with ssh's exit status on the first try of odd devices."""
+    tries = dict()
+    running = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def run(self):
+        cls = FlakyWorker
+        with cls.lock:
+            cls.running += 1
+            cls.peak = max(cls.peak, cls.running)
+            cls.tries[self.dst] = cls.tries.get(self.dst, 0) + 1
+            flaky = self.dst % 2 == 1 and cls.tries[self.dst] == 1
+        time.sleep(0.02)
+        with cls.lock:
+            cls.running -= 1
+        self.code = 255 if flaky else None
+        self.status = not flaky
+
+
 class TransferTest(unittest.TestCase):
 
     def setUp(self):
@@ -45,6 +86,16 @@ class TransferTest(unittest.TestCase):
         w = TransferWorker('/tmp/from', 'tester@0.0.0.1:/tmp/to')
         w.join()
 
+    def test_TransferWorker_snapshot(self):
+        with tempfile.TemporaryDirectory() as tmpdir, \
+                mock.patch('transfer.subprocess.run') as run:
+            run.return_value.returncode = 0
+            dst = pathlib.Path(tmpdir) / 'PC01' / '2026-10-18_10-00-00'
+            w = TransferWorker('tester@0.0.0.1:/tmp/from', dst)
+            w.join()
+            self.assertTrue(w.status)
+            self.assertTrue(dst.is_dir())
+
     def test_batch(self):
         p = DummyProgress()
         devices = [1, 3, 4]
@@ -54,4 +105,113 @@ class TransferTest(unittest.TestCase):
             # may fail anyway because there is no SSH server available
             # during unittest
             batch(devices, src_lambda, dst_lambda, p)
-        
+
+    def test_pipeline(self):
+        p = DummyProgress()
+        results = iter([(0, True), (1, False), (2, True)])
+        with tempfile.TemporaryDirectory() as empty:
+            # empty source directories are skipped without connecting
+            available, missing = pipeline(
+                results, lambda device: empty,
+                self.settings.getExchangeDir, 22, p, 3)
+        self.assertEqual(p.value, 1.0)
+        self.assertEqual(available, [0, 2])
+        self.assertEqual(missing, [1])
+
+    def test_pipeline_retry(self):
+        results = iter([(device, device != 5) for device in range(6)])
+        record = dict()
+        available, missing = pipeline(
+            results, lambda device: None, lambda device: device, 22,
+            DummyProgress(), 6, delay=0.005, transport=FlakyWorker, limit=2,
+            attempts=2, backoff=0.01, record=record)
+        self.assertEqual(available, [0, 1, 2, 3, 4])
+        self.assertEqual(FlakyWorker.peak, 2)
+        self.assertEqual(FlakyWorker.tries, {0: 1, 1: 2, 2: 1, 3: 2, 4: 1})
+        self.assertEqual(record, {0: True, 1: True, 2: True, 3: True,
+                                  4: True, 5: None})
+
+        # no retries left
+        FlakyWorker.tries.clear()
+        record.clear()
+        with self.assertRaises(SystemExit):
+            pipeline(iter([(0, True), (1, True)]), lambda device: None,
+                     lambda device: device, 22, DummyProgress(), 2,
+                     delay=0.005, transport=FlakyWorker, record=record)
+        self.assertEqual(record, {0: True, 1: False})
+
+    def test_TarWorker(self):
+        with tempfile.TemporaryDirectory() as tmpdir, fakeSsh():
+            tmpdir = pathlib.Path(tmpdir)
+            src, remote, back = tmpdir / 'src', tmpdir / 'remote', tmpdir / 'back'
+            src.mkdir()
+            makeTree(src)
+
+            # share into the remote exchange directory
+            w = TarWorker(src, f'tester@127.0.0.1:{remote}')
+            w.join()
+            self.assertTrue(w.status)
+            self.assertEqual((remote / '.hidden').read_text(), 'hidden')
+            self.assertEqual((remote / 'sub' / 'b.txt').read_text(), 'b' * 1000)
+
+            # fetch it back
+            w = TarWorker(f'tester@127.0.0.1:{remote}', back)
+            w.join()
+            self.assertTrue(w.status)
+            self.assertEqual((back / 'a.txt').read_text(), 'a')
+            self.assertEqual((back / 'sub' / 'b.txt').read_text(), 'b' * 1000)
+
+            # compress text, pass through already compressed files
+            (src / 'photo.jpg').write_bytes(os.urandom(5000))
+            w = TarWorker(src, f'tester@127.0.0.1:{remote}2', codec='gzip')
+            w.join()
+            self.assertTrue(w.status)
+            self.assertLess(w.sent, w.raw)
+            self.assertEqual((remote.with_name('remote2') / 'photo.jpg').read_bytes(),
+                             (src / 'photo.jpg').read_bytes())
+
+            w = TarWorker(f'tester@127.0.0.1:{remote}2', back, codec='gzip')
+            w.join()
+            self.assertTrue(w.status)
+            self.assertEqual((back / 'photo.jpg').read_bytes(),
+                             (src / 'photo.jpg').read_bytes())
+            self.assertEqual((back / '.hidden').read_text(), 'hidden')
+
+            # missing remote directory
+            w = TarWorker(f'tester@127.0.0.1:{tmpdir}/none', back)
+            w.join()
+            self.assertFalse(w.status)
+
+    def test_parseStats(self):
+        output = """
+Number of files: 4 (reg: 3, dir: 1)
+Total file size: 1,234,567 bytes
+Total transferred file size: 10,000 bytes
+Literal data: 2,048 bytes
+Matched data: 7,952 bytes
+"""
+        self.assertEqual(parseStats(output), (1234567, 2048))
+        self.assertEqual(parseStats(''), (0, 0))
+
+    def test_TarWorker_snapshot(self):
+        with tempfile.TemporaryDirectory() as tmpdir, fakeSsh():
+            tmpdir = pathlib.Path(tmpdir)
+            remote, fetch = tmpdir / 'remote', tmpdir / 'fetch'
+            remote.mkdir()
+            makeTree(remote)
+
+            first = fetch / '2024-01-01_08-00-00'
+            w = TarWorker(f'tester@127.0.0.1:{remote}', first, snapshot=True)
+            w.join()
+            self.assertTrue(w.status)
+
+            # unchanged files are linked, changed ones transferred
+            (remote / 'a.txt').write_text('changed')
+            second = fetch / '2024-01-01_09-00-00'
+            w = TarWorker(f'tester@127.0.0.1:{remote}', second, snapshot=True)
+            w.join()
+            self.assertTrue(w.status)
+            self.assertTrue(os.path.samefile(first / 'sub' / 'b.txt',
+                                             second / 'sub' / 'b.txt'))
+            self.assertEqual((first / 'a.txt').read_text(), 'a')
+            self.assertEqual((second / 'a.txt').read_text(), 'changed')
@@ -0,0 +1,57 @@
+#!/usr/bin/python3
+
+import unittest
+import pathlib
+import tempfile
+
+from trash import Trash
+from test.test_transfer import makeTree
+
+
+class TrashTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmpdir.name)
+        self.share = self.root / 'share'
+        self.share.mkdir()
+        makeTree(self.share)
+        self.share.chmod(0o750)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_discard(self):
+        inode = self.share.stat().st_ino
+        trash = Trash([self.root / '.trash'])
+        trash.discard(self.share)
+        # a fresh folder takes its place at once
+        self.assertEqual(list(self.share.iterdir()), [])
+        self.assertNotEqual(self.share.stat().st_ino, inode)
+        self.assertEqual(self.share.stat().st_mode & 0o777, 0o750)
+        trash.close()
+        trash.join()
+        self.assertEqual(list((self.root / '.trash').iterdir()), [])
+
+    def test_inplace(self):
+        inode = self.share.stat().st_ino
+        trash = Trash([self.root / '.trash'])
+        trash.discard(self.share, inplace=True)
+        self.assertEqual(list(self.share.iterdir()), [])
+        self.assertEqual(self.share.stat().st_ino, inode)
+        trash.close()
+        trash.join()
+        self.assertEqual(list((self.root / '.trash').iterdir()), [])
+
+    def test_leftovers(self):
+        # a run interrupted after the swap
+        (self.root / '.trash').mkdir()
+        self.share.rename(self.root / '.trash' / 'share1234')
+        trash = Trash([self.root / '.trash'])
+        trash.close()
+        trash.join()
+        self.assertEqual(list((self.root / '.trash').iterdir()), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
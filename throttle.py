@@ -0,0 +1,70 @@
+#!/usr/bin/python3
+
+import threading
+import time
+
+
+class TokenBucket(object):
+    """Admits {rate} bytes per second with bursts of up to {burst} bytes.
+Callers reserve bytes in advance and sleep off the debt, so concurrent
+callers are served in the order they asked.
+"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(rate / 4, 65536)
+        self.tokens = self.burst
+        self.last = time.monotonic()
+
+    def reserve(self, size, now):
+        """Take {size} bytes and return the seconds to wait for them."""
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        self.tokens -= size
+        return max(0.0, -self.tokens / self.rate)
+
+
+class Budget(object):
+    """Bandwidth shared by all transfers of a run: at most {total} bytes
+per second together and {device} bytes per second per device, 0 means
+unlimited. The total is not split up front, so devices that are idle or
+slow leave their share to the busy ones. {slots} is the number of
+transfers running at once.
+
+budget = Budget(12.5e6, 2.5e6, 8)
+budget.consume('schueler@192.168.2.100', len(data))
+"""
+
+    def __init__(self, total=0, device=0, slots=1):
+        self.total = total
+        self.device = device
+        self.slots = slots
+        self.bucket = TokenBucket(total) if total > 0 else None
+        self.buckets = dict()
+        self.lock = threading.Lock()
+
+    def consume(self, key, size):
+        """Block until {size} bytes of the device {key} may be sent."""
+        with self.lock:
+            now = time.monotonic()
+            wait = 0.0
+            if self.bucket is not None:
+                wait = self.bucket.reserve(size, now)
+            if self.device > 0:
+                bucket = self.buckets.setdefault(key,
+                                                 TokenBucket(self.device))
+                wait = max(wait, bucket.reserve(size, now))
+        if wait > 0:
+            time.sleep(wait)
+
+    def static(self):
+        """Return a fixed rate per device for tools that cannot share the
+budget, or 0 for unlimited.
+"""
+        rates = list()
+        if self.device > 0:
+            rates.append(self.device)
+        if self.total > 0:
+            rates.append(self.total / max(self.slots, 1))
+        return min(rates, default=0)
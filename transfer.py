@@ -1,70 +1,954 @@
 #!/usr/bin/python3
 
+import functools
 import os
+import re
+import shlex
 import subprocess
+import tarfile
 import threading
 import time
 import logging
 
+from cache import ContentCache, lines
+from chunked import receiveFile, sendFile
+from compression import CODECS, INCOMPRESSIBLE, isCompressible
+from connection import splitRemote, quoteRemote
+import integrity
+from journal import Journal
+from prepare import Artifacts
+from snapshot import latest, linkUnchanged
+from store import digest
+from throttle import Budget
+
 
 class TransferWorker(threading.Thread):
     """Thread to handle copy via SSH."""
 
-    def __init__(self, src, dst, port=22, timeout=3):
-        """Transer files from {src} to {dst}."""
+    # exit statuses of connection problems worth a retry, 255 is ssh's own
+    transient = (255,)
+
+    def __init__(self, src, dst, port=22, timeout=3, pool=None, budget=None,
+                 manifest=None):
+        """Transer files from {src} to {dst}. If a connection {pool} is
+given, its SSH session to the device is reused. The throughput is limited
+by the throttle.Budget {budget}, if given. Local sources are looked up in
+the manifest.Manifest {manifest}, if given, instead of being listed.
+"""
         super().__init__()
         self.src = src
         self.dst = dst
         self.port = port
         self.timeout = timeout
+        self.pool = pool
+        self.budget = budget
+        self.manifest = manifest
         self.status = None
+        self.code = None
+        self.raw = 0
+        self.sent = 0
         self.start()
 
+    def isEmpty(self):
+        """Return whether the source is an empty local directory."""
+        if not str(self.src).startswith('/'):
+            return False
+        if self.manifest is not None:
+            return self.manifest.isEmpty(self.src)
+        return len(os.listdir(self.src)) == 0
+
+    def shell(self, login, pooled=True):
+        """Return the ssh command line used to reach {login}. Unless
+{pooled}, a connection of its own is opened."""
+        if self.pool is not None and pooled:
+            options = self.pool.options(login, self.port)
+        else:
+            options = ['-o', f'ConnectTimeout={self.timeout}']
+        return ['ssh', *options, '-p', str(self.port)]
+
+    def ssh(self, login, command, pooled=True):
+        """Return the argument list running {command} on {login}."""
+        return self.shell(login, pooled) + [login, command]
+
+    def exited(self, p):
+        """Keep the exit status of the finished process {p} if it failed.
+Returns whether it succeeded.
+"""
+        if p.returncode != 0:
+            self.code = p.returncode
+        return p.returncode == 0
+
+    def login(self):
+        """Return the login of the device on the remote side."""
+        return splitRemote(str(self.src))[0] or splitRemote(str(self.dst))[0]
+
+    def throttle(self, size):
+        """Wait until {size} bytes may be sent within the budget."""
+        if self.budget is not None:
+            self.budget.consume(self.login(), size)
+
+    def isTransient(self):
+        """Return whether the transfer failed due to a connection problem
+that may be gone on a retry.
+"""
+        return not self.status and self.code in self.transient
+
     def run(self):
         """Trigger scp as subprocess and save success status."""
         # skip empty directories
-        if str(self.src).startswith('/') and len(os.listdir(self.src)) == 0:
+        if self.isEmpty():
             logging.debug(f'Skipping empty directory {self.src}.')
             self.status = 1
         else:
-            cmd = f'scp -o ConnectTimeout={self.timeout} -rP {self.port} {self.src}/* {self.dst}/'
+            options = f'-o ConnectTimeout={self.timeout}'
+            if self.pool is not None:
+                options = shlex.join(self.pool.options(self.login(),
+                                                       self.port))
+            if self.budget is not None and self.budget.static() > 0:
+                # scp cannot share the budget, use a fixed Kbit/s limit
+                options += f' -l {max(1, int(self.budget.static() / 125))}'
+            if splitRemote(str(self.dst))[0] is None:
+                # scp does not create the target, e.g. a new snapshot
+                os.makedirs(self.dst, exist_ok=True)
+            cmd = f'scp {options} -rP {self.port} {self.src}/* {self.dst}/'
             logging.debug(cmd)
             p = subprocess.run(cmd, shell=True, stdin=subprocess.PIPE,
                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            self.status = p.returncode == 0
+            self.status = self.exited(p)
 
 
-def batch(devices, src_lambda, dst_lambda, remote_port, progress, delay=0.1):
-    """Batch transfer for {devices}. Source and destination folders will
-be picked based on the actual device using {src_lambda} and {dst_lambda}.
+class Meter(object):
+    """File-like wrapper counting the bytes read from or written to
+{handle}. If given, {throttle} is called with the size of every chunk to
+pace the stream.
+"""
+
+    def __init__(self, handle, throttle=None):
+        self.handle = handle
+        self.throttle = throttle
+        self.count = 0
+
+    def read(self, size=-1):
+        data = self.handle.read(size)
+        self.count += len(data)
+        if self.throttle is not None:
+            self.throttle(len(data))
+        return data
+
+    def write(self, data):
+        if self.throttle is not None:
+            self.throttle(len(data))
+        self.handle.write(data)
+        self.count += len(data)
+        return len(data)
+
+    def flush(self):
+        self.handle.flush()
+
+
+def partition(src, codec='none', threshold=0.9):
+    """Split the local directory {src} into entries worth compressing with
+{codec} and plain entries. Both are lists of (path, arcname) pairs.
+Directories are plain.
+"""
+    packed = list()
+    plain = list()
+    compress = CODECS.get(codec) is not None
+    for root, dirs, files in os.walk(src):
+        dirs.sort()
+        for name in dirs + sorted(files):
+            path = os.path.join(root, name)
+            entry = (path, os.path.relpath(path, src))
+            if compress and name in files and isCompressible(path, threshold):
+                packed.append(entry)
+            else:
+                plain.append(entry)
+    return packed, plain
+
+
+class TarWorker(TransferWorker):
+    """Thread to handle copy as a tar stream through one SSH channel.
+Unlike scp, this costs no round trip per file and includes dotfiles.
+
+With a {codec} from compression.CODECS, compressible files travel in a
+compressed stream and already compressed files in a plain one. The bytes
+before and after compression are kept in {raw} and {sent}.
+
+In {snapshot} mode, the local destination is a new snapshot directory and
+unchanged files are hardlinked from the previous snapshot next to it.
+
+With a content {cache}, files the device received before are restored
+from its cache instead of being sent again.
+
+Files of at least {large} bytes are cut into ranges sent over {streams}
+parallel SSH channels, through the connection pool if {pooled}, see
+chunked.sendFile. 0 disables this.
+
+With a {journal}, completed files and verified ranges are checkpointed,
+so an interrupted transfer skips them when it is started again.
+
+With {verify}, both ends hash the files while they stream, see
+integrity.py. Files that arrived broken are sent once more and the
+digests of received files are recorded in {dst}.b2sum.
+
+{ingest}, if given, is called with the local path of every received file
+as soon as it is complete, see archive.Collector.
+
+With prepared {artifacts} for the codec, see prepare.Artifacts, a packed
+stream whose files were all compressed ahead of time is sent by
+concatenating their frames instead of compressing it again.
+"""
+
+    def __init__(self, src, dst, port=22, timeout=3, pool=None,
+                 codec='none', threshold=0.9, snapshot=False, cache=None,
+                 budget=None, large=0, streams=4, pooled=False, journal=None,
+                 verify=False, ingest=None, manifest=None, artifacts=None):
+        self.codec = codec
+        self.threshold = threshold
+        self.snapshot = snapshot
+        self.cache = cache
+        self.large = large
+        self.streams = streams
+        self.pooled = pooled
+        self.journal = journal
+        self.checkpoint = None
+        self.verify = verify
+        self.ingest = ingest
+        self.artifacts = artifacts
+        self.broken = list()
+        self.digests = dict()
+        super().__init__(src, dst, port, timeout, pool, budget, manifest)
+
+    def run(self):
+        """Stream the tree and save success status."""
+        # skip empty directories
+        if self.isEmpty():
+            logging.debug(f'Skipping empty directory {self.src}.')
+            self.status = 1
+            return
+
+        login, path = splitRemote(self.dst)
+        # a new snapshot directory never continues an earlier one
+        if self.journal is not None and \
+                not (self.snapshot and login is None):
+            self.checkpoint = self.journal.open(self.src, self.dst)
+        try:
+            if login is not None:
+                self.status = self.send(login, path)
+            else:
+                login, path = splitRemote(self.src)
+                self.status = self.receive(login, path)
+        except (OSError, tarfile.TarError) as e:
+            logging.debug(f'{self.src} -> {self.dst} failed: {e}')
+            self.status = False
+        if self.checkpoint is not None:
+            self.checkpoint.close(bool(self.status))
+
+    def isDone(self, src, name):
+        """Return whether the local file {src} was sent as {name} by an
+earlier, interrupted run.
+"""
+        if self.checkpoint is None or not os.path.isfile(src) or \
+                os.path.islink(src):
+            return False
+        st = os.stat(src)
+        return self.checkpoint.isDone(name, st.st_size, st.st_mtime)
+
+    def isReceived(self, name, size, mtime):
+        """Return whether the remote file {name} was received by an
+earlier, interrupted run and is still in place.
+"""
+        if self.checkpoint is None or \
+                not self.checkpoint.isDone(name, size, mtime):
+            return False
+        local = os.path.join(self.dst, name)
+        return os.path.isfile(local) and os.path.getsize(local) == size
+
+    def confirm(self, login, path, entries, ok):
+        """Record the files of {entries} as done. If the stream failed,
+only those already complete in the remote directory {path} are recorded.
+"""
+        if self.checkpoint is None:
+            return
+        arrived = None
+        if not ok:
+            listing = self.listRemote(login, quoteRemote(path)) or list()
+            # tar sets the mtime after the content is complete
+            arrived = set((name, size, int(mtime))
+                          for kind, size, mtime, name in listing
+                          if kind == 'f')
+        for src, name in entries:
+            if not os.path.isfile(src) or os.path.islink(src):
+                continue
+            st = os.stat(src)
+            if arrived is None or \
+                    (name, st.st_size, int(st.st_mtime)) in arrived:
+                self.checkpoint.done(name, st.st_size, st.st_mtime)
+
+    def pump(self, src, dst):
+        """Copy {src} to {dst} until EOF and count the bytes as sent. On
+write errors, {src} is drained so the producer cannot block.
+"""
+        try:
+            while True:
+                data = src.read(65536)
+                if not data:
+                    break
+                self.throttle(len(data))
+                dst.write(data)
+                self.sent += len(data)
+            dst.close()
+        except OSError as e:
+            logging.debug(f'Stream to {self.dst} broken: {e}')
+            while src.read(65536):
+                pass
+
+    def partition(self):
+        """Split the local source into entries worth compressing and plain
+entries, see partition().
+"""
+        return partition(self.src, self.codec, self.threshold)
+
+    def send(self, login, path):
+        """Pack the local source into the remote directory {path}."""
+        packed, plain = self.partition()
+        if self.checkpoint is not None:
+            packed = [e for e in packed if not self.isDone(*e)]
+            plain = [e for e in plain if not self.isDone(*e)]
+        if self.cache is not None:
+            packed, plain, keys = self.restore(login, path, packed, plain)
+        large = list()
+        if self.large > 0:
+            # large files travel in parallel ranges instead
+            large = [(src, name) for src, name in packed + plain
+                     if os.path.isfile(src) and not os.path.islink(src)
+                     and os.path.getsize(src) >= self.large]
+            packed = [e for e in packed if e not in large]
+            plain = [e for e in plain if e not in large]
+        ok = True
+        if len(packed) > 0:
+            ok = self.sendEntries(login, path, packed, self.codec)
+        if len(plain) > 0:
+            ok = self.sendEntries(login, path, plain) and ok
+        for src, name in large:
+            st = os.stat(src)
+            sent = sendFile(self, login, src, f'{path}/{name}', st.st_size,
+                            st.st_mtime, self.streams, self.pooled,
+                            self.checkpoint, name)
+            if sent and self.checkpoint is not None:
+                self.checkpoint.done(name, st.st_size, st.st_mtime)
+            ok = sent and ok
+            self.raw += st.st_size
+        if self.cache is not None and ok:
+            self.remember(login, path, packed + plain + large, keys)
+        return ok
+
+    def restore(self, login, path, packed, plain):
+        """Restore files the device has cached from earlier deliveries.
+Returns the remaining packed and plain entries and the digests of all
+files by name.
+"""
+        known = self.cache.load(login)
+        keys = dict()
+        for src, name in packed + plain:
+            if os.path.isfile(src) and not os.path.islink(src):
+                if self.manifest is not None:
+                    keys[name] = self.manifest.digest(src)
+                else:
+                    keys[name] = digest(src)
+        wanted = [(key, name) for name, key in keys.items()
+                  if key in known and '\n' not in name]
+        if len(wanted) == 0:
+            return packed, plain, keys
+
+        cmd = self.ssh(login, self.cache.restoreCommand(path))
+        logging.debug(' '.join(cmd))
+        p = subprocess.run(cmd, input=lines(wanted), stdout=subprocess.PIPE,
+                           stderr=subprocess.DEVNULL)
+        if p.returncode != 0:
+            return packed, plain, keys
+
+        missing = set(p.stdout.decode().split())
+        restored = set(name for key, name in wanted if key not in missing)
+        for src, name in packed + plain:
+            if name in restored:
+                self.raw += os.path.getsize(src)
+        logging.debug(f'{len(restored)} files restored from cache on {login}')
+        packed = [e for e in packed if e[1] not in restored]
+        plain = [e for e in plain if e[1] not in restored]
+        return packed, plain, keys
+
+    def remember(self, login, path, entries, keys):
+        """Copy the sent files into the device's cache and record all
+delivered digests in its inventory. The inventory is replaced by what the
+device kept after pruning its cache.
+"""
+        sent = [(keys[name], name) for _, name in entries
+                if name in keys and '\n' not in name]
+        if len(sent) > 0:
+            cmd = self.ssh(login, self.cache.storeCommand(path))
+            logging.debug(' '.join(cmd))
+            p = subprocess.run(cmd, input=lines(sent),
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL)
+            if p.returncode == 0:
+                self.cache.save(login, set(p.stdout.decode().split()))
+            return
+        known = self.cache.load(login)
+        self.cache.save(login, known | set(keys.values()))
+
+    def sendEntries(self, login, path, entries, codec='none'):
+        """Send {entries} in one stream compressed with {codec} into the
+remote directory {path}. With verification, files that arrived broken
+are sent once more.
+"""
+        remote = quoteRemote(path)
+        unpack = f'tar -C {remote} -xf -'
+        if self.verify:
+            unpack = integrity.command('unpack', remote)
+        if CODECS.get(codec) is not None:
+            unpack = f'{shlex.join(CODECS[codec][1])} | {unpack}'
+        command = f'mkdir -p {remote} && {unpack}'
+        ok = self.sendStream(login, command, entries, codec)
+        if ok and len(self.broken) > 0:
+            logging.info(f'{len(self.broken)} files arrived broken on '
+                         f'{login}, sending them again')
+            again = [e for e in entries if e[1] in self.broken]
+            ok = self.sendStream(login, command, again, codec) and \
+                len(self.broken) == 0
+        self.confirm(login, path,
+                     [e for e in entries if e[1] not in self.broken], ok)
+        return ok
+
+    def sendStream(self, login, command, entries, codec='none'):
+        """Write {entries} as tar stream into {command} on {login},
+compressed with {codec}. With verification, the names {command} reports
+as broken are kept in {broken}.
+"""
+        frames = self.prepared(entries, codec)
+        if frames is not None:
+            return self.sendPrepared(login, command, entries, frames)
+        cmd = self.ssh(login, command)
+        logging.debug(' '.join(cmd))
+        p = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.DEVNULL)
+        compressor = None
+        if CODECS.get(codec) is None:
+            sink = Meter(p.stdin, self.throttle)
+        else:
+            compressor = subprocess.Popen(
+                CODECS[codec][0], stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE)
+            pumping = threading.Thread(
+                target=self.pump, args=(compressor.stdout, p.stdin))
+            pumping.start()
+            sink = Meter(compressor.stdin)
+
+        out = b''
+        try:
+            if self.verify:
+                integrity.pack(entries, sink)
+            else:
+                with tarfile.open(fileobj=sink, mode='w|') as tar:
+                    for path, arcname in entries:
+                        tar.add(path, arcname=arcname, recursive=False)
+        finally:
+            if compressor is not None:
+                compressor.stdin.close()
+                pumping.join()
+                compressor.wait()
+            else:
+                self.sent += sink.count
+            self.raw += sink.count
+            p.stdin.close()
+            out = p.stdout.read()
+            p.wait()
+        self.broken = [os.fsdecode(name) for name in out.split(b'\0')
+                       if name]
+        return self.exited(p)
+
+    def prepared(self, entries, codec):
+        """Return the prepared frames of all {entries} compressed with
+{codec}, or None unless every one of them is prepared.
+"""
+        if self.artifacts is None or self.artifacts.codec != codec or \
+                CODECS.get(codec) is None:
+            return None
+        # the manifest member needs the digests without reading the files
+        if self.verify and self.manifest is None:
+            return None
+        frames = list()
+        for path, arcname in entries:
+            if not os.path.isfile(path) or os.path.islink(path):
+                return None
+            frame = self.artifacts.lookup(path, arcname)
+            if frame is None:
+                return None
+            frames.append(frame)
+        return frames
+
+    def sendPrepared(self, login, command, entries, frames):
+        """Write the prepared {frames} of {entries} into {command} on
+{login}, followed by a frame with the manifest member when verifying and
+the end of the archive.
+"""
+        tail = b''
+        if self.verify:
+            digests = {arcname: self.manifest.digest(path)
+                       for path, arcname in entries}
+            tail = integrity.trailer(digests)
+        tail = self.artifacts.compress(tail + bytes(2 * tarfile.BLOCKSIZE))
+
+        cmd = self.ssh(login, command)
+        logging.debug(f'{" ".join(cmd)} ({len(frames)} prepared)')
+        p = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.DEVNULL)
+        sink = Meter(p.stdin, self.throttle)
+        out = b''
+        try:
+            for frame in frames:
+                with open(frame, 'rb') as handle:
+                    while True:
+                        data = handle.read(65536)
+                        if not data:
+                            break
+                        sink.write(data)
+            sink.write(tail)
+        except OSError as e:
+            logging.debug(f'Stream to {self.dst} broken: {e}')
+        finally:
+            self.sent += sink.count
+            self.raw += sum(os.path.getsize(path) for path, _ in entries)
+            try:
+                p.stdin.close()
+            except OSError:
+                pass
+            out = p.stdout.read()
+            p.wait()
+        self.broken = [os.fsdecode(name) for name in out.split(b'\0')
+                       if name]
+        return self.exited(p)
+
+    def receive(self, login, path):
+        """Unpack the remote directory {path} into the local destination.
+In snapshot mode, files unchanged since the previous snapshot are
+hardlinked instead of transferred.
+"""
+        os.makedirs(self.dst, exist_ok=True)
+        remote = quoteRemote(path)
+        entries = self.listRemote(login, remote)
+        if entries is None:
+            return False
+
+        reference = None
+        if self.snapshot:
+            reference = latest(os.path.dirname(self.dst), exclude=self.dst)
+
+        # the remote side is split by extension only
+        packed = list()
+        plain = list()
+        large = list()
+        compress = CODECS.get(self.codec) is not None
+        for kind, size, mtime, name in entries:
+            if kind == 'f' and reference is not None and \
+                    linkUnchanged(reference, self.dst, name, size, mtime):
+                continue
+            if kind == 'f' and self.isReceived(name, size, mtime):
+                continue
+            if kind == 'f' and 0 < self.large <= size:
+                large.append((size, mtime, name))
+                continue
+            ext = os.path.splitext(name)[1].lower()
+            if compress and kind == 'f' and ext not in INCOMPRESSIBLE:
+                packed.append(name)
+            else:
+                plain.append(name)
+
+        ok = True
+        if len(packed) > 0:
+            ok = self.receiveEntries(login, path, packed, self.codec)
+        if len(plain) > 0:
+            ok = self.receiveEntries(login, path, plain) and ok
+        for size, mtime, name in large:
+            received = receiveFile(self, login, f'{path}/{name}',
+                                   os.path.join(self.dst, name), size, mtime,
+                                   self.streams, self.pooled,
+                                   self.checkpoint, name)
+            if received and self.checkpoint is not None:
+                self.checkpoint.done(name, size, mtime)
+            if received and self.ingest is not None:
+                self.ingest(os.path.join(self.dst, name))
+            ok = received and ok
+            self.raw += size
+        if len(self.digests) > 0:
+            integrity.record(f'{self.dst}.b2sum', self.digests)
+        return ok
+
+    def receiveEntries(self, login, path, names, codec='none'):
+        """Fetch {names} of the remote directory {path} in one stream
+compressed with {codec}. With verification, files that arrived broken
+are fetched once more.
+"""
+        remote = quoteRemote(path)
+        archive = f'cd {remote} && tar --null --no-recursion -T - -cf -'
+        if self.verify:
+            archive = integrity.command('pack', remote)
+        if CODECS.get(codec) is not None:
+            archive = f'{archive} | {shlex.join(CODECS[codec][0])}'
+        ok = self.receiveStream(login, archive, names, codec)
+        if ok and len(self.broken) > 0:
+            logging.info(f'{len(self.broken)} files from {login} arrived '
+                         f'broken, fetching them again')
+            ok = self.receiveStream(login, archive, self.broken, codec) \
+                and len(self.broken) == 0
+        return ok
+
+    def listRemote(self, login, remote):
+        """Return (type, size, mtime, name) of every entry below the
+quoted {remote} directory or None on failure. Type is 'd' for
+directories, 'f' for regular files and 'l' for symlinks.
+"""
+        listing = "find . -mindepth 1 -printf '%y %s %T@ %P\\0'"
+        cmd = self.ssh(login, f'cd {remote} && {listing}')
+        logging.debug(' '.join(cmd))
+        p = subprocess.run(cmd, stdin=subprocess.DEVNULL,
+                           stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        if not self.exited(p):
+            return None
+
+        entries = list()
+        for line in p.stdout.split(b'\0'):
+            if not line:
+                continue
+            kind, size, mtime, name = line.split(b' ', 3)
+            entries.append((kind.decode(), int(size), float(mtime),
+                            os.fsdecode(name)))
+        return entries
+
+    def receiveStream(self, login, command, names, codec='none'):
+        """Extract the tar stream printed by {command} on {login},
+compressed with {codec}. The {names} to archive are passed to {command}
+on stdin, separated by null bytes. With verification, the names that
+arrived broken are kept in {broken}.
+"""
+        self.broken = list()
+        cmd = self.ssh(login, command)
+        logging.debug(' '.join(cmd))
+        p = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.DEVNULL)
+
+        def feed():
+            try:
+                for name in names:
+                    p.stdin.write(os.fsencode(name) + b'\0')
+                p.stdin.close()
+            except OSError:
+                pass
+
+        feeding = threading.Thread(target=feed)
+        feeding.start()
+
+        decompressor = None
+        if CODECS.get(codec) is None:
+            source = Meter(p.stdout, self.throttle)
+        else:
+            decompressor = subprocess.Popen(
+                CODECS[codec][1], stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE)
+            pumping = threading.Thread(
+                target=self.pump, args=(p.stdout, decompressor.stdin))
+            pumping.start()
+            source = Meter(decompressor.stdout)
+
+        def extracted(member):
+            if self.checkpoint is not None:
+                self.checkpoint.done(member.name, member.size, member.mtime)
+            if self.ingest is not None:
+                self.ingest(os.path.join(self.dst, member.name))
+
+        try:
+            if self.verify:
+                verified, self.broken = integrity.unpack(self.dst, source,
+                                                         extracted)
+                if self.broken is None:
+                    raise tarfile.ReadError('stream ended before manifest')
+                self.digests.update(verified)
+                for name in self.broken:
+                    if self.checkpoint is not None:
+                        self.checkpoint.forget(name)
+            else:
+                with integrity.ReplacingTarFile.open(fileobj=source,
+                                                     mode='r|') as tar:
+                    for member in tar:
+                        tar.extract(member, self.dst, filter='data')
+                        if member.isfile():
+                            extracted(member)
+        except (OSError, tarfile.TarError):
+            if decompressor is not None:
+                decompressor.kill()
+            p.kill()
+            raise
+        finally:
+            if decompressor is not None:
+                pumping.join()
+                decompressor.stdout.close()
+                decompressor.wait()
+            else:
+                self.sent += source.count
+            self.raw += source.count
+            feeding.join()
+            p.stdout.close()
+            p.wait()
+        return self.exited(p)
+
+
+class RsyncWorker(TransferWorker):
+    """Thread to handle delta copy via rsync. Unchanged files are skipped
+by size and mtime, changed files only send the blocks that differ. The
+size of the source files and the literal data actually sent are kept in
+{raw} and {sent}. In {snapshot} mode, unchanged files are hardlinked from
+the previous snapshot next to the local destination. With {resume},
+partially transferred files are kept and continued by the next run.
 """
-    # setup workers
-    worker = list()
-    for device in devices:
-        src = src_lambda(device)
-        dst = dst_lambda(device)
-        worker.append(TransferWorker(src, dst, remote_port))
-
-    # wait and update progress bar
-    num_devices = len(devices)
-    n = num_devices
-    while n > 0 and progress.is_alive():
-        # calculate progress based on number of active workers
-        n = sum(1 if w.is_alive() else 0 for w in worker)
-        progress((num_devices - n) / num_devices)
+
+    # socket, protocol and timeout errors of rsync
+    transient = (10, 12, 30, 35, 255)
+
+    def __init__(self, src, dst, port=22, timeout=3, pool=None,
+                 compress=False, snapshot=False, budget=None, resume=False,
+                 manifest=None):
+        self.compress = compress
+        self.snapshot = snapshot
+        self.resume = resume
+        super().__init__(src, dst, port, timeout, pool, budget, manifest)
+
+    def run(self):
+        """Trigger rsync as subprocess and save success status."""
+        # skip empty directories
+        if self.isEmpty():
+            logging.debug(f'Skipping empty directory {self.src}.')
+            self.status = 1
+            return
+
+        login = splitRemote(self.src)[0] or splitRemote(self.dst)[0]
+        cmd = ['rsync', '-a', '--stats', '-e', shlex.join(self.shell(login))]
+        if self.compress:
+            cmd.append('-z')
+        if self.resume:
+            cmd.append('--partial-dir=.rsync-partial')
+        if self.budget is not None and self.budget.static() > 0:
+            # rsync cannot share the budget, use a fixed KiB/s limit
+            cmd.append(f'--bwlimit={max(1, int(self.budget.static() / 1024))}')
+        if self.snapshot:
+            reference = latest(os.path.dirname(self.dst), exclude=self.dst)
+            if reference is not None:
+                cmd.append(f'--link-dest={os.path.abspath(reference)}')
+        cmd += [f'{self.src}/', f'{self.dst}/']
+        if login == splitRemote(self.src)[0]:
+            os.makedirs(self.dst, exist_ok=True)
+        logging.debug(' '.join(cmd))
+        p = subprocess.run(cmd, stdin=subprocess.DEVNULL,
+                           stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.status = self.exited(p)
+        if self.status:
+            self.raw, self.sent = parseStats(p.stdout.decode())
+
+
+def parseStats(output):
+    """Return the total size of the source files and the literal data
+sent, both in bytes, from the output of rsync --stats.
+"""
+    def value(label):
+        match = re.search(label + r': ([\d,.]+)', output)
+        if match is None:
+            return 0
+        return int(re.sub(r'[,.]', '', match.group(1)))
+
+    return value('Total file size'), value('Literal data')
+
+
+def pipeline(results, src_lambda, dst_lambda, remote_port, progress, total,
+             delay=0.1, pool=None, transport=TransferWorker, limit=0,
+             attempts=1, backoff=1.0, record=None, sizes=None, done=None,
+             traffic=None):
+    """Start a transfer for each device as soon as {results}, an iterable of
+(device, status) pairs, reports it reachable. Source and destination
+folders will be picked based on the actual device using {src_lambda} and
+{dst_lambda}. {total} is the number of devices {results} will report.
+SSH sessions are shared through the connection {pool}, if given.
+{transport} creates the workers, e.g. TransferWorker or TarWorker.
+
+At most {limit} transfers run at once, 0 means no limit. A transfer that
+failed due to a connection problem is started again up to {attempts}
+times in total, waiting {backoff} seconds doubled after every try. The
+final status of each device is stored into the dict {record}, if given,
+None for missing devices. Waiting devices with the largest payload in the
+dict {sizes} start first, so no large transfer is left for the end.
+{done}, if given, is called with each device and its worker once the
+transfer finished for good. The bytes before and after compression of
+each device are stored as pair into the dict {traffic}, if given.
+Returns lists of available and missing devices.
+"""
+    if sizes is None:
+        sizes = dict()
+    queue = list()
+    available = list()
+    missing = list()
+    lock = threading.Lock()
+
+    def feed():
+        for device, status in results:
+            with lock:
+                if status:
+                    queue.append((0, device))
+                    available.append(device)
+                else:
+                    missing.append(device)
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+
+    running = dict()
+    finished = dict()
+    tries = dict()
+    while True:
+        feeding = feeder.is_alive()
+        now = time.monotonic()
+
+        # collect finished transfers and schedule retries
+        for device, w in list(running.items()):
+            if w.is_alive():
+                continue
+            del running[device]
+            if w.isTransient() and tries[device] < attempts:
+                wait = backoff * 2 ** (tries[device] - 1)
+                logging.debug(f'Retrying device {device} in {wait}s '
+                              f'(exit status {w.code})')
+                with lock:
+                    queue.append((now + wait, device))
+            else:
+                finished[device] = w
+                if done is not None:
+                    done(device, w)
+
+        # start due transfers up to the limit, largest first
+        with lock:
+            for entry in sorted(queue, key=lambda e: -sizes.get(e[1], 0)):
+                if limit > 0 and len(running) >= limit:
+                    break
+                due, device = entry
+                if due > now:
+                    continue
+                queue.remove(entry)
+                tries[device] = tries.get(device, 0) + 1
+                running[device] = transport(
+                    src_lambda(device), dst_lambda(device), remote_port,
+                    pool=pool)
+            waiting = len(queue)
+
+        # calculate progress based on finished workers and missing devices
+        if progress.is_alive():
+            progress((len(finished) + len(missing)) / max(total, 1))
+        if not feeding and len(running) == 0 and waiting == 0:
+            break
         time.sleep(delay)
     progress.finish()
 
     # count successes and failures
-    successes = 0
     failures = 0
-    for w in worker:
-        w.join()
-        if w.status:
-            successes += 1
-        else:
+    if record is not None:
+        record.update(dict.fromkeys(missing))
+    for device, w in finished.items():
+        if not w.status:
             failures += 1
+        if record is not None:
+            record[device] = bool(w.status)
+        if w.raw > 0 and traffic is not None:
+            traffic[device] = (w.raw, w.sent)
 
     if failures > 0:
         raise SystemExit(
-            f'{failures} von {num_devices} Übertragungen sind fehlgeschlagen.')
\ No newline at end of file
+            f'{failures} von {len(finished)} Übertragungen sind '
+            'fehlgeschlagen. Mit --retry-failed werden sie wiederholt.')
+
+    return available, missing
+
+
+def budgetFor(settings):
+    """Return the bandwidth budget shared by all transfers of a run or
+None if unlimited."""
+    if settings.bandwidth <= 0 and settings.device_bandwidth <= 0:
+        return None
+    slots = settings.max_workers
+    if slots <= 0:
+        slots = settings.num_clients
+    # settings are in Mbit/s, the budget counts bytes
+    return Budget(settings.bandwidth * 125000,
+                  settings.device_bandwidth * 125000, slots)
+
+
+def journalFor(settings):
+    """Return the journal of interrupted transfers or None if resuming is
+disabled."""
+    if not settings.resume:
+        return None
+    return Journal(settings.getStatePath('journal'))
+
+
+def artifactsFor(settings):
+    """Return the cache of members prepared by sync.py --watch for the
+configured codec, or None without compression."""
+    if CODECS.get(settings.codec) is None or settings.prepared_size <= 0:
+        return None
+    return Artifacts(settings.getStatePath('prepared'), settings.codec,
+                     settings.prepared_size << 20)
+
+
+def transportFor(settings, budget=None, ingest=None, manifest=None):
+    """Return the worker class for the configured transfer mode. All its
+workers share the {budget}, by default a new one from the settings, and
+the {manifest} of the local sources. In tar mode, received files are
+passed to {ingest} as they arrive, see TarWorker."""
+    if budget is None:
+        budget = budgetFor(settings)
+    if settings.transfer_mode == 'scp':
+        return functools.partial(TransferWorker, budget=budget,
+                                 manifest=manifest)
+    elif settings.transfer_mode == 'tar':
+        cache = None
+        if settings.cache:
+            cache = ContentCache(settings.getStatePath('cache'),
+                                 settings.getCacheDir(),
+                                 settings.cache_size << 20)
+        return functools.partial(TarWorker, codec=settings.codec,
+                                 threshold=settings.compress_threshold,
+                                 snapshot=settings.snapshots, cache=cache,
+                                 budget=budget,
+                                 large=settings.chunk_threshold << 20,
+                                 streams=settings.chunk_streams,
+                                 pooled=settings.chunk_pooled,
+                                 journal=journalFor(settings),
+                                 verify=settings.verify,
+                                 ingest=ingest, manifest=manifest,
+                                 artifacts=artifactsFor(settings))
+    elif settings.transfer_mode == 'rsync':
+        return functools.partial(RsyncWorker,
+                                 compress=settings.codec != 'none',
+                                 snapshot=settings.snapshots, budget=budget,
+                                 resume=settings.resume, manifest=manifest)
+    raise ValueError(f'unknown transfer mode {settings.transfer_mode}')
+
+
+def batch(devices, src_lambda, dst_lambda, remote_port, progress, delay=0.1,
+          pool=None, transport=TransferWorker, limit=0, attempts=1,
+          backoff=1.0, record=None, sizes=None):
+    """Batch transfer for {devices}. Source and destination folders will
+be picked based on the actual device using {src_lambda} and {dst_lambda}.
+"""
+    results = ((device, True) for device in devices)
+    pipeline(results, src_lambda, dst_lambda, remote_port, progress,
+             len(devices), delay, pool, transport, limit, attempts, backoff,
+             record, sizes)
@@ -0,0 +1,130 @@
+#!/usr/bin/python3
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import pathlib
+import queue
+import shutil
+import tempfile
+import threading
+
+
+AT_FDCWD = -100
+RENAME_EXCHANGE = 2
+
+
+def exchange(a, b):
+    """Swap the paths {a} and {b} atomically with renameat2(2). Raises
+OSError if the kernel or the file system does not support it.
+"""
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    if not hasattr(libc, 'renameat2'):
+        raise OSError(38, 'renameat2 not available')
+    result = libc.renameat2(AT_FDCWD, os.fsencode(a), AT_FDCWD,
+                            os.fsencode(b), RENAME_EXCHANGE)
+    if result != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno), str(a))
+
+
+class Trash(threading.Thread):
+    """Empties folders without waiting for their contents to be deleted.
+discard() swaps a folder for a fresh empty one and moves the old one into
+a trash folder from {bins} on the same file system, where {workers}
+threads delete it in the background. Anything left in the bins by an
+interrupted run is deleted as well. Folders watched with inotify, like
+the roots of prepare.Watcher, are discarded {inplace}, since a watch
+follows the old folder into the trash.
+
+trash = Trash([settings.share.parent / '.lan_share_trash'])
+trash.discard(settings.getShareDir(0))
+trash.close()
+"""
+
+    def __init__(self, bins, workers=2):
+        super().__init__()
+        self.bins = [pathlib.Path(b) for b in bins]
+        self.queue = queue.Queue()
+        self.workers = workers
+        for b in self.bins:
+            b.mkdir(parents=True, exist_ok=True)
+            # leftovers of an interrupted run
+            for leftover in b.iterdir():
+                self.queue.put(leftover)
+        self.start()
+
+    def binFor(self, directory):
+        """Return the bin on the file system of {directory} or None."""
+        device = os.stat(directory).st_dev
+        for b in self.bins:
+            if os.stat(b).st_dev == device:
+                return b
+        return None
+
+    def discard(self, directory, inplace=False):
+        """Leave {directory} empty at once and delete its old contents in
+the background. If {inplace}, the folder itself is kept and only its
+entries are moved away.
+"""
+        directory = pathlib.Path(directory)
+        if not directory.is_dir():
+            return
+        b = self.binFor(directory)
+        if b is None:
+            logging.debug(f'No trash next to {directory}, deleting in place')
+            for entry in directory.iterdir():
+                delete(entry)
+            return
+        mode = directory.stat().st_mode & 0o7777
+        old = pathlib.Path(tempfile.mkdtemp(dir=b, prefix=directory.name))
+        if inplace:
+            for entry in directory.iterdir():
+                os.rename(entry, old / entry.name)
+            logging.debug(f'Moved the contents of {directory} to {old}')
+            self.queue.put(old)
+            return
+        try:
+            exchange(old, directory)
+        except OSError as e:
+            # not atomic, the folder is missing for a moment
+            logging.debug(f'Cannot swap {directory}: {e}')
+            old.rmdir()
+            os.rename(directory, old)
+            directory.mkdir()
+        directory.chmod(mode)
+        logging.debug(f'Moved {directory} to {old}')
+        self.queue.put(old)
+
+    def run(self):
+        threads = [threading.Thread(target=self.work)
+                   for _ in range(self.workers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    def work(self):
+        while True:
+            path = self.queue.get()
+            if path is None:
+                # wake up the next worker
+                self.queue.put(None)
+                return
+            delete(path)
+
+    def close(self):
+        """Let the workers finish the queued folders and stop."""
+        self.queue.put(None)
+
+
+def delete(path):
+    """Delete the file or folder {path}, ignoring errors."""
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass